@@ -1,61 +1,244 @@
 # stdlib
-import json
+import os
+import time
 
 # flask
-from flask import Flask, jsonify, request
-
-# deps
-from web3 import Web3
+from flask import Flask, Response, g, request, stream_with_context
 
 # local
+from src.call_cache import parse_block
+from src.encoding import JSON_MIMETYPE, dumps
 from src.exceptions import ProductDoesNotExists
+from src.metrics import CONTENT_TYPE, http_latency, registry
 from src.products import (
     accept_product,
     create_product,
     delegate_product,
+    get_delegated_products_by_owner,
     get_product,
     get_product_by_name,
-    get_products,
+    get_products_by_new_owner,
+    get_products_by_status,
+    get_products_page,
+    iter_products,
+    resolve_block,
+    start_fee_tracker,
+    start_product_index,
+    state_version,
 )
+from src.submitter import tx_submitter
+
 
+NDJSON = "application/x-ndjson"
+MAX_PAGE_SIZE = 1000
+INVALID_BLOCK = {"error": "block must be a block number or a block hash."}
 
 app = Flask(__name__)
 
+if os.getenv("PRODUCT_INDEX") == "1":
+    start_product_index()
+if os.getenv("FEE_TRACKER") == "1":
+    start_fee_tracker()
+if os.getenv("TX_SUBMITTER") == "1":
+    tx_submitter.start()
+
+
+@app.before_request
+def start_timer():
+    g.started = time.monotonic()
+
+
+@app.after_request
+def record_latency(response):
+    # the route template, not the path, so there is one series per route
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    http_latency.observe(
+        time.monotonic() - g.started, route, request.method, str(response.status_code)
+    )
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def get_block():
+    """Reads the block to pin the reads to from the ``block`` query parameter, a block number or
+    a block hash.
+
+    :return: the block requested, None if missing or invalid
+    :rtype: int or str
+    """
+    block = request.args.get("block")
+    return None if block is None else parse_block(block)
+
+
+def invalid_block():
+    return "block" in request.args and get_block() is None
+
+
+def not_modified(etag):
+    """Returns a 304 response if the client already has the representation tagged ``etag``.
+
+    :param etag: tag of the current state of the resource
+    :type etag: str
+    :rtype: flask.Response
+    """
+    if etag not in request.if_none_match:
+        return None
+    return tagged(Response(status=304), etag)
+
+
+def json_response(body):
+    """Serializes the body with the fast encoder, products without converting them to dicts.
+
+    :rtype: flask.Response
+    """
+    return Response(dumps(body), mimetype=JSON_MIMETYPE)
+
+
+def tagged(response, etag):
+    """Tags the response so the clients poll it with ``If-None-Match`` and revalidate it on every
+    request.
+    """
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
 
 @app.route("/")
 def products():
-    products = get_products()
-    return jsonify({"products": products})
+    cursor = request.args.get("cursor", type=int)
+    limit = request.args.get("limit", type=int)
+    # flask answers None for the values that aren't integers
+    if ("cursor" in request.args and (cursor is None or cursor < 0)) or (
+        "limit" in request.args and (limit is None or limit <= 0)
+    ):
+        return {"error": "cursor and limit must be positive integers."}
+    cursor = cursor or 0
+    if invalid_block():
+        return INVALID_BLOCK
+    # resolved once, the tag and the reads are of the same block
+    block = resolve_block(get_block())
+    if limit is not None:
+        limit = min(limit, MAX_PAGE_SIZE)
+
+    stream = request.args.get("stream") == "1" or request.accept_mimetypes.best == NDJSON
+    etag = state_version(block) + ("-ndjson" if stream else "")
+    response = not_modified(etag)
+    if response is None and stream:
+
+        def products_stream():
+            for _, product in iter_products(cursor, limit, block=block):
+                yield product.to_json() + "\n"
+
+        response = Response(stream_with_context(products_stream()), mimetype=NDJSON)
+    elif response is None and ("cursor" in request.args or limit is not None):
+        response = json_response(get_products_page(cursor, limit or MAX_PAGE_SIZE, block=block))
+    elif response is None:
+        products = [product for _, product in iter_products(block=block)]
+        response = json_response({"products": products})
+    response.vary.add("Accept")
+    return tagged(response, etag)
 
 
 @app.route("/product/<int:prod_id>")
 def product(prod_id):
+    if invalid_block():
+        return INVALID_BLOCK
+    block = resolve_block(get_block())
+    etag = state_version(block)
+    response = not_modified(etag)
+    if response is not None:
+        return response
     try:
-        product = get_product(prod_id)
+        product = get_product(prod_id, block=block)
     except ProductDoesNotExists:
         return {"error": f"Product {prod_id} does not exists."}
-    return jsonify({"product": product.to_dict()})
+    return tagged(json_response({"product": product}), etag)
 
 
 @app.route("/product/<prod_name>")
 def find(prod_name):
-    product = get_product_by_name(prod_name)
-    return jsonify({"product": product})
+    if invalid_block():
+        return INVALID_BLOCK
+    block = resolve_block(get_block())
+    etag = state_version(block)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    product = get_product_by_name(prod_name, block=block)
+    return tagged(json_response({"product": product}), etag)
+
+
+@app.route("/products")
+def products_by_status():
+    status = request.args.get("status", type=int)
+    if status is None:
+        return {"error": "A status must be provided."}
+    if invalid_block():
+        return INVALID_BLOCK
+    return json_response({"products": get_products_by_status(status, block=get_block())})
+
+
+@app.route("/owner/<addr>/products")
+def owner_products(addr):
+    if invalid_block():
+        return INVALID_BLOCK
+    block = get_block()
+    return json_response(
+        {
+            "products": get_delegated_products_by_owner(addr, block=block),
+            "pending": get_products_by_new_owner(addr, block=block),
+        }
+    )
+
+
+def queued(job):
+    """Answers a write with its queued job, to poll on ``/tx/<job id>``.
+
+    :param job: queued transaction
+    :type job: src.submitter.Job
+    :rtype: flask.Response
+    """
+    response = json_response(job.to_dict())
+    response.status_code = 202
+    response.headers["Location"] = f"/tx/{job.id}"
+    return response
 
 
 @app.route("/product/", methods=["POST"])
 def add():
+    if tx_submitter.running:
+        return queued(tx_submitter.create_product(request.form["name"], request.form["address"]))
     product = create_product(request.form["name"], request.form["address"])
-    return jsonify({"transaction_hash": json.loads(Web3.toJSON(product))})
+    return json_response({"transaction_hash": product})
 
 
 @app.route("/product/<int:prod_id>/delegate/", methods=["POST"])
 def delegate(prod_id):
+    if tx_submitter.running:
+        return queued(
+            tx_submitter.delegate_product(
+                prod_id, request.form["address"], request.form["new_address"]
+            )
+        )
     product = delegate_product(prod_id, request.form["address"], request.form["new_address"])
-    return jsonify({"transaction_hash": json.loads(Web3.toJSON(product))})
+    return json_response({"transaction_hash": product})
 
 
 @app.route("/product/<int:prod_id>/accept/", methods=["POST"])
 def accept(prod_id):
+    if tx_submitter.running:
+        return queued(tx_submitter.accept_product(prod_id, request.form["address"]))
     product = accept_product(prod_id, request.form["address"])
-    return jsonify({"transaction_hash": json.loads(Web3.toJSON(product))})
+    return json_response({"transaction_hash": product})
+
+
+@app.route("/tx/<key>")
+def transaction_status(key):
+    job = tx_submitter.get(key)
+    if job is None:
+        return {"error": f"Transaction {key} not found."}
+    return json_response(job.to_dict())
@@ -0,0 +1,292 @@
+# stdlib
+import os
+import time
+
+# deps
+from aiohttp import web
+
+# local
+from src.async_connection import close_client_session
+from src.async_products import (
+    accept_product,
+    create_product,
+    delegate_product,
+    get_delegated_products_by_owner,
+    get_product,
+    get_product_by_name,
+    get_products_by_new_owner,
+    get_products_by_status,
+    get_products_page,
+    iter_products,
+    resolve_block,
+    state_version,
+)
+from src.call_cache import parse_block
+from src.encoding import JSON_MIMETYPE, dumps
+from src.exceptions import ProductDoesNotExists
+from src.metrics import http_latency, registry
+from src.products import start_fee_tracker, start_product_index
+from src.submitter import tx_submitter
+
+
+NDJSON = "application/x-ndjson"
+MAX_PAGE_SIZE = 1000
+INVALID_BLOCK = {"error": "block must be a block number or a block hash."}
+INVALID_PAGE = {"error": "cursor and limit must be positive integers."}
+
+routes = web.RouteTableDef()
+
+
+class InvalidParameter(Exception):
+    pass
+
+
+def int_param(request, name, default=None):
+    if name not in request.query:
+        return default
+    try:
+        return int(request.query[name])
+    except ValueError:
+        raise InvalidParameter(name)
+
+
+def get_block(request):
+    """Reads the block to pin the reads to from the ``block`` query parameter.
+
+    :return: the block requested, None if missing
+    :rtype: int or str
+    """
+    if "block" not in request.query:
+        return None
+    block = parse_block(request.query["block"])
+    if block is None:
+        raise InvalidParameter("block")
+    return block
+
+
+def not_modified(request, etag):
+    """Returns a 304 response if the client already has the representation tagged ``etag``.
+
+    :rtype: aiohttp.web.Response
+    """
+    if_none_match = request.if_none_match or ()
+    if not any(tag.value in (etag, "*") for tag in if_none_match):
+        return None
+    return tagged(web.Response(status=304), etag)
+
+
+def tagged(response, etag):
+    response.etag = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@web.middleware
+async def record_latency(request, handler):
+    started = time.monotonic()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        # the route template, not the path, so there is one series per route
+        route = resource.canonical if resource is not None else "unmatched"
+        http_latency.observe(time.monotonic() - started, route, request.method, str(status))
+
+
+def json_response(body):
+    """Serializes the body with the fast encoder, products without converting them to dicts.
+
+    :rtype: aiohttp.web.Response
+    """
+    return web.Response(text=dumps(body), content_type=JSON_MIMETYPE)
+
+
+def transaction_response(result):
+    return json_response({"transaction_hash": result})
+
+
+def queued(job):
+    """Answers a write with its queued job, to poll on ``/tx/{job id}``.
+
+    :param job: queued transaction
+    :type job: src.submitter.Job
+    :rtype: aiohttp.web.Response
+    """
+    response = json_response(job.to_dict())
+    response.set_status(202)
+    response.headers["Location"] = f"/tx/{job.id}"
+    return response
+
+
+@routes.get("/")
+async def products(request):
+    try:
+        cursor = int_param(request, "cursor", 0)
+        limit = int_param(request, "limit")
+    except InvalidParameter:
+        return web.json_response(INVALID_PAGE)
+    if cursor < 0 or (limit is not None and limit <= 0):
+        return web.json_response(INVALID_PAGE)
+    try:
+        block = get_block(request)
+    except InvalidParameter:
+        return web.json_response(INVALID_BLOCK)
+    # resolved once, the tag and the reads are of the same block
+    block = await resolve_block(block)
+    if limit is not None:
+        limit = min(limit, MAX_PAGE_SIZE)
+
+    stream = request.query.get("stream") == "1" or request.headers.get("Accept") == NDJSON
+    etag = await state_version(block) + ("-ndjson" if stream else "")
+    response = not_modified(request, etag)
+    if response is None and stream:
+        response = tagged(web.StreamResponse(headers={"Content-Type": NDJSON}), etag)
+        response.headers["Vary"] = "Accept"
+        await response.prepare(request)
+        async for _, product in iter_products(cursor, limit, block):
+            await response.write((product.to_json() + "\n").encode())
+        await response.write_eof()
+        return response
+    if response is None and ("cursor" in request.query or limit is not None):
+        response = json_response(
+            await get_products_page(cursor, limit or MAX_PAGE_SIZE, block=block)
+        )
+    elif response is None:
+        products = [product async for _, product in iter_products(block=block)]
+        response = json_response({"products": products})
+    response.headers["Vary"] = "Accept"
+    return tagged(response, etag)
+
+
+@routes.get(r"/product/{prod_id:\d+}")
+async def product(request):
+    prod_id = int(request.match_info["prod_id"])
+    try:
+        block = get_block(request)
+    except InvalidParameter:
+        return web.json_response(INVALID_BLOCK)
+    block = await resolve_block(block)
+    etag = await state_version(block)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    try:
+        product = await get_product(prod_id, block=block)
+    except ProductDoesNotExists:
+        return web.json_response({"error": f"Product {prod_id} does not exists."})
+    return tagged(json_response({"product": product}), etag)
+
+
+@routes.get("/product/{prod_name}")
+async def find(request):
+    try:
+        block = get_block(request)
+    except InvalidParameter:
+        return web.json_response(INVALID_BLOCK)
+    block = await resolve_block(block)
+    etag = await state_version(block)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    product = await get_product_by_name(request.match_info["prod_name"], block=block)
+    return tagged(json_response({"product": product}), etag)
+
+
+@routes.get("/products")
+async def products_by_status(request):
+    try:
+        status = int_param(request, "status")
+    except InvalidParameter:
+        status = None
+    if status is None:
+        return web.json_response({"error": "A status must be provided."})
+    try:
+        block = get_block(request)
+    except InvalidParameter:
+        return web.json_response(INVALID_BLOCK)
+    return json_response({"products": await get_products_by_status(status, block=block)})
+
+
+@routes.get("/owner/{addr}/products")
+async def owner_products(request):
+    addr = request.match_info["addr"]
+    try:
+        block = get_block(request)
+    except InvalidParameter:
+        return web.json_response(INVALID_BLOCK)
+    return json_response(
+        {
+            "products": await get_delegated_products_by_owner(addr, block=block),
+            "pending": await get_products_by_new_owner(addr, block=block),
+        }
+    )
+
+
+@routes.get("/metrics")
+async def metrics(request):
+    # aiohttp doesn't accept the version parameter of the prometheus content type
+    return web.Response(text=registry.render(), content_type="text/plain")
+
+
+@routes.post("/product/")
+async def add(request):
+    form = await request.post()
+    if tx_submitter.running:
+        return queued(tx_submitter.create_product(form["name"], form["address"]))
+    return transaction_response(await create_product(form["name"], form["address"]))
+
+
+@routes.post(r"/product/{prod_id:\d+}/delegate/")
+async def delegate(request):
+    form = await request.post()
+    prod_id = int(request.match_info["prod_id"])
+    if tx_submitter.running:
+        return queued(tx_submitter.delegate_product(prod_id, form["address"], form["new_address"]))
+    return transaction_response(
+        await delegate_product(prod_id, form["address"], form["new_address"])
+    )
+
+
+@routes.post(r"/product/{prod_id:\d+}/accept/")
+async def accept(request):
+    form = await request.post()
+    prod_id = int(request.match_info["prod_id"])
+    if tx_submitter.running:
+        return queued(tx_submitter.accept_product(prod_id, form["address"]))
+    return transaction_response(await accept_product(prod_id, form["address"]))
+
+
+@routes.get("/tx/{key}")
+async def transaction_status(request):
+    key = request.match_info["key"]
+    job = tx_submitter.get(key)
+    if job is None:
+        return web.json_response({"error": f"Transaction {key} not found."})
+    return json_response(job.to_dict())
+
+
+async def on_cleanup(app):
+    await close_client_session()
+
+
+def init_app(argv=None):
+    """Builds the async api, served with ``python -m aiohttp.web async_app:init_app``.
+
+    :rtype: aiohttp.web.Application
+    """
+    app = web.Application(middlewares=[record_latency])
+    app.add_routes(routes)
+    app.on_cleanup.append(on_cleanup)
+    if os.getenv("PRODUCT_INDEX") == "1":
+        start_product_index()
+    if os.getenv("FEE_TRACKER") == "1":
+        start_fee_tracker()
+    if os.getenv("TX_SUBMITTER") == "1":
+        tx_submitter.start()
+    return app
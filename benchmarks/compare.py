@@ -0,0 +1,34 @@
+"""Compares the medians of two benchmark result files.
+
+    python -m benchmarks.compare benchmarks/results/<before>.json benchmarks/results/<after>.json
+"""
+# stdlib
+import argparse
+import json
+
+
+def load(path):
+    with open(path) as results_file:
+        report = json.load(results_file)
+    return report, {(r["name"], r["size"]): r for r in report["results"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args(argv)
+
+    before_report, before = load(args.before)
+    after_report, after = load(args.after)
+    print(f"{before_report['commit'] or args.before} -> {after_report['commit'] or args.after}")
+    for key in sorted(before.keys() & after.keys(), key=lambda key: (key[1], key[0])):
+        old, new = before[key]["median"], after[key]["median"]
+        change = (new - old) / old * 100 if old else 0
+        print(
+            f"{key[0]:<40} {key[1]:>6} {old * 1000:>10.2f} ms {new * 1000:>10.2f} ms {change:+7.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
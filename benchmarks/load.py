@@ -0,0 +1,154 @@
+"""Load generator driving the api and the signer service, reporting the latency percentiles and
+the throughput of each scenario.
+
+    python -m benchmarks.load --scenarios products product sign --concurrency 16 --duration 30
+
+Run it against the api and the signer pointed at ``benchmarks.rpc_server`` to see the round-trip
+costs of a remote provider.
+"""
+# stdlib
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import threading
+import time
+from datetime import datetime, timezone
+
+# local
+from benchmarks.run import git_commit
+from src.sessions import build_session
+
+
+SIGN_BATCH_SIZE = 10
+
+
+def sign_tx():
+    return {
+        "to": os.getenv("CONTRACT_ADDR", "0x%040d" % 1),
+        "data": "0x",
+        "value": 0,
+        "gas": 210000,
+        "gasPrice": 1000000000,
+        "nonce": random.randrange(1000),
+        "chainId": 61,
+    }
+
+
+# scenario -> service, HTTP method, path and json body of each request
+SCENARIOS = {
+    "products": lambda args: ("api", "GET", "/", None),
+    "page": lambda args: ("api", "GET", "/?limit=100", None),
+    "product": lambda args: ("api", "GET", f"/product/{random.randrange(args.products)}", None),
+    "status": lambda args: ("api", "GET", "/products?status=0", None),
+    "sign": lambda args: ("signer", "GET", "/", sign_tx()),
+    "sign-batch": lambda args: (
+        "signer",
+        "POST",
+        "/batch",
+        [sign_tx() for _ in range(SIGN_BATCH_SIZE)],
+    ),
+}
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def run_scenario(name, args):
+    """Sends the requests of a scenario from ``args.concurrency`` threads for ``args.duration``
+    seconds or until ``args.requests`` requests are sent.
+
+    :rtype: dict
+    """
+    urls = {"api": args.api.rstrip("/"), "signer": args.signer.rstrip("/")}
+    # failed requests are measured, not retried
+    session = build_session(pool_size=args.concurrency, retries=0)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    sent = iter(range(args.requests)) if args.requests else None
+
+    def worker():
+        while time.monotonic() < deadline and (sent is None or next(sent, None) is not None):
+            service, method, path, body = SCENARIOS[name](args)
+            started = time.perf_counter()
+            try:
+                response = session.request(
+                    method, urls[service] + path, json=body, timeout=args.timeout
+                )
+                ok = response.status_code == 200 and "error" not in response.json()
+            except Exception:
+                ok = False
+            latency = time.perf_counter() - started
+            with lock:
+                (latencies if ok else errors).append(latency)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "name": name,
+        "concurrency": args.concurrency,
+        "requests": len(latencies) + len(errors),
+        "errors": len(errors),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": statistics.mean(latencies) if latencies else None,
+        "throughput": len(latencies) / elapsed,
+    }
+    print(
+        f"{name:<12} {result['requests']:>7} req {result['errors']:>5} err"
+        + "".join(
+            f" {key} {result[key] * 1000:>9.1f} ms" if result[key] is not None else f" {key} -"
+            for key in ("p50", "p95", "p99")
+        )
+        + f" {result['throughput']:>8.1f} req/s"
+    )
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--api", default="http://127.0.0.1:5000")
+    parser.add_argument("--signer", default="http://127.0.0.1:5001")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--requests", type=int, help="max requests per scenario")
+    parser.add_argument("--products", type=int, default=100, help="ids requested by product")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "results": [run_scenario(name, args) for name in args.scenarios],
+    }
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
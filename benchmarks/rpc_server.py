@@ -0,0 +1,253 @@
+"""Local JSON-RPC stand-in for the remote provider, serving an eth-tester chain with the product
+contract deployed, with the round-trip latency, rate limits and errors of a remote endpoint.
+
+    python -m benchmarks.rpc_server --products 100 --latency 0.1 --jitter 0.05 --rate-limit 25
+
+Point the api and the signer at it with the ``PROVIDER``, ``CONTRACT_ADDR``,
+``CONTRACT_CREATED_BLOCK`` and ``KEY`` values printed on startup.
+"""
+# stdlib
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# deps
+from eth_tester.exceptions import TransactionFailed, ValidationError
+from web3 import Web3
+from web3._utils.encoding import Web3JsonEncoder
+
+# local
+from benchmarks.run import Chain
+from src.tests.fixtures import funded_account
+
+
+# calls answered from the state, without side effects
+CACHED_METHODS = ("eth_call", "eth_estimateGas")
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` calls per second, with bursts of up to ``burst`` calls."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, calls=1):
+        """Takes ``calls`` tokens if there are enough of them.
+
+        :rtype: bool
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < calls:
+                return False
+            self._tokens -= calls
+            return True
+
+
+def to_quantities(value):
+    """Encodes the integers of an eth-tester result as hex quantities, as a node does."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return hex(value)
+    if isinstance(value, dict):
+        return {key: to_quantities(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_quantities(item) for item in value]
+    return value
+
+
+def rpc_error(code, message):
+    return {"code": code, "message": message}
+
+
+class StandIn:
+    """Answers JSON-RPC payloads from the chain, after waiting the configured latency."""
+
+    def __init__(
+        self,
+        chain,
+        latency=0,
+        jitter=0,
+        rate_limit=None,
+        burst=None,
+        batch=True,
+        max_batch_size=None,
+        error_rate=0,
+    ):
+        """
+        :param chain: seeded chain
+        :type chain: benchmarks.run.Chain
+        :param latency: seconds each request waits before being answered
+        :type latency: float
+        :param jitter: max seconds randomly added to the latency
+        :type jitter: float
+        :param rate_limit: calls per second above which the requests are answered with a 429,
+            unlimited by default. The calls of a batch count one by one.
+        :type rate_limit: float
+        :param burst: calls allowed at once within the rate limit
+        :type burst: int
+        :param batch: answer batch requests, otherwise they get a single error response
+        :type batch: bool
+        :param max_batch_size: max amount of calls per batch request
+        :type max_batch_size: int
+        :param error_rate: fraction of the calls answered with an internal error
+        :type error_rate: float
+        """
+        self.chain = chain
+        # web3 without its result formatters, so the results keep the json-rpc format
+        self.raw_w3 = Web3(chain.w3.provider, middlewares=[])
+        self.latency = latency
+        self.jitter = jitter
+        self.limiter = RateLimiter(rate_limit, burst) if rate_limit else None
+        self.batch = batch
+        self.max_batch_size = max_batch_size
+        self.error_rate = error_rate
+        # eth-tester isn't thread safe, the requests only wait concurrently
+        self._lock = threading.Lock()
+        # eth-tester takes tens of milliseconds per call, far more than a node, so the calls are
+        # answered once per chain state
+        self._answers = {}
+
+    def _execute(self, method, params):
+        """Runs a call on the chain.
+
+        :return: the result or the error of the call
+        :rtype: dict
+        """
+        try:
+            response = self.raw_w3.manager._make_request(method, params)
+        except TransactionFailed as e:
+            return {"error": rpc_error(3, str(e))}
+        except (ValidationError, ValueError, TypeError) as e:
+            return {"error": rpc_error(-32000, str(e))}
+        if "error" in response:
+            code = -32601 if "Unknown RPC Endpoint" in str(response["error"]) else -32000
+            return {"error": rpc_error(code, str(response["error"]))}
+        return {"result": to_quantities(response["result"])}
+
+    def _answer(self, method, params):
+        with self._lock:
+            if method.startswith("eth_send"):
+                self._answers.clear()
+            if method not in CACHED_METHODS:
+                return self._execute(method, params)
+            key = (method, json.dumps(params, sort_keys=True))
+            if key not in self._answers:
+                self._answers[key] = self._execute(method, params)
+            return self._answers[key]
+
+    def call(self, request):
+        if not isinstance(request, dict) or "method" not in request:
+            return {"jsonrpc": "2.0", "id": None, "error": rpc_error(-32600, "Invalid request")}
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        if self.error_rate and random.random() < self.error_rate:
+            response["error"] = rpc_error(-32603, "Internal error")
+        else:
+            response.update(self._answer(request["method"], request.get("params", [])))
+        return response
+
+    def handle(self, payload):
+        """Answers a request or a batch of requests.
+
+        :param payload: decoded request body
+        :type payload: dict or list
+        :return: HTTP status and response body
+        :rtype: tuple[int, dict or list]
+        """
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        is_batch = isinstance(payload, list)
+        if is_batch and not self.batch:
+            return 200, {"jsonrpc": "2.0", "id": None, "error": rpc_error(-32600, "No batches")}
+        if is_batch and self.max_batch_size and len(payload) > self.max_batch_size:
+            message = f"Batch size limit exceeded, {self.max_batch_size} calls per batch"
+            return 200, {"jsonrpc": "2.0", "id": None, "error": rpc_error(-32600, message)}
+        if self.limiter is not None and not self.limiter.acquire(len(payload) if is_batch else 1):
+            return 429, {"jsonrpc": "2.0", "id": None, "error": rpc_error(-32005, "Rate limited")}
+        if is_batch:
+            return 200, [self.call(request) for request in payload]
+        return 200, self.call(payload)
+
+
+class RPCHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            status, response = 200, {"jsonrpc": "2.0", "id": None, "error": rpc_error(-32700, "")}
+        else:
+            status, response = self.server.stand_in.handle(payload)
+        data = json.dumps(response, cls=Web3JsonEncoder).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(stand_in, host="127.0.0.1", port=8545):
+    """Serves the stand-in in a daemon thread.
+
+    :rtype: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), RPCHandler)
+    server.stand_in = stand_in
+    thread = threading.Thread(target=server.serve_forever, name="rpc", daemon=True)
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8545)
+    parser.add_argument("--products", type=int, default=100, help="products to seed")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.05, help="max seconds added")
+    parser.add_argument("--rate-limit", type=float, help="calls per second")
+    parser.add_argument("--burst", type=int, help="calls allowed at once")
+    parser.add_argument("--no-batch", dest="batch", action="store_false")
+    parser.add_argument("--max-batch-size", type=int)
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of failed calls")
+    parser.add_argument("--key", help="private key of the signer account, a new one by default")
+    args = parser.parse_args(argv)
+
+    chain = Chain()
+    chain.seed(args.products)
+    signer = funded_account(chain.w3, chain.funder, args.key)
+    stand_in = StandIn(
+        chain,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        burst=args.burst,
+        batch=args.batch,
+        max_batch_size=args.max_batch_size,
+        error_rate=args.error_rate,
+    )
+    server = serve(stand_in, args.host, args.port)
+    print(f"PROVIDER=http://{args.host}:{args.port}")
+    print(f"CONTRACT_ADDR={chain.contract.address}")
+    print(f"CONTRACT_CREATED_BLOCK={chain.created_block}")
+    print(f"KEY={signer.key.hex()}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""Benchmarks the product reads, the api, the transaction sending and the event handling against
+the product contract deployed on a local eth-tester chain, and the import time of the modules.
+
+    python -m benchmarks.run --sizes 10 100 1000 --output benchmarks/results/$(git rev-parse --short HEAD).json
+
+The chain is seeded once up to the largest size, growing between sizes. eth-tester takes tens of
+milliseconds per transaction and per eth_call, so 10000 products take around 10 minutes to seed and
+each listing read from the contract as long.
+"""
+# stdlib
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# deps
+import pytest
+from web3 import EthereumTesterProvider, Web3
+
+# local
+from app import app
+from src import products
+from src.call_cache import BlockPin, CallCache
+from src.event_subscription import EventPipeline, HeadTracker, LogCursor
+from src.fees import FeeCache, GasTable
+from src.index import ProductIndex
+from src.nonce import NonceManager
+from src.sessions import get_session
+from src.tests.fixtures import (
+    MockResponse,
+    create_product_tx,
+    deploy_product_contract,
+    funded_account,
+)
+
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+# products the contract lets each account create
+PRODUCTS_PER_ACCOUNT = 11
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORTED_MODULES = ("src.connection", "src.products", "src.event_subscription", "app", "service")
+
+
+def measure(name, size, func, rounds, items=1, setup=None):
+    """Runs ``func`` ``rounds`` times and summarizes its durations.
+
+    :param name: benchmark name
+    :type name: str
+    :param size: amount of products on the chain
+    :type size: int
+    :param func: function to time
+    :type func: function
+    :param rounds: amount of runs
+    :type rounds: int
+    :param items: amount of products, transactions or events handled by each run
+    :type items: int
+    :param setup: function called before each run, not timed
+    :type setup: function
+    :rtype: dict
+    """
+    durations = []
+    for _ in range(rounds):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return summarize(name, size, durations, items)
+
+
+def summarize(name, size, durations, items=1):
+    median = statistics.median(durations)
+    result = {
+        "name": name,
+        "size": size,
+        "rounds": len(durations),
+        "items": items,
+        "min": min(durations),
+        "median": median,
+        "mean": statistics.mean(durations),
+        "items_per_sec": items / median if median else None,
+    }
+    print(f"{name:<40} {size:>6} {median * 1000:>10.2f} ms {result['items_per_sec'] or 0:>10.1f}/s")
+    return result
+
+
+class Chain:
+    """eth-tester chain with the product contract deployed, seeded with products from as many
+    accounts as the contract limit requires.
+    """
+
+    def __init__(self):
+        self.w3 = Web3(EthereumTesterProvider())
+        self.funder = self.w3.eth.accounts[0]
+        self.contract = deploy_product_contract(self.w3, self.funder)
+        self.created_block = self.w3.eth.block_number
+        self.accounts = []
+        self.size = 0
+
+    def new_account(self):
+        account = funded_account(self.w3, self.funder)
+        self.accounts.append(account)
+        return account
+
+    def seed(self, size):
+        """Creates products until the contract has ``size`` of them.
+
+        :param size: amount of products
+        :type size: int
+        """
+        started = time.perf_counter()
+        seeded = self.size
+        while self.size < size:
+            created = self.size % PRODUCTS_PER_ACCOUNT
+            account = self.new_account() if created == 0 else self.accounts[-1]
+            create_product_tx(
+                self.w3, self.contract, account, f"product_{self.size}", nonce=created
+            )
+            self.size += 1
+        print(f"seeded {size - seeded} products in {time.perf_counter() - started:.1f}s")
+
+
+@contextlib.contextmanager
+def patched(chain):
+    """Points the product module, its caches and the signer client at the local chain."""
+    keys = {}
+
+    def sign(*args, **kwargs):
+        tx = kwargs["json"]
+        signed = chain.w3.eth.account.sign_transaction(tx, keys[tx["from"]])
+        return MockResponse({"rawTransaction": signed["rawTransaction"].hex()}, 200)
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr("src.products.w3", chain.w3)
+        monkeypatch.setattr("src.products.contract", chain.contract)
+        monkeypatch.setattr("src.products.product_index", ProductIndex())
+        monkeypatch.setattr("src.products.nonce_manager", NonceManager())
+        monkeypatch.setattr("src.products.fee_cache", FeeCache())
+        monkeypatch.setattr("src.products.gas_table", GasTable())
+        monkeypatch.setattr("src.products.block_pin", BlockPin())
+        monkeypatch.setattr(
+            "src.products.call_cache", CallCache(block_hash=products.pinned_block_hash)
+        )
+        monkeypatch.setattr("src.event_subscription.w3", chain.w3)
+        monkeypatch.setattr(get_session(), "request", sign)
+        monkeypatch.setenv("MINIMUM_CONFIRMATION", "0")
+        yield keys
+
+
+def cold_reads():
+    """Forgets the cached block number and call results, so each run reads the contract."""
+    products.block_pin.expire()
+    products.call_cache.clear()
+
+
+def bench_reads(chain, rounds, cold_rounds):
+    """Times the listings reading every product from the contract, the same reads answered from
+    the call cache, which is the cost of the code around the contract calls, and answered by a
+    synced product index.
+    """
+    owner = chain.accounts[0].address
+    client = app.test_client()
+    reads = {
+        "get_products": products.get_products,
+        "GET /": lambda: client.get("/").get_data(),
+        "GET / (ndjson)": lambda: client.get("/?stream=1").get_data(),
+        "get_product_by_name": lambda: products.get_product_by_name("product_0"),
+        "get_products_by_status": lambda: products.get_products_by_status(0),
+        "get_delegated_products_by_owner": lambda: products.get_delegated_products_by_owner(owner),
+        "get_products_by_new_owner": lambda: products.get_products_by_new_owner(owner),
+    }
+
+    # eth-tester takes tens of milliseconds per eth_call, the filters read the same products
+    results = [
+        measure(f"{name} [cold]", chain.size, reads[name], cold_rounds, chain.size, cold_reads)
+        for name in ("get_products", "GET /")
+    ]
+    for name, read in reads.items():
+        read()
+        results.append(measure(f"{name} [cached]", chain.size, read, rounds, chain.size))
+
+    products.product_index.sync(chain.contract)
+    for name, read in reads.items():
+        results.append(measure(f"{name} [index]", chain.size, read, rounds, chain.size))
+    products.product_index.reset()
+    return results
+
+
+def bench_events(chain, rounds):
+    """Reads the product creation events of the chain and handles them through the event
+    pipeline, until every event is handled.
+    """
+
+    async def handle_all():
+        head_tracker = HeadTracker(chain.w3, poll_interval=0.01)
+        pipeline = EventPipeline(head_tracker)
+        pipeline.start()
+        tracker = asyncio.create_task(head_tracker.run())
+        try:
+            cursor = LogCursor([chain.contract.events.NewProduct])
+            for event in cursor.get_new_entries(max_entries=chain.size):
+                await pipeline.put(event)
+            while pipeline.completed + pipeline.failed < chain.size:
+                await asyncio.sleep(0.001)
+        finally:
+            tracker.cancel()
+            await pipeline.stop()
+
+    def run():
+        # handle_event prints each event
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(handle_all())
+
+    return [measure("event_pipeline", chain.size, run, rounds, chain.size)]
+
+
+def bench_send(chain, keys, transactions, rounds):
+    """Sends product creations through ``send_transaction`` with the signer answered in process,
+    from new accounts on each run as each account creates at most 11 products.
+    """
+    batches = []
+
+    def setup():
+        batch = []
+        while len(batch) < transactions:
+            account = chain.new_account()
+            keys[account.address] = account.key.hex()
+            batch.extend([account.address] * min(PRODUCTS_PER_ACCOUNT, transactions - len(batch)))
+        batches.append(batch)
+
+    def run():
+        for i, address in enumerate(batches[-1]):
+            tx_hash = products.create_product(f"sent_{i}", address)
+            if isinstance(tx_hash, dict):
+                raise Exception(tx_hash["error"])
+
+    return [measure("send_transaction", chain.size, run, rounds, transactions, setup)]
+
+
+def bench_imports(rounds):
+    """Times the imports of the modules, and the first use of the contract after importing the
+    api, each in a new interpreter.
+    """
+    scripts = {f"import {module}": f"import {module}" for module in IMPORTED_MODULES}
+    scripts["cold start"] = "import app; from src.connection import contract; contract.functions"
+    results = []
+    for name, script in scripts.items():
+        timed = f"import time; started = time.perf_counter(); {script}; "
+        timed += "print(time.perf_counter() - started)"
+        durations = [
+            float(
+                subprocess.run(
+                    [sys.executable, "-c", timed],
+                    cwd=ROOT,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+            )
+            for _ in range(rounds)
+        ]
+        results.append(summarize(name, 0, durations))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument(
+        "--cold-rounds", type=int, default=1, help="runs of the reads going to the contract"
+    )
+    parser.add_argument("--transactions", type=int, default=50, help="sent on each run")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    results = bench_imports(args.rounds)
+    chain = Chain()
+    with patched(chain) as keys:
+        for size in sorted(args.sizes):
+            chain.seed(size)
+            results.extend(bench_reads(chain, args.rounds, args.cold_rounds))
+            results.extend(bench_events(chain, args.rounds))
+        results.extend(bench_send(chain, keys, args.transactions, args.rounds))
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sizes": sorted(args.sizes),
+        "results": results,
+    }
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
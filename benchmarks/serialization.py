@@ -0,0 +1,77 @@
+"""Micro-benchmark of the per-product cost of building and serializing a listing, with the
+``__dict__`` products converted to dicts and serialized by ``jsonify`` against the ``__slots__``
+products serializing themselves.
+
+    python -m benchmarks.serialization --products 10000
+"""
+# stdlib
+import argparse
+import json
+
+# flask
+from flask import Flask, jsonify
+
+# local
+from benchmarks.run import measure
+from src.encoding import dumps
+from src.models import Product
+
+
+class DictProduct:
+    """The product before it had ``__slots__`` and ``to_json``."""
+
+    def __init__(self, name, status, owner, new_owner):
+        self.name = name
+        self.status = status
+        self.owner = owner
+        self.new_owner = new_owner
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "status": self.status,
+            "owner": self.owner,
+            "new_owner": self.new_owner,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    # the decoded contract results of the listing
+    rows = [
+        [f"product_{i}", i % 2, "0x%040x" % i, "0x%040x" % (i % 7)] for i in range(args.products)
+    ]
+    app = Flask(__name__)
+
+    def before():
+        products = [DictProduct(*row).to_dict() for row in rows]
+        return jsonify({"products": products}).get_data()
+
+    def after():
+        products = [Product(*row) for row in rows]
+        return dumps({"products": products}).encode()
+
+    with app.app_context():
+        assert json.loads(before()) == json.loads(after())
+        results = [
+            measure(name, args.products, run, args.rounds, args.products)
+            for name, run in (
+                ("dict products + jsonify", before),
+                ("slots products + dumps", after),
+            )
+        ]
+    for result in results:
+        print(f"{result['name']:<40} {result['median'] / args.products * 1e6:.2f} us per product")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"results": results}, output, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
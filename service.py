@@ -1,33 +1,167 @@
 # stdlib
 import json
+import multiprocessing
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 # flask
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+
+# deps
+from eth_account import Account
+from eth_account._utils.signing import sign_transaction_dict
+from eth_utils import keccak
+from hexbytes import HexBytes
 
 # local
-from src.connection import w3
+from src.metrics import (
+    CONTENT_TYPE,
+    registry,
+    signing_latency,
+    signings,
+    track,
+)
+
 
+# processes signing in parallel, 0 signs in the request threads
+SIGN_WORKERS = int(os.getenv("SIGN_WORKERS") or os.cpu_count() or 1)
 
 app = Flask(__name__)
 
 
+class Signer:
+    """Signs the transactions of one account. The account is derived from the key once, instead
+    of on every signature as ``Account.sign_transaction`` does.
+    """
+
+    def __init__(self, key):
+        """
+        :param key: private key of the account
+        :type key: str
+        """
+        self.account = Account.from_key(key)
+        self.address = self.account.address.lower()
+
+    def sign(self, tx):
+        """Signs a transaction.
+
+        :param tx: transaction to sign
+        :type tx: dict
+        :return: the signed transaction or an error
+        :rtype: dict
+        """
+        try:
+            if "from" in tx:
+                # allowed only if it's the address of the key
+                if str(tx["from"]).lower() != self.address:
+                    raise TypeError(
+                        f"from field must match key's {self.account.address}, but it was "
+                        f"{tx['from']}"
+                    )
+                tx = {field: value for field, value in tx.items() if field != "from"}
+            v, r, s, encoded_tx = sign_transaction_dict(self.account._key_obj, tx)
+        except Exception as e:
+            return {"error": str(e.args[0]) if e.args else repr(e)}
+        return {
+            "rawTransaction": HexBytes(encoded_tx).hex(),
+            "hash": HexBytes(keccak(encoded_tx)).hex(),
+            "r": r,
+            "s": s,
+            "v": v,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_signer(key):
+    return Signer(key)
+
+
+# signer of each worker process, built once when the process starts
+worker_signer = None
+
+
+def init_worker(key):
+    global worker_signer
+    worker_signer = Signer(key)
+
+
+def sign_in_worker(tx):
+    return worker_signer.sign(tx)
+
+
+@lru_cache(maxsize=1)
+def get_pool(key, workers):
+    """Pool of processes signing with the account of ``key``, started on first use. They are
+    spawned, forking the threads of the server could copy a held lock.
+
+    :rtype: concurrent.futures.ProcessPoolExecutor
+    """
+    return ProcessPoolExecutor(
+        workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(key,),
+    )
+
+
+def sign_transactions(txs, key):
+    """Signs transactions, in the process pool if there are ``SIGN_WORKERS``.
+
+    :param txs: transactions to sign
+    :type txs: list[dict]
+    :param key: private key of the account
+    :type key: str
+    :return: the signed transaction, or an error, of each transaction in the same order
+    :rtype: list[dict]
+    """
+    try:
+        signer = get_signer(key)
+    except Exception as e:
+        return [{"error": str(e.args[0]) if e.args else repr(e)}] * len(txs)
+    if SIGN_WORKERS <= 0:
+        return [signer.sign(tx) for tx in txs]
+    pool = get_pool(key, SIGN_WORKERS)
+    chunksize = max(1, len(txs) // SIGN_WORKERS)
+    return list(pool.map(sign_in_worker, txs, chunksize=chunksize))
+
+
+def get_json_body():
+    # older clients send the json encoded transaction as a json string
+    body = request.get_json()
+    return json.loads(body) if isinstance(body, str) else body
+
+
+def timed(route, txs):
+    """Signs the transactions of a request, recording its signing latency in the metrics and in
+    a ``Server-Timing`` header.
+    """
+    started = time.monotonic()
+    with track(signings, signing_latency, route):
+        results = sign_transactions(txs, os.environ["KEY"])
+    elapsed = time.monotonic() - started
+    return results, {"Server-Timing": f"sign;dur={elapsed * 1000:.2f}"}
+
+
 @app.route("/")
 def sign():
-    tx = json.loads(request.get_json())
+    tx = get_json_body()
     if not tx:
         return jsonify({"error": "A transaction must be provided"})
-    key = os.environ["KEY"]
-    try:
-        signed_tx = w3.eth.account.sign_transaction(tx, key)
-    except Exception as e:
-        return jsonify({"error": str(e.args[0])})
-    return jsonify(
-        {
-            "rawTransaction": signed_tx["rawTransaction"].hex(),
-            "hash": signed_tx["hash"].hex(),
-            "r": signed_tx["r"],
-            "s": signed_tx["s"],
-            "v": signed_tx["v"],
-        }
-    )
+    results, headers = timed("sign", [tx])
+    return jsonify(results[0]), headers
+
+
+@app.route("/batch", methods=["POST"])
+def sign_batch():
+    txs = get_json_body()
+    if not txs or not isinstance(txs, list):
+        return jsonify({"error": "A list of transactions must be provided"})
+    results, headers = timed("batch", txs)
+    return jsonify({"results": results}), headers
+
+
+@app.route("/metrics")
+def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
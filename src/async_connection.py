@@ -0,0 +1,78 @@
+# stdlib
+import os
+
+# deps
+import aiohttp
+from web3 import AsyncHTTPProvider, Web3
+from web3.eth import AsyncEth
+
+# local
+from src.connection import Lazy, w3
+from src.metrics import rpc_errors, rpc_latency, rpc_requests
+from src.sessions import HTTP_TIMEOUT
+
+
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", 100))
+
+_client_session = None
+
+
+def get_client_session():
+    """Returns the aiohttp session shared by the async web3 provider and the async signer
+    client. It must be used from the event loop it was created in.
+
+    :rtype: aiohttp.ClientSession
+    """
+    global _client_session
+    if _client_session is None or _client_session.closed:
+        _client_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=ASYNC_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+        )
+    return _client_session
+
+
+async def close_client_session():
+    global _client_session
+    if _client_session is not None:
+        await _client_session.close()
+        _client_session = None
+
+
+class PooledAsyncHTTPProvider(AsyncHTTPProvider):
+    """Async HTTP provider sending the requests through the shared aiohttp session, as web3 opens
+    a new session, and so a new connection, per request.
+    """
+
+    async def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        rpc_requests.inc(method)
+        try:
+            with rpc_latency.time(method):
+                async with get_client_session().post(
+                    self.endpoint_uri, data=request_data, headers=self.get_request_headers()
+                ) as response:
+                    response.raise_for_status()
+                    raw_response = await response.read()
+        except Exception:
+            rpc_errors.inc(method)
+            raise
+        response = self.decode_rpc_response(raw_response)
+        if "error" in response:
+            rpc_errors.inc(method)
+        return response
+
+
+def build_async_w3():
+    """Builds the async web3 instance, to the endpoint of the sync one.
+
+    :rtype: Web3
+    """
+    return Web3(
+        PooledAsyncHTTPProvider(w3.provider.endpoint_uri),
+        modules={"eth": (AsyncEth,)},
+        middlewares=[],
+    )
+
+
+async_w3 = Lazy(build_async_w3)
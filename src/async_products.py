@@ -0,0 +1,342 @@
+# stdlib
+import asyncio
+import os
+
+# deps
+from eth_utils import keccak
+from hexbytes import HexBytes
+from web3 import Web3
+from web3 import exceptions as web3Exceptions
+
+# local
+from src import products
+from src.async_connection import async_w3, get_client_session
+from src.batch import DEFAULT_BATCH_SIZE, _decode, is_revert
+from src.call_cache import block_key
+from src.index import index_key
+from src.metrics import signer_latency, signer_requests, track
+from src.models import Product
+from src.nonce import is_already_known, is_nonce_error
+
+from .exceptions import ProductDoesNotExists
+
+
+ASYNC_READ_CONCURRENCY = int(os.getenv("ASYNC_READ_CONCURRENCY", 32))
+
+
+async def _in_executor(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+async def _eth_call(function, block_identifier):
+    try:
+        result = await async_w3.eth.call(
+            {"to": function.address, "data": function._encode_transaction_data()},
+            block_identifier,
+        )
+    except (web3Exceptions.ContractLogicError, web3Exceptions.BadFunctionCallOutput) as e:
+        return e
+    except ValueError as e:
+        # error answered by the node, only a revert is a result
+        error = e.args[0] if e.args else str(e)
+        if not is_revert(error):
+            raise
+        message = error.get("message") if isinstance(error, dict) else error
+        return web3Exceptions.ContractLogicError(message)
+    try:
+        return _decode(function, Web3.toHex(result))
+    except Exception as e:
+        return e
+
+
+async def call_many(functions, block_identifier):
+    """Calls the contract functions at the same block concurrently, at most
+    ``ASYNC_READ_CONCURRENCY`` at a time.
+
+    :param functions: contract functions to call, e.g. ``contract.functions.products(0)``
+    :type functions: list[web3.contract.ContractFunction]
+    :param block_identifier: block number or block hash
+    :type block_identifier: int or str
+    :return: the decoded result of each call, or the exception raised by it, in the same order
+    :rtype: list
+    """
+    semaphore = asyncio.Semaphore(ASYNC_READ_CONCURRENCY)
+
+    async def call(function):
+        async with semaphore:
+            return await _eth_call(function, block_identifier)
+
+    return await asyncio.gather(*(call(f) for f in functions))
+
+
+async def _call(functions, block):
+    return await products.call_cache.call_async(functions, block, call_many)
+
+
+async def pinned_block(block=None):
+    """Returns the block the reads are pinned to, the current block by default.
+
+    :param block: block number or block hash requested
+    :type block: int or str
+    :rtype: int or str
+    """
+    if block is not None:
+        return block
+    block_number = products.block_pin.cached()
+    if block_number is None:
+        latest = await async_w3.eth.get_block("latest")
+        block_number = latest["number"]
+        products.block_pin.on_new_block(block_number, latest["hash"])
+    return block_number
+
+
+async def resolve_block(block=None):
+    """Resolves the block of a read request once, see ``products.resolve_block``.
+
+    :param block: block number or block hash requested
+    :type block: int or str
+    :rtype: int or str
+    """
+    if block is not None or products.product_index.ready:
+        return block
+    return await pinned_block()
+
+
+async def read_block(block=None):
+    """Returns the block the reads answer at, see ``products.read_block``.
+
+    :param block: block number or block hash requested
+    :type block: int or str
+    :rtype: int or str
+    """
+    if products._use_index(block):
+        return products.product_index.last_block
+    return await pinned_block(block)
+
+
+async def state_version(block=None):
+    """Version of the contract state the reads answer from, see ``products.state_version``.
+
+    :param block: block number or hash requested
+    :type block: int or str
+    :rtype: str
+    """
+    if block is not None:
+        return f"block-{block_key(block)}"
+    if products.product_index.ready:
+        return f"index-{products.product_index.version}"
+    return f"block-{await pinned_block()}"
+
+
+async def get_product(product_id, block=None):
+    """Get a product by id, from the product index if it has seen it or from the contract.
+
+    :param product_id: product id
+    :type product_id: int
+    :param block: block number or hash to read the product at, the current block by default
+    :type block: int or str
+    :return: product
+    :rtype: Product
+    """
+    product = products.product_index.get(product_id) if block is None else None
+    if product is not None:
+        return product
+    function = products.contract.functions.products(product_id)
+    (product,) = await _call([function], await read_block(block))
+    if isinstance(product, web3Exceptions.ContractLogicError):
+        raise ProductDoesNotExists(product_id)
+    if isinstance(product, Exception):
+        raise product
+    product = Product(*product)
+    if products.product_index.ready and block is None:
+        products.product_index.put(product_id, product)
+    return product
+
+
+async def _products_amount(block):
+    (products_amount,) = await _call([products.contract.functions.size()], block)
+    if isinstance(products_amount, Exception):
+        raise products_amount
+    return products_amount
+
+
+async def _read_range(start, stop, block, use_index):
+    """Yields the products between ``start`` and ``stop`` one chunk at a time, from the index or
+    read from the contract at ``block``, the products of each chunk concurrently.
+
+    :rtype: AsyncIterator[tuple[int, Product]]
+    """
+    for chunk_start in range(start, stop, DEFAULT_BATCH_SIZE):
+        ids = range(chunk_start, min(chunk_start + DEFAULT_BATCH_SIZE, stop))
+        indexed = products.product_index.get_range(ids.start, ids.stop) if use_index else {}
+        missing = [i for i in ids if indexed.get(i) is None]
+        results = await _call([products.contract.functions.products(i) for i in missing], block)
+        fetched = dict(zip(missing, results))
+        for i in ids:
+            if i not in fetched:
+                yield i, indexed[i]
+                continue
+            if isinstance(fetched[i], Exception):
+                print(f"Unable to get product {i}")
+                continue
+            product = Product(*fetched[i])
+            if use_index:
+                products.product_index.put(i, product)
+            yield i, product
+
+
+async def iter_products(start=0, limit=None, block=None):
+    """Iterates over the products from the id ``start``, all of them read at the same block.
+
+    :param start: first product id
+    :type start: int
+    :param limit: max amount of product ids to read, all the remaining by default
+    :type limit: int
+    :param block: block number or hash to read the products at, the current block by default
+    :type block: int or str
+    :return: product ids and products
+    :rtype: AsyncIterator[tuple[int, Product]]
+    """
+    use_index = products._use_index(block)
+    block = await read_block(block)
+    products_amount = await _products_amount(block)
+    stop = products_amount if limit is None else min(products_amount, start + limit)
+    async for i, product in _read_range(start, stop, block, use_index):
+        yield i, product
+
+
+async def get_products_page(cursor=0, limit=DEFAULT_BATCH_SIZE, block=None):
+    """Get a page of products
+
+    :param cursor: first product id of the page
+    :type cursor: int
+    :param limit: amount of product ids in the page
+    :type limit: int
+    :param block: block number or hash to read the products at, the current block by default
+    :type block: int or str
+    :return: products of the page and the cursor of the next page, None on the last page
+    :rtype: dict
+    """
+    use_index = products._use_index(block)
+    block = await read_block(block)
+    products_amount = await _products_amount(block)
+    stop = min(products_amount, cursor + limit)
+    page = [product.to_dict() async for _, product in _read_range(cursor, stop, block, use_index)]
+    return {"products": page, "next_cursor": stop if stop < products_amount else None}
+
+
+async def get_products(block=None):
+    """Get all products
+
+    :param block: block number or hash to read the products at, the current block by default
+    :type block: int or str
+    :return: list of products
+    :rtype: list[dict]
+    """
+    return [product.to_dict() async for _, product in iter_products(block=block)]
+
+
+async def _filter_products(block, **filters):
+    if products._use_index(block):
+        return [product.to_dict() for _, product in products.product_index.find(**filters)]
+    return [
+        product
+        for product in await get_products(block)
+        if all(
+            index_key(field, product[field]) == index_key(field, value)
+            for field, value in filters.items()
+        )
+    ]
+
+
+async def get_product_by_name(name, block=None):
+    """Same as ``products.get_product_by_name``."""
+    return await _filter_products(block, name=name)
+
+
+async def get_products_by_status(status, block=None):
+    """Same as ``products.get_products_by_status``."""
+    return await _filter_products(block, status=status)
+
+
+async def get_delegated_products_by_owner(owner, block=None):
+    """Same as ``products.get_delegated_products_by_owner``."""
+    return await _filter_products(block, owner=owner)
+
+
+async def get_products_by_new_owner(new_owner, block=None):
+    """Same as ``products.get_products_by_new_owner``."""
+    return await _filter_products(block, new_owner=new_owner)
+
+
+async def sign_transaction(tx):
+    """Signs a transaction with the signer microservice without blocking the event loop.
+
+    :param tx: built transaction
+    :type tx: dict
+    :return: the signed transaction or an error
+    :rtype: dict
+    """
+    with track(signer_requests, signer_latency, "sign"):
+        async with get_client_session().request("GET", os.getenv("SIGN_URL"), json=tx) as response:
+            response.raise_for_status()
+            return await response.json()
+
+
+async def send_raw_transaction(raw_transaction):
+    """Same as ``products.send_raw_transaction``."""
+    try:
+        return await async_w3.eth.send_raw_transaction(raw_transaction)
+    except Exception as e:
+        if not is_already_known(e):
+            raise
+        return HexBytes(keccak(HexBytes(raw_transaction)))
+
+
+async def send_transaction(transaction, acc_address, retry_nonce=True):
+    """Build a transaction, sign it and send it, see ``products.send_transaction``. The
+    transaction is built in the default executor, its nonce and gas are usually cached.
+
+    :param transaction: transaction function
+    :type transaction: function
+    :param acc_address: address to send the transaction from
+    :type acc_address: str
+    :param retry_nonce: send the transaction again if its nonce is rejected
+    :type retry_nonce: bool
+    """
+    try:
+        tx = await _in_executor(products.build_transaction, transaction, acc_address)
+    except web3Exceptions.InvalidAddress:
+        return {"error": "Invalid address"}
+    try:
+        signed_tx = await sign_transaction(tx)
+        hash_tx = await send_raw_transaction(signed_tx["rawTransaction"])
+    except Exception as e:
+        print(e.args[0] if e.args else repr(e))
+        if not is_nonce_error(e):
+            products.nonce_manager.release(acc_address, tx["nonce"])
+            return {"error": "Something went wrong, try again."}
+        products.nonce_manager.resync(acc_address)
+        if retry_nonce:
+            return await send_transaction(transaction, acc_address, retry_nonce=False)
+        return {"error": "Something went wrong, try again."}
+    products.gas_table.track(hash_tx, transaction)
+    products.block_pin.expire()
+    return hash_tx
+
+
+async def create_product(name, acc_address):
+    """Same as ``products.create_product``."""
+    return await send_transaction(products.contract.functions.createProduct(name), acc_address)
+
+
+async def delegate_product(product_id, acc_address, acc2_address):
+    """Same as ``products.delegate_product``."""
+    tx = products.contract.functions.delegateProduct(product_id, acc2_address)
+    return await send_transaction(tx, acc_address)
+
+
+async def accept_product(product_id, acc_address):
+    """Same as ``products.accept_product``."""
+    tx = products.contract.functions.acceptProduct(product_id)
+    return await send_transaction(tx, acc_address)
@@ -0,0 +1,373 @@
+# stdlib
+import os
+
+# deps
+from hexbytes import HexBytes
+from web3 import HTTPProvider, Web3
+from web3 import exceptions as web3Exceptions
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.method_formatters import (
+    receipt_formatter,
+    transaction_result_formatter,
+)
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3.datastructures import AttributeDict
+
+# local
+from src.metrics import rpc_errors, rpc_latency, rpc_requests
+from src.provider import (
+    LIMIT_EXCEEDED,
+    EndpointError,
+    MultiEndpointProvider,
+    check_response,
+)
+from src.sessions import get_session
+
+
+DEFAULT_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE", 100))
+
+# endpoints that refused a batch request
+_unsupported_endpoints = set()
+# max amount of calls per batch of the endpoints that answered a bigger one with a size limit
+_batch_limits = {}
+
+# HTTP statuses of the endpoints refusing a batch payload
+BATCH_REFUSED_STATUSES = (405, 501)
+PAYLOAD_TOO_LARGE = 413
+# JSON-RPC errors answering a whole batch over the size limit of the endpoint
+INVALID_REQUEST = -32600
+BATCH_LIMIT_CODES = (INVALID_REQUEST, LIMIT_EXCEEDED)
+BATCH_LIMIT_MESSAGES = ("limit", "too large", "too many")
+# JSON-RPC errors of a call reverted by the contract, the failed asserts of solidity 0.5, like
+# reading a product past the end of the array, end on an invalid opcode
+REVERT_CODE = 3
+REVERT_MESSAGES = ("execution reverted", "invalid opcode")
+
+
+class BatchNotSupported(Exception):
+    pass
+
+
+class BatchTooLarge(ValueError):
+    """The endpoint answered a batch with its size limit, smaller batches are accepted."""
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def _decode(function, result):
+    output_types = get_abi_output_types(function.abi)
+    data = function.web3.codec.decode_abi(output_types, bytes.fromhex(result[2:]))
+    data = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, data)
+    return data[0] if len(data) == 1 else data
+
+
+def is_revert(error):
+    """Returns whether a JSON-RPC error means that the contract reverted the call.
+
+    :param error: ``error`` member of a JSON-RPC response
+    :type error: dict or str
+    :rtype: bool
+    """
+    if isinstance(error, dict):
+        if error.get("code") == REVERT_CODE:
+            return True
+        error = error.get("message")
+    message = str(error).lower()
+    return any(text in message for text in REVERT_MESSAGES)
+
+
+def is_batch_limit(error):
+    """Returns whether the error answering a whole batch is a size limit of the endpoint.
+
+    :param error: ``error`` member of a JSON-RPC response
+    :type error: dict or str
+    :rtype: bool
+    """
+    if isinstance(error, dict):
+        if error.get("code") in BATCH_LIMIT_CODES:
+            return True
+        error = error.get("message")
+    message = str(error).lower()
+    return any(text in message for text in BATCH_LIMIT_MESSAGES)
+
+
+def _post_batch(provider, calls):
+    """Sends JSON-RPC calls in one batch request.
+
+    :param provider: HTTP provider
+    :type provider: HTTPProvider
+    :param calls: method and params of each call
+    :type calls: list[tuple[str, list]]
+    :return: the response of each call, in the same order
+    :rtype: list[dict]
+    :raises BatchNotSupported: if the endpoint refuses the batch payload
+    :raises BatchTooLarge: if the endpoint answers with its batch size limit
+    """
+    payload = [
+        {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+        for i, (method, params) in enumerate(calls)
+    ]
+    for method, _ in calls:
+        rpc_requests.inc(method)
+    with rpc_latency.time("batch"):
+        response = get_session().post(
+            provider.endpoint_uri, json=payload, **provider.get_request_kwargs()
+        )
+    if response.status_code in BATCH_REFUSED_STATUSES:
+        raise BatchNotSupported(f"{response.status_code} {response.reason}")
+    if response.status_code == PAYLOAD_TOO_LARGE:
+        raise BatchTooLarge(f"{response.status_code} {response.reason}")
+    if response.status_code != 400:
+        # some endpoints answer the batches they refuse with a 400 and a JSON-RPC error
+        response.raise_for_status()
+    try:
+        responses = response.json()
+    except ValueError:
+        responses = None
+    if not isinstance(responses, list):
+        # a single error answering the whole batch, the batches are refused unless it's a limit
+        error = responses.get("error") if isinstance(responses, dict) else responses
+        if error is not None and is_batch_limit(error):
+            raise BatchTooLarge(error)
+        raise BatchNotSupported(responses or f"{response.status_code} {response.reason}")
+    if len(responses) != len(calls):
+        raise ValueError(f"Unexpected response to a batch of {len(calls)} calls: {responses}")
+    responses = sorted(responses, key=lambda item: item["id"])
+    for (method, _), item in zip(calls, responses):
+        if "error" in item:
+            rpc_errors.inc(method)
+    return responses
+
+
+def _call_results(functions, responses):
+    results = []
+    for function, item in zip(functions, responses):
+        if "error" in item:
+            error = item["error"]
+            if not is_revert(error):
+                # like the single calls, only the reverts are results
+                raise ValueError(error)
+            message = error.get("message") if isinstance(error, dict) else error
+            results.append(web3Exceptions.ContractLogicError(message))
+            continue
+        try:
+            results.append(_decode(function, item["result"]))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _call_one(function, block_identifier="latest"):
+    try:
+        return function.call(block_identifier=block_identifier)
+    except (web3Exceptions.ContractLogicError, web3Exceptions.BadFunctionCallOutput) as e:
+        return e
+
+
+def _accepts_batches(provider):
+    return (
+        isinstance(provider, HTTPProvider) and provider.endpoint_uri not in _unsupported_endpoints
+    )
+
+
+def _batch_endpoints(provider):
+    return [endpoint for endpoint in provider.ranked() if _accepts_batches(endpoint.provider)]
+
+
+def _disable_batching(provider, error):
+    print(f"Batch requests not supported by {provider.endpoint_uri}: {error}")
+    _unsupported_endpoints.add(provider.endpoint_uri)
+
+
+def batching_enabled(w3):
+    """Returns whether calls through the given web3 instance are sent in batch requests.
+
+    :param w3: web3 instance
+    :type w3: Web3
+    :rtype: bool
+    """
+    if isinstance(w3.provider, MultiEndpointProvider):
+        return bool(_batch_endpoints(w3.provider))
+    return _accepts_batches(w3.provider)
+
+
+def _post_limited(provider, calls):
+    """Sends calls in batches within the size limit of the endpoint, halving the batches answered
+    with a limit until they are accepted.
+
+    :rtype: list[dict]
+    :raises BatchNotSupported: if the endpoint refuses the batch payload, or even one call in it
+    """
+    size = _batch_limits.get(provider.endpoint_uri, len(calls))
+    responses = []
+    for chunk in _chunks(calls, size):
+        try:
+            responses.extend(_post_batch(provider, chunk))
+        except BatchTooLarge as e:
+            if len(chunk) == 1:
+                raise BatchNotSupported(e)
+            _batch_limits[provider.endpoint_uri] = len(chunk) // 2
+            print(f"Batch of {len(chunk)} calls over the limit of {provider.endpoint_uri}: {e}")
+            responses.extend(_post_limited(provider, chunk))
+    return responses
+
+
+def _post_to_endpoint(endpoint, calls):
+    def post():
+        responses = _post_limited(endpoint.provider, calls)
+        for item in responses:
+            try:
+                check_response(item)
+            except EndpointError as e:
+                # the next endpoint is asked for the whole batch, the last one answers it
+                raise EndpointError(str(e), responses)
+        return responses
+
+    return endpoint.timed(post)
+
+
+def _send_batch(provider, calls):
+    """Sends a batch request, through the endpoints of a multi-endpoint provider accepting
+    batches from the best to the worst, timed in their averages and failing over like the reads.
+
+    :raises BatchNotSupported: if no endpoint accepts the batch payloads
+    """
+    if not isinstance(provider, MultiEndpointProvider):
+        try:
+            return _post_limited(provider, calls)
+        except BatchNotSupported as e:
+            _disable_batching(provider, e)
+            raise
+
+    def send(endpoint):
+        try:
+            return _post_to_endpoint(endpoint, calls)
+        except BatchNotSupported as e:
+            _disable_batching(endpoint.provider, e)
+            raise
+
+    endpoints = _batch_endpoints(provider)
+    if not endpoints:
+        raise BatchNotSupported("No endpoint accepts batch requests")
+    return provider.failover(endpoints, "batch", send)
+
+
+def batch_call(functions, chunk_size=DEFAULT_BATCH_SIZE, block_identifier="latest"):
+    """Calls the given contract functions packed in JSON-RPC batch requests of ``chunk_size``
+    calls each, all of them at the same block.
+
+    Providers that are not HTTP or that reject the batch requests are called one function at a
+    time, and the endpoints rejecting batches are remembered so they are not tried again.
+
+    :param functions: contract functions to call, e.g. ``contract.functions.products(0)``
+    :type functions: list[web3.contract.ContractFunction]
+    :param chunk_size: amount of calls per batch request
+    :type chunk_size: int
+    :param block_identifier: block number, block hash or tag to call the functions at
+    :type block_identifier: int or str or bytes
+    :return: the decoded result of each call, or the exception raised by it, in the same order
+    :rtype: list
+    """
+    functions = list(functions)
+    if not functions:
+        return []
+    w3 = functions[0].web3
+    if not batching_enabled(w3):
+        return [_call_one(f, block_identifier) for f in functions]
+
+    block = block_identifier if isinstance(block_identifier, str) else Web3.toHex(block_identifier)
+    results = []
+    for i, chunk in enumerate(_chunks(functions, chunk_size)):
+        calls = [
+            ("eth_call", [{"to": f.address, "data": f._encode_transaction_data()}, block])
+            for f in chunk
+        ]
+        try:
+            results.extend(_call_results(chunk, _send_batch(w3.provider, calls)))
+        except BatchNotSupported:
+            results.extend(_call_one(f, block_identifier) for f in functions[i * chunk_size :])
+            break
+    return results
+
+
+def _get_receipt(w3, tx_hash):
+    try:
+        return w3.eth.get_transaction_receipt(tx_hash)
+    except web3Exceptions.TransactionNotFound:
+        return None
+
+
+def _get_transaction(w3, tx_hash):
+    try:
+        return w3.eth.get_transaction(tx_hash)
+    except web3Exceptions.TransactionNotFound:
+        return None
+
+
+def _get_by_hash(w3, method, formatter, get_one, tx_hashes, chunk_size):
+    """Reads the result of a JSON-RPC method for each transaction hash, packed in batch requests,
+    or one by one with ``get_one(w3, tx_hash)`` if the endpoint doesn't accept batches.
+
+    :return: the formatted result of each transaction, None for the unknown ones
+    :rtype: list[web3.datastructures.AttributeDict]
+    """
+    tx_hashes = list(tx_hashes)
+    if not batching_enabled(w3):
+        return [get_one(w3, tx_hash) for tx_hash in tx_hashes]
+
+    results = []
+    for i, chunk in enumerate(_chunks(tx_hashes, chunk_size)):
+        calls = [(method, [HexBytes(tx_hash).hex()]) for tx_hash in chunk]
+        try:
+            responses = _send_batch(w3.provider, calls)
+        except BatchNotSupported:
+            results.extend(get_one(w3, tx_hash) for tx_hash in tx_hashes[i * chunk_size :])
+            break
+        for item in responses:
+            if "error" in item:
+                raise ValueError(item["error"])
+            result = item.get("result")
+            results.append(AttributeDict.recursive(formatter(result)) if result else None)
+    return results
+
+
+def get_transaction_receipts(w3, tx_hashes, chunk_size=DEFAULT_BATCH_SIZE):
+    """Reads several transaction receipts packed in JSON-RPC batch requests.
+
+    :param w3: web3 instance
+    :type w3: Web3
+    :param tx_hashes: hashes of the transactions, as bytes or hex strings
+    :type tx_hashes: list[HexBytes or str]
+    :param chunk_size: amount of receipts per batch request
+    :type chunk_size: int
+    :return: the receipt of each transaction, None for the transactions not mined yet
+    :rtype: list[web3.datastructures.AttributeDict]
+    """
+    return _get_by_hash(
+        w3, "eth_getTransactionReceipt", receipt_formatter, _get_receipt, tx_hashes, chunk_size
+    )
+
+
+def get_transactions(w3, tx_hashes, chunk_size=DEFAULT_BATCH_SIZE):
+    """Reads several transactions packed in JSON-RPC batch requests.
+
+    :param w3: web3 instance
+    :type w3: Web3
+    :param tx_hashes: hashes of the transactions, as bytes or hex strings
+    :type tx_hashes: list[HexBytes or str]
+    :param chunk_size: amount of transactions per batch request
+    :type chunk_size: int
+    :return: each transaction, None for the unknown ones
+    :rtype: list[web3.datastructures.AttributeDict]
+    """
+    return _get_by_hash(
+        w3,
+        "eth_getTransactionByHash",
+        transaction_result_formatter,
+        _get_transaction,
+        tx_hashes,
+        chunk_size,
+    )
@@ -0,0 +1,215 @@
+# stdlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# deps
+from web3 import Web3
+
+# local
+from src.batch import batch_call
+
+
+BLOCK_TTL = float(os.getenv("BLOCK_TTL", 1))
+CALL_CACHE_SIZE = int(os.getenv("CALL_CACHE_SIZE", 10000))
+BLOCK_HASH_LENGTH = 66
+
+
+def block_key(block_identifier):
+    """Normalizes a block number or hash, so the same block is cached under one key.
+
+    :param block_identifier: block number or block hash
+    :type block_identifier: int or str or bytes
+    :rtype: int or str
+    """
+    if isinstance(block_identifier, int):
+        return block_identifier
+    if isinstance(block_identifier, str):
+        return block_identifier.lower()
+    return Web3.toHex(block_identifier)
+
+
+def parse_block(value):
+    """Parses a block number or a block hash given as text, e.g. in a query parameter.
+
+    :param value: block number or block hash
+    :type value: str
+    :return: the block, None if it's not a block number or a block hash
+    :rtype: int or str
+    """
+    if value.isdigit():
+        return int(value)
+    if len(value) == BLOCK_HASH_LENGTH and value.startswith("0x"):
+        try:
+            int(value, 16)
+        except ValueError:
+            return None
+        return value
+    return None
+
+
+class BlockPin:
+    """Caches the current block for ``ttl`` seconds, the block the reads are pinned to when none
+    is requested. Its hash is kept along its number, to cache the reads at the block under it.
+    """
+
+    def __init__(self, ttl=BLOCK_TTL):
+        self.ttl = ttl
+        self._block_number = None
+        self._block_hash = None
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+
+    def block_number(self, w3):
+        """Returns the cached block number, reading the latest block from the node when it's
+        expired.
+
+        :param w3: web3 instance
+        :type w3: Web3
+        :rtype: int
+        """
+        block_number = self.cached()
+        if block_number is not None:
+            return block_number
+        block = w3.eth.get_block("latest")
+        self.on_new_block(block["number"], block["hash"])
+        return block["number"]
+
+    def block_hash(self, block_number):
+        """Returns the hash of a block number if it's the pinned block, None otherwise.
+
+        :param block_number: block number
+        :type block_number: int
+        :rtype: str
+        """
+        with self._lock:
+            return self._block_hash if block_number == self._block_number else None
+
+    def on_new_block(self, block_number, block_hash=None):
+        """Moves the pin to a newer block seen by someone else, e.g. a head tracker.
+
+        :param block_number: current block number
+        :type block_number: int
+        :param block_hash: hash of the block, unknown by default
+        :type block_hash: str or bytes
+        """
+        with self._lock:
+            if self._block_number is None or block_number >= self._block_number:
+                if block_number != self._block_number or block_hash is not None:
+                    self._block_hash = None if block_hash is None else block_key(block_hash)
+                self._block_number = block_number
+                self._fetched_at = time.monotonic()
+
+    def cached(self):
+        """Returns the cached block number, None when it's expired.
+
+        :rtype: int
+        """
+        with self._lock:
+            if self._block_number is not None and time.monotonic() - self._fetched_at < self.ttl:
+                return self._block_number
+        return None
+
+    def expire(self):
+        """Reads the block again on the next read, e.g. after sending a transaction."""
+        with self._lock:
+            self._fetched_at = 0
+
+
+class CallCache:
+    """LRU cache of contract call results keyed by block hash and call.
+
+    The state at a given block hash never changes, so a cached result is valid until it's
+    evicted. A block number can be replaced by a reorg, its results are only cached under the
+    hash ``block_hash`` gives for it. Failed calls are not cached.
+    """
+
+    def __init__(self, maxsize=CALL_CACHE_SIZE, block_hash=None):
+        """
+        :param maxsize: max amount of cached results
+        :type maxsize: int
+        :param block_hash: function returning the hash of a block number, None when unknown
+        :type block_hash: function
+        """
+        self.maxsize = maxsize
+        self.block_hash = block_hash
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _block(self, block_identifier):
+        if not isinstance(block_identifier, int):
+            return block_key(block_identifier)
+        return self.block_hash(block_identifier) if self.block_hash else None
+
+    def _key(self, function, block):
+        return block, function.address, function._encode_transaction_data()
+
+    def call(self, functions, block_identifier):
+        """Calls the contract functions at the given block, the ones not cached in JSON-RPC
+        batches.
+
+        :param functions: contract functions to call, e.g. ``contract.functions.products(0)``
+        :type functions: list[web3.contract.ContractFunction]
+        :param block_identifier: block number or block hash, never a tag like "latest"
+        :type block_identifier: int or str or bytes
+        :return: the decoded result of each call, or the exception raised by it, in the same order
+        :rtype: list
+        """
+        block = self._block(block_identifier)
+        if block is None:
+            return batch_call(functions, block_identifier=block_identifier)
+        keys = [self._key(f, block) for f in functions]
+        results, missing = self._lookup(keys, functions)
+        if missing:
+            called = batch_call([f for _, f in missing], block_identifier=block_identifier)
+            self._store(missing, called, results)
+        return [results[key] for key in keys]
+
+    async def call_async(self, functions, block_identifier, call_many):
+        """Same as ``call``, calling the functions not cached with the coroutine ``call_many``.
+
+        :param call_many: coroutine function calling the functions at a block
+        :type call_many: function
+        :rtype: list
+        """
+        block = self._block(block_identifier)
+        if block is None:
+            return await call_many(functions, block_identifier)
+        keys = [self._key(f, block) for f in functions]
+        results, missing = self._lookup(keys, functions)
+        if missing:
+            called = await call_many([f for _, f in missing], block_identifier)
+            self._store(missing, called, results)
+        return [results[key] for key in keys]
+
+    def _lookup(self, keys, functions):
+        results = {}
+        with self._lock:
+            for key in keys:
+                if key in self._results:
+                    self._results.move_to_end(key)
+                    results[key] = self._results[key]
+            self.hits += len(results)
+            self.misses += len(keys) - len(results)
+        missing = [(key, f) for key, f in zip(keys, functions) if key not in results]
+        return results, missing
+
+    def _store(self, missing, called, results):
+        with self._lock:
+            for (key, _), result in zip(missing, called):
+                results[key] = result
+                if isinstance(result, Exception):
+                    continue
+                self._results[key] = result
+                if len(self._results) > self.maxsize:
+                    self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._results)}
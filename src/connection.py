@@ -1,21 +1,133 @@
 # stdlib
 import json
 import os
+import threading
+from functools import lru_cache
 
 # deps
 from web3 import HTTPProvider, Web3
 from web3.middleware import geth_poa_middleware
 
+# local
+from src.metrics import rpc_metrics_middleware
+from src.provider import MultiEndpointProvider
+from src.sessions import HTTP_TIMEOUT, get_session
 
-with open("src/contract_abi.json") as contract_file:
-    abi = json.loads(contract_file.read())
 
-w3 = Web3(HTTPProvider(os.getenv("PROVIDER", "https://matic-mumbai.chainstacklabs.com")))
-w3.middleware_onion.inject(geth_poa_middleware, layer=0)
-contract_address = w3.toChecksumAddress(
-    os.getenv("CONTRACT_ADDR", "0xd9E0b2C0724F3a01AaECe3C44F8023371f845196")
-)
+ABI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "contract_abi.json")
+DEFAULT_PROVIDER = "https://matic-mumbai.chainstacklabs.com"
+DEFAULT_CONTRACT_ADDR = "0xd9E0b2C0724F3a01AaECe3C44F8023371f845196"
 
-created_block = 22660777  # contract creation block
+created_block = int(os.getenv("CONTRACT_CREATED_BLOCK", 22660777))  # contract creation block
 
-contract = w3.eth.contract(address=contract_address, abi=abi)
+
+class Lazy:
+    """Stands for an object built on first use, so importing the module doesn't build it. The
+    attributes are read from and written to the built object.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_target", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _resolve(self):
+        target = object.__getattribute__(self, "_target")
+        if target is None:
+            with object.__getattribute__(self, "_lock"):
+                target = object.__getattribute__(self, "_target")
+                if target is None:
+                    target = object.__getattribute__(self, "_factory")()
+                    object.__setattr__(self, "_target", target)
+        return target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._resolve(), name)
+
+    def __repr__(self):
+        return f"Lazy({object.__getattribute__(self, '_target')!r})"
+
+
+def _set(lazy, target):
+    object.__setattr__(lazy, "_target", target)
+
+
+@lru_cache(maxsize=None)
+def load_abi():
+    """Reads the contract abi once, from the package directory.
+
+    :rtype: list[dict]
+    """
+    with open(ABI_PATH) as contract_file:
+        return json.load(contract_file)
+
+
+def build_w3(provider=None):
+    """Builds the web3 instance of the api, with the poa and the metrics middlewares.
+
+    :param provider: web3 provider, an HTTP provider to ``PROVIDER`` sharing the HTTP session by
+        default, or a multi-endpoint provider if it lists several comma separated URLs
+    :type provider: web3.providers.BaseProvider
+    :rtype: Web3
+    """
+    if provider is None:
+        endpoint_uris = [uri.strip() for uri in os.getenv("PROVIDER", DEFAULT_PROVIDER).split(",")]
+        endpoint_uris = [uri for uri in endpoint_uris if uri]
+        if len(endpoint_uris) > 1:
+            provider = MultiEndpointProvider(endpoint_uris)
+        else:
+            provider = HTTPProvider(
+                endpoint_uris[0], request_kwargs={"timeout": HTTP_TIMEOUT}, session=get_session()
+            )
+    web3 = Web3(provider)
+    web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+    web3.middleware_onion.inject(rpc_metrics_middleware, "rpc_metrics", layer=0)
+    return web3
+
+
+def build_contract(web3=None, address=None):
+    """Builds the product contract.
+
+    :param web3: web3 instance, the shared one by default
+    :type web3: Web3
+    :param address: contract address, ``CONTRACT_ADDR`` by default
+    :type address: str
+    :rtype: web3.contract.Contract
+    """
+    web3 = w3 if web3 is None else web3
+    address = address or os.getenv("CONTRACT_ADDR", DEFAULT_CONTRACT_ADDR)
+    return web3.eth.contract(address=Web3.toChecksumAddress(address), abi=load_abi())
+
+
+w3 = Lazy(build_w3)
+contract = Lazy(build_contract)
+
+
+def init(provider=None, contract_address=None):
+    """Builds the web3 instance and the contract now instead of on first use, e.g. with another
+    provider in tests.
+
+    :param provider: web3 provider, an HTTP provider to ``PROVIDER`` by default
+    :type provider: web3.providers.BaseProvider
+    :param contract_address: contract address, ``CONTRACT_ADDR`` by default
+    :type contract_address: str
+    :return: the web3 instance and the contract
+    :rtype: tuple[Web3, web3.contract.Contract]
+    """
+    web3 = build_w3(provider)
+    product_contract = build_contract(web3, contract_address)
+    _set(w3, web3)
+    _set(contract, product_contract)
+    return web3, product_contract
+
+
+def reset():
+    """Forgets the web3 instance and the contract, they are built again on next use."""
+    _set(w3, None)
+    _set(contract, None)
@@ -0,0 +1,42 @@
+# stdlib
+import json
+
+# deps
+from hexbytes import HexBytes
+
+# local
+from src.models import Product
+
+
+JSON_MIMETYPE = "application/json"
+
+
+def _default(value):
+    if isinstance(value, (bytes, bytearray)):
+        # transaction hashes, as Web3.toJSON encodes them
+        return HexBytes(value).hex()
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+_encoder = json.JSONEncoder(separators=(",", ":"), default=_default)
+
+
+def dumps(value):
+    """Serializes a response to compact JSON. The products serialize themselves, the rest is
+    encoded by the C encoder of the standard library.
+
+    :param value: response body, with lists of products, product dicts or transaction hashes
+    :type value: dict or list
+    :rtype: str
+    """
+    if isinstance(value, Product):
+        return value.to_json()
+    if isinstance(value, dict):
+        return "{%s}" % ",".join(
+            f"{_encoder.encode(str(key))}:{dumps(item)}" for key, item in value.items()
+        )
+    if isinstance(value, list) and value and isinstance(value[0], Product):
+        return "[%s]" % ",".join([item.to_json() for item in value])
+    return _encoder.encode(value)
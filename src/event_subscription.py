@@ -1,14 +1,23 @@
 # stdlib
 import asyncio
+import os
 
 # deps
+from web3 import Web3
 from web3 import exceptions as web3Exceptions
 
 # local
-from src.connection import *
+from src.connection import contract, created_block, w3
+from src.head_tracker import HeadTracker
+from src.log_cursor import CHECKPOINT_DIR, LogCursor
+from src.metrics import event_latency, events, start_metrics_server
 from src.models import WatchList
 
 
+EVENT_WORKERS = int(os.getenv("EVENT_WORKERS", 64))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 1000))
+
+
 def is_transaction_successfull(tx_hash):
     """Checks if the transaction is in the blockchain and if its status is success.
 
@@ -41,32 +50,173 @@ def has_min_confirmations(transaction_block_number, tx_hash):
     ) and is_transaction_successfull(tx_hash)
 
 
-async def handle_event(event):
+async def handle_event(event, head_tracker):
+    """Prints the event once its transaction has the minimum amount of confirmations.
+
+    :param event: decoded contract event
+    :type event: web3.datastructures.AttributeDict
+    :param head_tracker: tracker releasing the confirmed transactions
+    :type head_tracker: HeadTracker
+    """
     wl = WatchList()
     if event.event != "DelegateProduct" or wl.is_subscribed(event.args.newOwner):
-        # check every 3 seconds if it has the minimum confirmations
-        while not has_min_confirmations(event.blockNumber, event.transactionHash):
-            await asyncio.sleep(3)
+        successful = await head_tracker.wait_for_confirmations(
+            event.blockNumber, event.transactionHash
+        )
+        if not successful:
+            return
     print(Web3.toJSON(event))
 
 
-async def log_loop(event_filter, poll_interval):
+class EventPipeline:
+    """Bounded queue of events handled by a fixed amount of worker tasks.
+
+    Putting an event waits while the queue is full, so the reader stops fetching logs until the
+    workers catch up.
+    """
+
+    def __init__(
+        self,
+        head_tracker,
+        handlers=None,
+        workers=EVENT_WORKERS,
+        queue_size=EVENT_QUEUE_SIZE,
+        on_handled=(),
+    ):
+        """
+        :param head_tracker: tracker releasing the confirmed transactions
+        :type head_tracker: HeadTracker
+        :param handlers: coroutine handling each event name, ``handle_event`` by default
+        :type handlers: dict
+        :param workers: amount of events handled concurrently
+        :type workers: int
+        :param queue_size: max amount of events waiting for a worker
+        :type queue_size: int
+        :param on_handled: callables receiving each event once it's handled or has failed
+        :type on_handled: list[function]
+        """
+        self.head_tracker = head_tracker
+        self.handlers = handlers or {}
+        self.on_handled = list(on_handled)
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def put(self, event):
+        await self.queue.put(event)
+        events.inc(event.event, "queued")
+
+    async def _work(self):
+        while True:
+            event = await self.queue.get()
+            self.in_flight += 1
+            try:
+                handler = self.handlers.get(event.event, handle_event)
+                with event_latency.time(event.event):
+                    await handler(event, self.head_tracker)
+                self.completed += 1
+                events.inc(event.event, "completed")
+            except Exception as e:
+                self.failed += 1
+                events.inc(event.event, "failed")
+                print(f"Unable to handle event {event.event}: {e!r}")
+            finally:
+                self.in_flight -= 1
+                for callback in self.on_handled:
+                    callback(event)
+                self.queue.task_done()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+async def log_loop(event_filter, poll_interval, pipeline):
+    """Reads the new logs and queues each event in the pipeline, waiting while it's full.
+
+    :param event_filter: filter or log cursor returning the new decoded events
+    :type event_filter: LogCursor
+    :param poll_interval: seconds between reads once the filter is caught up with the chain
+    :type poll_interval: int
+    :param pipeline: pipeline handling the events
+    :type pipeline: EventPipeline
+    """
+    loop = asyncio.get_event_loop()
     while True:
-        for event in event_filter.get_new_entries():
-            asyncio.create_task(handle_event(event))
-        await asyncio.sleep(poll_interval)
+        try:
+            # read in a thread, so the workers and the head tracker go on during the request
+            entries = await loop.run_in_executor(None, event_filter.get_new_entries)
+        except Exception as e:
+            print(f"Unable to read the new events: {e!r}")
+            await asyncio.sleep(poll_interval)
+            continue
+        for event in entries:
+            await pipeline.put(event)
+        # keep reading without waiting while a backfill is behind the chain
+        await asyncio.sleep(poll_interval if getattr(event_filter, "caught_up", True) else 0)
+
+
+async def run_listener(event_filter, head_tracker, handlers=None, poll_interval=2):
+    # the cursor checkpoints the blocks whose events are all handled
+    pipeline = EventPipeline(head_tracker, handlers, on_handled=[event_filter.handled])
+    pipeline.start()
+    try:
+        await asyncio.gather(head_tracker.run(), log_loop(event_filter, poll_interval, pipeline))
+    finally:
+        await pipeline.stop()
 
 
-def listen_event(filter):
-    event_filter = filter.createFilter(fromBlock="latest")
+def listen_events(event_types, handlers=None):
+    """Listens to several events of the contract with a single eth_getLogs query per block range,
+    from the contract creation block or from where the last listener of the events stopped.
+
+    :param event_types: contract events to listen to
+    :type event_types: list[web3.contract.ContractEvent]
+    :param handlers: coroutine handling each event name, ``handle_event`` by default
+    :type handlers: dict
+    """
+    checkpoint_name = "-".join(event_type.event_name for event_type in event_types)
+    event_filter = LogCursor(
+        event_types,
+        from_block=created_block,
+        checkpoint_path=os.path.join(CHECKPOINT_DIR, f"{checkpoint_name}.json"),
+    )
+    head_tracker = HeadTracker(w3)
+    start_metrics_server()
     asyncio.set_event_loop(asyncio.new_event_loop())
     loop = asyncio.get_event_loop()
     try:
-        loop.run_until_complete(asyncio.gather(log_loop(event_filter, 2)))
+        loop.run_until_complete(run_listener(event_filter, head_tracker, handlers))
     finally:
         loop.close()
 
 
+def listen_event(filter):
+    """Listens to an event from the contract creation block, or from where the last listener of
+    the event stopped, reading the logs with eth_getLogs instead of a server side filter.
+
+    :param filter: contract event to listen to
+    :type filter: web3.contract.ContractEvent
+    """
+    listen_events([filter])
+
+
 def polling_new_products():
     event_type = contract.events.NewProduct
     listen_event(event_type)
@@ -80,3 +230,17 @@ def polling_delegated_products():
 def polling_accepted_products():
     event_type = contract.events.AcceptProduct
     listen_event(event_type)
+
+
+def polling_products(handlers=None):
+    """Listens to the creation, delegation and acceptance of products in a single listener.
+
+    :param handlers: coroutine handling each event name, ``handle_event`` by default
+    :type handlers: dict
+    """
+    event_types = [
+        contract.events.NewProduct,
+        contract.events.DelegateProduct,
+        contract.events.AcceptProduct,
+    ]
+    listen_events(event_types, handlers)
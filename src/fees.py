@@ -0,0 +1,222 @@
+# stdlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# local
+from src.batch import get_transaction_receipts
+
+
+FEE_TTL = float(os.getenv("FEE_TTL", 15))
+FEE_POLL_INTERVAL = float(os.getenv("FEE_POLL_INTERVAL", 3))
+GAS_MARGIN = float(os.getenv("GAS_MARGIN", 1.2))
+FEE_PENDING_BLOCKS = int(os.getenv("FEE_PENDING_BLOCKS", 50))
+DEFAULT_GAS = 210000
+
+
+class FeeCache:
+    """Caches the gas price for ``ttl`` seconds or until a new block is seen."""
+
+    def __init__(self, ttl=FEE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._gas_price = None
+        self._block_number = None
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+
+    def gas_price(self, w3):
+        """Returns the cached gas price, reading it from the node when it's expired.
+
+        :param w3: web3 instance
+        :type w3: Web3
+        :rtype: int
+        """
+        with self._lock:
+            if self._gas_price is not None and time.monotonic() - self._fetched_at < self.ttl:
+                self.hits += 1
+                return self._gas_price
+            self.misses += 1
+        gas_price = w3.eth.gas_price
+        with self._lock:
+            self._gas_price = gas_price
+            self._fetched_at = time.monotonic()
+        return gas_price
+
+    def on_new_block(self, block_number):
+        """Expires the gas price when the chain moves to a new block.
+
+        :param block_number: current block number
+        :type block_number: int
+        """
+        with self._lock:
+            if self._block_number is not None and block_number > self._block_number:
+                self._gas_price = None
+            self._block_number = block_number
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def gas_key(transaction):
+    """Key of the gas table for a transaction: its function and its calldata size in words, as
+    longer arguments, like a product name, use more gas.
+
+    :param transaction: transaction function
+    :type transaction: web3.contract.ContractFunction
+    :rtype: tuple[str, int]
+    """
+    return transaction.fn_name, len(transaction._encode_transaction_data()) // 64
+
+
+class GasTable:
+    """Gas limit per contract function, seeded from ``estimate_gas`` and refined from the gas used
+    by the mined transactions, plus a safety margin. A transaction still without a receipt
+    ``pending_blocks`` blocks after it was first polled was dropped or replaced and is forgotten.
+    """
+
+    def __init__(self, margin=GAS_MARGIN, max_pending=10000, pending_blocks=FEE_PENDING_BLOCKS):
+        self.margin = margin
+        self.max_pending = max_pending
+        self.pending_blocks = pending_blocks
+        self.hits = 0
+        self.misses = 0
+        self._gas = {}
+        self._observed = set()
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+
+    def gas(self, transaction, acc_address):
+        """Returns the gas limit for a transaction.
+
+        :param transaction: transaction function
+        :type transaction: web3.contract.ContractFunction
+        :param acc_address: address to send the transaction from
+        :type acc_address: str
+        :rtype: int
+        """
+        key = gas_key(transaction)
+        with self._lock:
+            gas = self._gas.get(key)
+            if gas is not None:
+                self.hits += 1
+                return int(gas * self.margin)
+            self.misses += 1
+        try:
+            gas = transaction.estimateGas({"from": acc_address})
+        except Exception as e:
+            # the node refuses to estimate transactions that revert
+            print(f"Unable to estimate the gas of {key[0]}: {e}")
+            return DEFAULT_GAS
+        with self._lock:
+            self._gas.setdefault(key, gas)
+        return int(gas * self.margin)
+
+    def track(self, tx_hash, transaction):
+        """Remembers the function of a sent transaction, to learn its gas from the receipt.
+
+        :param tx_hash: hash of the transaction
+        :type tx_hash: HexBytes
+        :param transaction: transaction function
+        :type transaction: web3.contract.ContractFunction
+        """
+        with self._lock:
+            # the block is set by the first poll of its receipt
+            self._pending[tx_hash] = [gas_key(transaction), None]
+            if len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+
+    def pending(self, block_number=None):
+        """Returns the hashes of the tracked transactions whose receipt wasn't observed yet. Given
+        the current block, the transactions polled for ``pending_blocks`` blocks are dropped.
+
+        :param block_number: current block number
+        :type block_number: int
+        :rtype: list[HexBytes]
+        """
+        with self._lock:
+            if block_number is not None:
+                for tx_hash, entry in list(self._pending.items()):
+                    if entry[1] is None:
+                        entry[1] = block_number
+                    elif block_number - entry[1] >= self.pending_blocks:
+                        del self._pending[tx_hash]
+            return list(self._pending)
+
+    def observe_receipt(self, receipt):
+        """Refines the gas of the function of a tracked transaction with its gas used. The first
+        receipt replaces the estimate, then the largest gas used is kept.
+
+        :param receipt: transaction receipt
+        :type receipt: web3.datastructures.AttributeDict
+        """
+        with self._lock:
+            key, _ = self._pending.pop(receipt.get("transactionHash"), (None, None))
+            if key is None or receipt["status"] != 1:
+                return
+            if key in self._observed:
+                self._gas[key] = max(self._gas[key], receipt["gasUsed"])
+            else:
+                self._gas[key] = receipt["gasUsed"]
+                self._observed.add(key)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class FeeTracker:
+    """Follows the chain head in the process sending the transactions. On each new block the gas
+    price of the fee cache expires and the receipts of the transactions tracked by the gas table
+    are read in a batch to refine their gas.
+    """
+
+    def __init__(self, w3, fee_cache, gas_table, poll_interval=FEE_POLL_INTERVAL):
+        """
+        :param w3: web3 instance
+        :type w3: Web3
+        :param fee_cache: gas price cache to expire
+        :type fee_cache: FeeCache
+        :param gas_table: gas table to feed with the receipts
+        :type gas_table: GasTable
+        :param poll_interval: seconds between block number polls
+        :type poll_interval: float
+        """
+        self.w3 = w3
+        self.fee_cache = fee_cache
+        self.gas_table = gas_table
+        self.poll_interval = poll_interval
+        self.head = None
+
+    def poll(self):
+        """Reads the block number and, on a new block, the receipts of the sent transactions."""
+        head = self.w3.eth.block_number
+        if self.head is not None and head <= self.head:
+            return
+        self.head = head
+        self.fee_cache.on_new_block(head)
+        tx_hashes = self.gas_table.pending(head)
+        if not tx_hashes:
+            return
+        for receipt in get_transaction_receipts(self.w3, tx_hashes):
+            if receipt is not None:
+                self.gas_table.observe_receipt(receipt)
+
+    def start(self):
+        """Polls the chain head in a daemon thread.
+
+        :rtype: threading.Thread
+        """
+
+        def poll_loop():
+            while True:
+                try:
+                    self.poll()
+                except Exception as e:
+                    print(f"Unable to track the fees: {e}")
+                time.sleep(self.poll_interval)
+
+        thread = threading.Thread(target=poll_loop, name="fee-tracker", daemon=True)
+        thread.start()
+        return thread
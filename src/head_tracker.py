@@ -0,0 +1,100 @@
+# stdlib
+import asyncio
+import os
+
+# local
+from src.batch import get_transaction_receipts
+
+
+class HeadTracker:
+    """Follows the chain head once for every pending event.
+
+    On each poll the transactions that reached ``MINIMUM_CONFIRMATION`` blocks of depth have their
+    receipts read in a batch and their waiters are released. A receipt is read at most once per
+    block, so the RPC cost is per block instead of per pending event. The blocking web3 calls run
+    in the default executor.
+    """
+
+    def __init__(self, w3, poll_interval=3, on_new_block=(), on_receipt=()):
+        """
+        :param w3: web3 instance
+        :type w3: Web3
+        :param poll_interval: seconds between block number polls
+        :type poll_interval: int
+        :param on_new_block: callables receiving each new block number
+        :type on_new_block: list[function]
+        :param on_receipt: callables receiving each receipt read
+        :type on_receipt: list[function]
+        """
+        self.w3 = w3
+        self.poll_interval = poll_interval
+        self.on_new_block = list(on_new_block)
+        self.on_receipt = list(on_receipt)
+        self.head = None
+        # tx hash -> (block number, futures waiting for it)
+        self._pending = {}
+        # tx hash -> head at which its receipt wasn't found yet
+        self._read_at = {}
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    async def wait_for_confirmations(self, transaction_block_number, tx_hash):
+        """Waits until the transaction has the minimum amount of confirmations.
+
+        :param transaction_block_number: block in which the transaction took place.
+        :type transaction_block_number: int
+        :param tx_hash: hash of the transaction
+        :type tx_hash: HexBytes
+        :return: whether the confirmed transaction was successful
+        :rtype: boolean
+        """
+        future = asyncio.get_running_loop().create_future()
+        _, futures = self._pending.setdefault(tx_hash, (transaction_block_number, []))
+        futures.append(future)
+        return await future
+
+    async def poll(self):
+        """Reads the block number and releases the confirmed transactions, the ones already deep
+        enough when they were added included.
+        """
+        loop = asyncio.get_running_loop()
+        head = await loop.run_in_executor(None, lambda: self.w3.eth.block_number)
+        if self.head is None or head > self.head:
+            self.head = head
+            for callback in self.on_new_block:
+                callback(head)
+        await self._release(loop)
+
+    async def _release(self, loop):
+        min_confirmations = int(os.environ["MINIMUM_CONFIRMATION"])
+        confirmed = [
+            tx_hash
+            for tx_hash, (block_number, _) in self._pending.items()
+            if self.head - block_number >= min_confirmations
+            and self._read_at.get(tx_hash) != self.head
+        ]
+        if not confirmed:
+            return
+        receipts = await loop.run_in_executor(None, get_transaction_receipts, self.w3, confirmed)
+        for tx_hash, receipt in zip(confirmed, receipts):
+            if receipt is None:
+                # not available on this node yet, read again on the next block
+                self._read_at[tx_hash] = self.head
+                continue
+            self._read_at.pop(tx_hash, None)
+            for callback in self.on_receipt:
+                callback(receipt)
+            _, futures = self._pending.pop(tx_hash)
+            for future in futures:
+                if not future.done():
+                    future.set_result(receipt["status"] == 1)
+
+    async def run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"Unable to poll the chain head: {e}")
+            await asyncio.sleep(self.poll_interval)
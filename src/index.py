@@ -0,0 +1,251 @@
+# stdlib
+import threading
+import time
+from collections import defaultdict
+
+# local
+from src.batch import get_transactions
+from src.log_cursor import LogCursor
+from src.models import Product
+
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+PRODUCT_EVENTS = ("NewProduct", "DelegateProduct", "AcceptProduct")
+
+INDEXED_FIELDS = ("name", "status", "owner", "new_owner")
+
+
+def index_key(field, value):
+    """Returns the value a product field is indexed and compared by, the addresses in lowercase
+    so they match checksummed or not.
+    """
+    if field in ("owner", "new_owner") and isinstance(value, str):
+        return value.lower()
+    return value
+
+
+def get_creators(events, w3):
+    """Reads the creator of each new product from its transaction, all of them in batch requests.
+
+    :param events: decoded logs of the product events
+    :type events: list[web3.datastructures.AttributeDict]
+    :param w3: web3 instance
+    :type w3: Web3
+    :return: address of the sender of each ``NewProduct`` transaction, by transaction hash
+    :rtype: dict[HexBytes, str]
+    """
+    tx_hashes = [event.transactionHash for event in events if event.event == "NewProduct"]
+    transactions = get_transactions(w3, tx_hashes)
+    return {tx_hash: transaction["from"] for tx_hash, transaction in zip(tx_hashes, transactions)}
+
+
+def transferred(product, event):
+    """Returns the product after a delegation or an acceptance, leaving ``product`` unchanged.
+
+    :param product: product before the event
+    :type product: Product
+    :param event: decoded ``DelegateProduct`` or ``AcceptProduct`` log
+    :type event: web3.datastructures.AttributeDict
+    :rtype: Product
+    """
+    if event.event == "DelegateProduct":
+        return Product(product.name, event.args.status, product.owner, event.args.newOwner)
+    if event.event == "AcceptProduct":
+        return Product(product.name, event.args.status, product.new_owner, ZERO_ADDRESS)
+    return product
+
+
+class ProductIndex:
+    """In-memory product table materialized from the contract events.
+
+    The table is built by replaying the ``NewProduct``, ``DelegateProduct`` and ``AcceptProduct``
+    logs from the contract creation block and then kept up to date by syncing the new logs. The
+    product ids are also indexed by name, status, owner and new owner.
+    """
+
+    def __init__(self, from_block=0):
+        self.from_block = from_block
+        self.last_block = None
+        # block number and log index of the last applied event
+        self.last_event = None
+        self._cursor = None
+        self._products = {}
+        self._indexes = {field: defaultdict(set) for field in INDEXED_FIELDS}
+        self._lock = threading.RLock()
+
+    @property
+    def ready(self):
+        """The index has replayed the contract history at least once."""
+        return self.last_block is not None
+
+    @property
+    def version(self):
+        """Position of the last applied event, it only changes when a product event is applied.
+
+        :rtype: str
+        """
+        if self.last_event is None:
+            return "0"
+        return "{}.{}".format(*self.last_event)
+
+    def size(self):
+        with self._lock:
+            return len(self._products)
+
+    def get(self, product_id):
+        """Returns the indexed product or None if the index has not seen it yet.
+
+        :param product_id: product id
+        :type product_id: int
+        :rtype: Product
+        """
+        with self._lock:
+            return self._products.get(product_id)
+
+    def get_range(self, start, stop):
+        """Returns the indexed products with ids between ``start`` and ``stop``.
+
+        :param start: first product id
+        :type start: int
+        :param stop: product id after the last one
+        :type stop: int
+        :rtype: dict[int, Product]
+        """
+        with self._lock:
+            return {i: self._products[i] for i in range(start, stop) if i in self._products}
+
+    def put(self, product_id, product):
+        """Stores a product read from the contract.
+
+        :param product_id: product id
+        :type product_id: int
+        :param product: product
+        :type product: Product
+        """
+        with self._lock:
+            old_product = self._products.get(product_id)
+            if old_product is not None:
+                self._unindex(product_id, old_product)
+            self._products[product_id] = product
+            self._index(product_id, product)
+
+    def _index(self, product_id, product):
+        for field, index in self._indexes.items():
+            index[index_key(field, getattr(product, field))].add(product_id)
+
+    def _unindex(self, product_id, product):
+        for field, index in self._indexes.items():
+            key = index_key(field, getattr(product, field))
+            index[key].discard(product_id)
+            if not index[key]:
+                del index[key]
+
+    def find(self, **filters):
+        """Returns the products matching every given field, e.g. ``find(owner=addr, status=1)``.
+
+        :param filters: values of the indexed fields: name, status, owner and new_owner
+        :type filters: dict
+        :return: product ids and products sorted by id
+        :rtype: list[tuple[int, Product]]
+        """
+        with self._lock:
+            ids = None
+            for field, value in filters.items():
+                matches = self._indexes[field].get(index_key(field, value), set())
+                ids = matches if ids is None else ids & matches
+            return [(i, self._products[i]) for i in sorted(ids or ())]
+
+    def products(self):
+        """Returns every indexed product sorted by id.
+
+        :rtype: list[tuple[int, Product]]
+        """
+        with self._lock:
+            return sorted(self._products.items())
+
+    def reset(self):
+        with self._lock:
+            self._products.clear()
+            for index in self._indexes.values():
+                index.clear()
+            self._cursor = None
+            self.last_block = None
+            self.last_event = None
+
+    def _apply(self, event, owners):
+        product_id = event.args.productId
+        self.last_event = (event.blockNumber, event.logIndex)
+        if event.event == "NewProduct":
+            owner = owners[event.transactionHash]
+            self.put(product_id, Product(event.args.name, 0, owner, ZERO_ADDRESS))
+            return
+        product = self._products.get(product_id)
+        if product is None:
+            # unknown product, it will be read from the contract when requested
+            return
+        # a new product replaces it, the requests may be serializing the one they got
+        self.put(product_id, transferred(product, event))
+
+    def _apply_events(self, events, w3):
+        # the creators are read before the lock, so the reads aren't blocked during the calls
+        owners = get_creators(events, w3)
+        with self._lock:
+            for event in events:
+                self._apply(event, owners)
+        return len(events)
+
+    def apply_event(self, event, w3):
+        """Applies a decoded contract event to the product table.
+
+        :param event: decoded log of one of the product events
+        :type event: web3.datastructures.AttributeDict
+        :param w3: web3 instance, used to find out the creator of new products
+        :type w3: Web3
+        """
+        self._apply_events([event], w3)
+
+    def sync(self, contract, to_block=None):
+        """Replays the product events from the last synced block up to ``to_block``, reading the
+        logs in adaptively sized block ranges.
+
+        :param contract: product contract
+        :type contract: web3.contract.Contract
+        :param to_block: last block to sync, the current block by default
+        :type to_block: int
+        :return: amount of events applied
+        :rtype: int
+        """
+        if self._cursor is None:
+            event_types = [getattr(contract.events, name) for name in PRODUCT_EVENTS]
+            self._cursor = LogCursor(event_types, from_block=self.from_block)
+
+        applied = 0
+        for events in self._cursor.scan(to_block):
+            applied += self._apply_events(events, contract.web3)
+        self.last_block = self._cursor.last_block
+        return applied
+
+    def follow(self, contract, poll_interval=2):
+        """Syncs the index and keeps syncing the new blocks in a daemon thread. The reads go to
+        the contract until the first sync is done.
+
+        :param contract: product contract
+        :type contract: web3.contract.Contract
+        :param poll_interval: seconds between syncs
+        :type poll_interval: int
+        :return: the thread following the chain
+        :rtype: threading.Thread
+        """
+
+        def follow_loop():
+            while True:
+                try:
+                    self.sync(contract)
+                except Exception as e:
+                    print(f"Unable to sync the product index: {e}")
+                time.sleep(poll_interval)
+
+        thread = threading.Thread(target=follow_loop, name="product-index", daemon=True)
+        thread.start()
+        return thread
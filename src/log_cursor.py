@@ -0,0 +1,238 @@
+# stdlib
+import json
+import os
+import threading
+import time
+
+# deps
+import requests
+from eth_utils import event_abi_to_log_topic
+from web3 import Web3
+from web3._utils.events import get_event_data
+
+
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", ".checkpoints")
+
+# error messages of the providers refusing a too large eth_getLogs query
+RANGE_ERRORS = (
+    "block range",
+    "more than",
+    "too many",
+    "too large",
+    "too wide",
+    "response size",
+    "exceed maximum",
+    "limited to",
+)
+
+
+def event_topics(event_types):
+    """Maps the topic of each event to its abi.
+
+    :param event_types: contract events, e.g. ``contract.events.NewProduct``
+    :type event_types: list[web3.contract.ContractEvent]
+    :rtype: dict[bytes, dict]
+    """
+    topics = {}
+    for event_type in event_types:
+        event_abi = event_type._get_event_abi()
+        topics[event_abi_to_log_topic(event_abi)] = event_abi
+    return topics
+
+
+def is_range_error(error):
+    """Returns whether the error means that the queried block range must be smaller.
+
+    :param error: error raised by eth_getLogs
+    :type error: Exception
+    :rtype: bool
+    """
+    if isinstance(error, requests.Timeout):
+        # the node gave up reading the range
+        return True
+    if not isinstance(error, ValueError) or not error.args:
+        return False
+    message = error.args[0]
+    if isinstance(message, dict):
+        message = message.get("message", "")
+    return any(text in str(message).lower() for text in RANGE_ERRORS)
+
+
+class LogCursor:
+    """Reads the logs of some contract events with eth_getLogs over block ranges.
+
+    The range size grows while the queries return few results fast and shrinks when they are
+    slow, return many results or are refused by the provider. The last processed block can be
+    persisted to a checkpoint file, so a restarted cursor resumes where it stopped. The entries
+    of ``get_new_entries`` are processed once they are marked ``handled``, the checkpoint stays
+    before the lowest block with an unhandled entry.
+    """
+
+    def __init__(
+        self,
+        event_types,
+        from_block=0,
+        checkpoint_path=None,
+        chunk_size=2000,
+        min_chunk_size=1,
+        max_chunk_size=100000,
+        target_results=1000,
+        target_latency=2,
+    ):
+        """
+        :param event_types: contract events to read, from the same contract
+        :type event_types: list[web3.contract.ContractEvent]
+        :param from_block: first block to read if there is no checkpoint
+        :type from_block: int
+        :param checkpoint_path: file to persist the last processed block to
+        :type checkpoint_path: str
+        :param chunk_size: initial amount of blocks per query
+        :type chunk_size: int
+        :param target_results: amount of logs per query above which the range shrinks
+        :type target_results: int
+        :param target_latency: seconds per query above which the range shrinks
+        :type target_latency: float
+        """
+        self.w3 = event_types[0].web3
+        self.address = event_types[0].address
+        self.topics = event_topics(event_types)
+        self.checkpoint_path = checkpoint_path
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.target_results = target_results
+        self.target_latency = target_latency
+        self.last_block = self.load_checkpoint(from_block - 1)
+        # last block read, ahead of the checkpoint while its entries are handled
+        self.read_block = self.last_block
+        # block number -> amount of its entries not handled yet
+        self._unhandled = {}
+        # the entries can be marked handled in another thread than the one reading them
+        self._lock = threading.Lock()
+        self.head = None
+
+    @property
+    def caught_up(self):
+        return self.head is not None and self.read_block >= self.head
+
+    def load_checkpoint(self, default):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return default
+        with open(self.checkpoint_path) as checkpoint_file:
+            return json.load(checkpoint_file)["last_block"]
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as checkpoint_file:
+            json.dump({"last_block": self.last_block}, checkpoint_file)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def decode(self, log):
+        return get_event_data(self.w3.codec, self.topics[bytes(log["topics"][0])], log)
+
+    def _adapt(self, results, latency):
+        if results > self.target_results or latency > self.target_latency:
+            self.chunk_size = max(self.min_chunk_size, self.chunk_size // 2)
+        elif results < self.target_results // 2 and latency < self.target_latency / 2:
+            self.chunk_size = min(self.max_chunk_size, self.chunk_size * 2)
+
+    def _next_chunk(self):
+        """Reads the logs of the next block range, shrinking it until the provider accepts it.
+
+        :return: last block of the range and its decoded logs
+        :rtype: tuple[int, list]
+        """
+        start = self.read_block + 1
+        while True:
+            end = min(start + self.chunk_size - 1, self.head)
+            started = time.monotonic()
+            try:
+                logs = self.w3.eth.get_logs(
+                    {
+                        "address": self.address,
+                        "fromBlock": start,
+                        "toBlock": end,
+                        "topics": [[Web3.toHex(topic) for topic in self.topics]],
+                    }
+                )
+            except Exception as e:
+                span = end - start + 1
+                if not is_range_error(e) or span <= self.min_chunk_size:
+                    raise
+                # half of the refused range, which can be smaller than the chunk near the head
+                self.chunk_size = max(self.min_chunk_size, span // 2)
+                continue
+            self._adapt(len(logs), time.monotonic() - started)
+            return end, [self.decode(log) for log in logs]
+
+    def _commit(self, end):
+        self.read_block = max(self.read_block, end)
+        self.last_block = end
+        self.save_checkpoint()
+
+    def scan(self, to_block=None):
+        """Yields the decoded logs one block range at a time up to ``to_block``. The range is
+        checkpointed once the caller asks for the next one.
+
+        :param to_block: last block to read, the current block by default
+        :type to_block: int
+        :rtype: Iterator[list[web3.datastructures.AttributeDict]]
+        """
+        self.head = self.w3.eth.block_number if to_block is None else to_block
+        while self.read_block < self.head:
+            end, entries = self._next_chunk()
+            yield entries
+            self._commit(end)
+
+    def get_new_entries(self, max_entries=1000):
+        """Reads the logs after the last read block, like a web3 filter, stopping at the current
+        block or once ``max_entries`` logs are read. Their blocks are checkpointed once every
+        entry is marked ``handled``. If a range fails after others were read, the logs read so
+        far are returned and the failed range is read on the next call.
+
+        :rtype: list[web3.datastructures.AttributeDict]
+        """
+        self.head = self.w3.eth.block_number
+        entries = []
+        while self.read_block < self.head and len(entries) < max_entries:
+            try:
+                end, chunk_entries = self._next_chunk()
+            except Exception as e:
+                if not entries:
+                    raise
+                print(f"Unable to read the logs after block {self.read_block}: {e!r}")
+                break
+            # registered before the read block moves past them, so they're checkpointed once handled
+            with self._lock:
+                for entry in chunk_entries:
+                    count = self._unhandled.get(entry.blockNumber, 0)
+                    self._unhandled[entry.blockNumber] = count + 1
+                self.read_block = end
+            entries.extend(chunk_entries)
+        with self._lock:
+            self._commit_handled()
+        return entries
+
+    def handled(self, entry):
+        """Marks an entry returned by ``get_new_entries`` as handled.
+
+        :param entry: decoded log
+        :type entry: web3.datastructures.AttributeDict
+        """
+        block_number = entry.blockNumber
+        with self._lock:
+            self._unhandled[block_number] -= 1
+            if not self._unhandled[block_number]:
+                del self._unhandled[block_number]
+            self._commit_handled()
+
+    def _commit_handled(self):
+        # up to the block before the lowest one with unhandled entries
+        end = min(self._unhandled) - 1 if self._unhandled else self.read_block
+        if end > self.last_block:
+            self._commit(end)
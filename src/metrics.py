@@ -0,0 +1,231 @@
+# stdlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_PORT = os.getenv("METRICS_PORT")
+
+# latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter per label values."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """Distribution of observed values, e.g. latencies, in cumulative buckets per label values."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total, count = self._values.get(labels, ([0] * len(self.buckets), 0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[labels] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, *labels)
+
+    def count(self, *labels):
+        with self._lock:
+            return self._values.get(labels, (None, 0, 0))[2]
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(c), s, n) for labels, (c, s, n) in self._values.items()]
+        for labels, counts, total, count in sorted(values, key=lambda item: item[0]):
+            for bound, bucket_count in zip(self.buckets, counts):
+                extra = (("le", bound),)
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, extra)} {bucket_count}"
+            extra = (("le", "+Inf"),)
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, extra)} {count}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Renders every metric in the Prometheus text format.
+
+        :rtype: str
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+rpc_requests = registry.register(
+    Counter("rpc_requests_total", "JSON-RPC requests sent to the provider.", ("method",))
+)
+rpc_errors = registry.register(
+    Counter("rpc_errors_total", "JSON-RPC requests failed or answered with an error.", ("method",))
+)
+rpc_latency = registry.register(
+    Histogram("rpc_request_duration_seconds", "JSON-RPC request latency.", ("method",))
+)
+rpc_endpoint_requests = registry.register(
+    Counter(
+        "rpc_endpoint_requests_total", "JSON-RPC requests per endpoint.", ("endpoint", "outcome")
+    )
+)
+rpc_hedged = registry.register(
+    Counter("rpc_hedged_requests_total", "Reads also sent to a second endpoint.", ("method",))
+)
+http_latency = registry.register(
+    Histogram(
+        "http_request_duration_seconds", "API request latency.", ("route", "method", "status")
+    )
+)
+signer_requests = registry.register(
+    Counter("signer_requests_total", "Calls to the signer microservice.", ("route", "outcome"))
+)
+signer_latency = registry.register(
+    Histogram("signer_request_duration_seconds", "Signer microservice latency.", ("route",))
+)
+events = registry.register(
+    Counter("events_total", "Contract events through the event pipeline.", ("event", "stage"))
+)
+event_latency = registry.register(
+    Histogram("event_handling_duration_seconds", "Event handling latency.", ("event",))
+)
+signings = registry.register(
+    Counter("signings_total", "Signing requests of the signer service.", ("route", "outcome"))
+)
+signing_latency = registry.register(
+    Histogram("signing_duration_seconds", "Signing latency of the signer service.", ("route",))
+)
+transactions = registry.register(
+    Counter("transactions_total", "Transactions through the submission pipeline.", ("status",))
+)
+
+
+@contextmanager
+def track(counter, histogram, *labels):
+    """Times the block in ``histogram`` and counts it in ``counter`` with an extra ``ok`` or
+    ``error`` outcome label.
+    """
+    started = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        counter.inc(*labels, "error")
+        raise
+    else:
+        counter.inc(*labels, "ok")
+    finally:
+        histogram.observe(time.monotonic() - started, *labels)
+
+
+def rpc_metrics_middleware(make_request, w3):
+    """Web3 middleware counting the requests, errors and latency of each JSON-RPC method."""
+
+    def middleware(method, params):
+        started = time.monotonic()
+        try:
+            response = make_request(method, params)
+        except Exception:
+            rpc_errors.inc(method)
+            raise
+        finally:
+            rpc_requests.inc(method)
+            rpc_latency.observe(time.monotonic() - started, method)
+        if "error" in response:
+            rpc_errors.inc(method)
+        return response
+
+    return middleware
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serves the metrics of a process without an api, e.g. the event listener, on ``port``.
+
+    :param port: port to listen on, the metrics are not served if it's not set
+    :type port: int
+    :return: the server, None if no port is set
+    :rtype: ThreadingHTTPServer
+    """
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("", int(port)), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
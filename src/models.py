@@ -1,4 +1,21 @@
+# stdlib
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from json.encoder import encode_basestring_ascii
+
+# deps
+from eth_utils import to_checksum_address
+
+
 class Product:
+    """Product of the contract. Listings build one per product, so it has no ``__dict__`` and
+    serializes itself to JSON without an intermediate dict.
+    """
+
+    __slots__ = ("name", "status", "owner", "new_owner")
+
     def __init__(self, name, status, owner, new_owner):
         self.name = name
         self.status = status
@@ -13,12 +30,77 @@ class Product:
             "new_owner": self.new_owner,
         }
 
+    def to_json(self):
+        """Serializes the product to the JSON of ``to_dict``.
+
+        :rtype: str
+        """
+        return '{"name":%s,"status":%d,"owner":%s,"new_owner":%s}' % (
+            encode_basestring_ascii(self.name),
+            self.status,
+            encode_basestring_ascii(self.owner),
+            encode_basestring_ascii(self.new_owner),
+        )
+
+
+def address_key(address):
+    """Normalizes an address to its 20 bytes, whatever its case or prefix.
+
+    :param address: wallet address
+    :type address: str
+    :rtype: bytes
+    """
+    value = address[2:] if address[:2].lower() == "0x" else address
+    try:
+        key = bytes.fromhex(value)
+    except ValueError:
+        key = b""
+    if len(key) != 20:
+        raise ValueError(f"Invalid address {address}")
+    return key
+
 
 class WatchList:
-    _subscribers = []
+    """Set of the addresses subscribed to the delegation events, shared by every instance.
+
+    The addresses are kept as 20 byte keys, so checks are O(1) and case insensitive. With
+    ``WATCHLIST_DB`` set they are persisted to that SQLite file and loaded on first use.
+    """
+
+    db_path = os.getenv("WATCHLIST_DB")
+    _subscribers = set()
+    _loaded = False
+    _lock = threading.Lock()
+
+    def _load(self):
+        if WatchList._loaded:
+            return
+        with WatchList._lock:
+            if WatchList._loaded:
+                return
+            if self.db_path:
+                with closing(sqlite3.connect(self.db_path)) as conn:
+                    conn.execute("CREATE TABLE IF NOT EXISTS watchlist (address BLOB PRIMARY KEY)")
+                    rows = conn.execute("SELECT address FROM watchlist").fetchall()
+                self._subscribers.update(bytes(row[0]) for row in rows)
+            WatchList._loaded = True
+
+    def _store(self, statement, keys):
+        if not self.db_path or not keys:
+            return
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            with conn:
+                conn.executemany(statement, [(key,) for key in keys])
 
     def get_subscribers(self):
-        return self._subscribers.copy()
+        """Returns the subscribed addresses, checksummed.
+
+        :rtype: list[str]
+        """
+        self._load()
+        with WatchList._lock:
+            keys = list(self._subscribers)
+        return [to_checksum_address(key) for key in keys]
 
     def subscribe(self, address):
         """Add an address to the subscriber list
@@ -26,7 +108,20 @@ class WatchList:
         :param address: wallet address to add
         :type address: str
         """
-        self._subscribers.append(address)
+        self.subscribe_many([address])
+
+    def subscribe_many(self, addresses):
+        """Add several addresses to the subscriber list, in a single write.
+
+        :param addresses: wallet addresses to add
+        :type addresses: list[str]
+        """
+        keys = {address_key(address) for address in addresses}
+        self._load()
+        with WatchList._lock:
+            keys -= self._subscribers
+            self._subscribers.update(keys)
+            self._store("INSERT OR IGNORE INTO watchlist (address) VALUES (?)", keys)
 
     def unsubscribe(self, address):
         """Removes an address to the subscriber list.
@@ -34,7 +129,20 @@ class WatchList:
         :param address: wallet address to remove from the subscribers
         :type address: str
         """
-        self._subscribers.remove(address)
+        self.unsubscribe_many([address])
+
+    def unsubscribe_many(self, addresses):
+        """Removes several addresses from the subscriber list, in a single write.
+
+        :param addresses: wallet addresses to remove from the subscribers
+        :type addresses: list[str]
+        """
+        keys = {address_key(address) for address in addresses}
+        self._load()
+        with WatchList._lock:
+            keys &= self._subscribers
+            self._subscribers.difference_update(keys)
+            self._store("DELETE FROM watchlist WHERE address = ?", keys)
 
     def is_subscribed(self, address):
         """Returns a boolean indicating if the given address is in the subscription list or not.
@@ -42,4 +150,9 @@ class WatchList:
         :param address: address to check
         :type address: str
         """
-        return address in self._subscribers
+        try:
+            key = address_key(address)
+        except ValueError:
+            return False
+        self._load()
+        return key in self._subscribers
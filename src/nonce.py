@@ -0,0 +1,94 @@
+# stdlib
+import threading
+
+
+# errors of the nodes rejecting a transaction because of its nonce
+NONCE_ERRORS = ("nonce too low", "replacement transaction underpriced")
+# error of the nodes already holding the same transaction in their pool
+ALREADY_KNOWN = "already known"
+
+
+def _error_message(error):
+    message = error.args[0] if error.args else ""
+    if isinstance(message, dict):
+        message = message.get("message", "")
+    return str(message).lower()
+
+
+def is_nonce_error(error):
+    """Returns whether a node rejected the transaction because its nonce is already used.
+
+    :param error: error raised when sending the transaction
+    :type error: Exception
+    :rtype: bool
+    """
+    message = _error_message(error)
+    return any(text in message for text in NONCE_ERRORS)
+
+
+def is_already_known(error):
+    """Returns whether a node refused the transaction because it already has it, i.e. it was sent.
+
+    :param error: error raised when sending the transaction
+    :type error: Exception
+    :rtype: bool
+    """
+    return ALREADY_KNOWN in _error_message(error)
+
+
+class NonceManager:
+    """Hands out the nonces of each account locally, so transactions from the same account can be
+    sent concurrently. The next nonce of an account is read from the chain the first time and
+    after a resync.
+    """
+
+    def __init__(self):
+        self._nonces = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _address_lock(self, address):
+        with self._lock:
+            return self._locks.setdefault(address.lower(), threading.Lock())
+
+    def allocate(self, w3, address):
+        """Returns the next nonce of the account.
+
+        :param w3: web3 instance, to read the transaction count of the account
+        :type w3: Web3
+        :param address: account address
+        :type address: str
+        :rtype: int
+        """
+        key = address.lower()
+        with self._address_lock(address):
+            if key not in self._nonces:
+                self._nonces[key] = w3.eth.get_transaction_count(address, "pending")
+            nonce = self._nonces[key]
+            self._nonces[key] += 1
+            return nonce
+
+    def release(self, address, nonce):
+        """Gives back a nonce of a transaction that was not sent. If later nonces were already
+        handed out the account is resynced, as the gap would block them.
+
+        :param address: account address
+        :type address: str
+        :param nonce: nonce not used
+        :type nonce: int
+        """
+        key = address.lower()
+        with self._address_lock(address):
+            if self._nonces.get(key) == nonce + 1:
+                self._nonces[key] = nonce
+            else:
+                self._nonces.pop(key, None)
+
+    def resync(self, address):
+        """Forgets the next nonce of the account, it's read from the chain on the next allocation.
+
+        :param address: account address
+        :type address: str
+        """
+        with self._address_lock(address):
+            self._nonces.pop(address.lower(), None)
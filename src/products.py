@@ -1,52 +1,245 @@
 # stdlib
-import json
 import os
 
 # deps
-import requests
+from eth_utils import keccak
+from hexbytes import HexBytes
 from web3 import exceptions as web3Exceptions
 
 # local
-from src.connection import contract, w3
+from src.batch import DEFAULT_BATCH_SIZE, batching_enabled
+from src.call_cache import BlockPin, CallCache, block_key
+from src.connection import contract, created_block, w3
+from src.fees import FeeCache, FeeTracker, GasTable
+from src.index import ProductIndex, index_key
+from src.metrics import signer_latency, signer_requests, track
 from src.models import Product
+from src.nonce import NonceManager, is_already_known, is_nonce_error
+from src.sessions import HTTP_TIMEOUT, get_session
+from src.store import ProductStore
 
 from .exceptions import ProductDoesNotExists
 
 
-def send_transaction(transaction, acc_address):
-    """Build a transaction and send it.
+PRODUCT_DB = os.getenv("PRODUCT_DB")
+
+if PRODUCT_DB:
+    product_index = ProductStore(PRODUCT_DB, from_block=created_block)
+else:
+    product_index = ProductIndex(from_block=created_block)
+nonce_manager = NonceManager()
+fee_cache = FeeCache()
+gas_table = GasTable()
+fee_tracker = FeeTracker(w3, fee_cache, gas_table)
+block_pin = BlockPin()
+
+
+def pinned_block_hash(block_number):
+    """Returns the hash of a block number if it's the pinned block, the call results at other
+    block numbers are not cached as a reorg can replace them.
+
+    :param block_number: block number
+    :type block_number: int
+    :rtype: str
+    """
+    return block_pin.block_hash(block_number)
+
+
+call_cache = CallCache(block_hash=pinned_block_hash)
+
+# products read in the same batch as the products amount while no amount was read yet
+HEAD_SIZE = 10
+# products amount of the last listing, the products are never removed so it only grows
+last_products_amount = None
+
+
+def build_transaction(transaction, acc_address):
+    """Builds a transaction with the next nonce of the address and the cached gas limit and gas
+    price. The nonce is given back if the transaction can't be built.
 
     :param transaction: transaction function
     :type transaction: function
     :param acc_address: address to send the transaction from
     :type acc_address: str
+    :return: the transaction ready to sign
+    :rtype: dict
     """
+    nonce = nonce_manager.allocate(w3, acc_address)
     try:
-        tx = transaction.buildTransaction(
+        return transaction.buildTransaction(
             {
                 "from": acc_address,
-                "gas": 210000,
-                "gasPrice": w3.eth.gas_price,
-                "nonce": w3.eth.get_transaction_count(acc_address),
+                "gas": gas_table.gas(transaction, acc_address),
+                "gasPrice": fee_cache.gas_price(w3),
+                "nonce": nonce,
             }
         )
+    except Exception:
+        nonce_manager.release(acc_address, nonce)
+        raise
+
+
+def send_raw_transaction(raw_transaction):
+    """Sends a signed transaction. A node answering that it already has the transaction got it
+    before, e.g. from a retried request, so its hash is returned instead of an error.
+
+    :param raw_transaction: signed transaction
+    :type raw_transaction: str
+    :return: transaction hash
+    :rtype: HexBytes
+    """
+    try:
+        return w3.eth.send_raw_transaction(raw_transaction)
+    except Exception as e:
+        if not is_already_known(e):
+            raise
+        return HexBytes(keccak(HexBytes(raw_transaction)))
+
+
+def send_transaction(transaction, acc_address, retry_nonce=True):
+    """Build a transaction and send it.
+
+    The nonce is handed out by the local nonce manager, so transactions from the same address can
+    be sent concurrently. If the node rejects the nonce, the address is resynced from the chain
+    and the transaction is sent once more. The gas price and the gas limit of each contract
+    function are cached.
+
+    :param transaction: transaction function
+    :type transaction: function
+    :param acc_address: address to send the transaction from
+    :type acc_address: str
+    :param retry_nonce: send the transaction again if its nonce is rejected
+    :type retry_nonce: bool
+    """
+    try:
+        tx = build_transaction(transaction, acc_address)
     except web3Exceptions.InvalidAddress:
         return {"error": "Invalid address"}
+    nonce = tx["nonce"]
     try:
         # call microservice to sign tx
-        signed_tx = requests.request(
-            "GET",
-            os.getenv("SIGN_URL"),
-            headers={"content-type": "application/json"},
-            json=json.dumps(tx),
-        ).json()
-        hash_tx = w3.eth.send_raw_transaction(signed_tx["rawTransaction"])
+        with track(signer_requests, signer_latency, "sign"):
+            signed_tx = (
+                get_session()
+                .request(
+                    "GET",
+                    os.getenv("SIGN_URL"),
+                    headers={"content-type": "application/json"},
+                    json=tx,
+                    timeout=HTTP_TIMEOUT,
+                )
+                .json()
+            )
+        hash_tx = send_raw_transaction(signed_tx["rawTransaction"])
     except Exception as e:
         print(e.args[0])
+        if not is_nonce_error(e):
+            nonce_manager.release(acc_address, nonce)
+            return {"error": "Something went wrong, try again."}
+        nonce_manager.resync(acc_address)
+        if retry_nonce:
+            return send_transaction(transaction, acc_address, retry_nonce=False)
         return {"error": "Something went wrong, try again."}
+    gas_table.track(hash_tx, transaction)
+    # the next reads see the transaction as soon as it's mined
+    block_pin.expire()
     return hash_tx
 
 
+def sign_transactions(txs):
+    """Signs several transactions with a single call to the signer microservice.
+
+    :param txs: built transactions
+    :type txs: list[dict]
+    :return: the signed transaction, or an error, of each transaction in the same order
+    :rtype: list[dict]
+    """
+    with track(signer_requests, signer_latency, "batch"):
+        response = (
+            get_session()
+            .post(
+                f"{os.getenv('SIGN_URL').rstrip('/')}/batch",
+                json=txs,
+                timeout=HTTP_TIMEOUT,
+            )
+            .json()
+        )
+    if "error" in response:
+        raise Exception(response["error"])
+    return response["results"]
+
+
+def send_transactions(transactions, acc_address):
+    """Build several transactions from the same address, sign them in one signer call and send
+    them in nonce order. After the first transaction that can't be sent the rest are not sent.
+
+    :param transactions: transaction functions
+    :type transactions: list[function]
+    :param acc_address: address to send the transactions from
+    :type acc_address: str
+    :return: the hash of each transaction, or an error, in the same order
+    :rtype: list
+    """
+    nonces = []
+    txs = []
+    try:
+        for transaction in transactions:
+            nonces.append(nonce_manager.allocate(w3, acc_address))
+            txs.append(
+                transaction.buildTransaction(
+                    {
+                        "from": acc_address,
+                        "gas": gas_table.gas(transaction, acc_address),
+                        "gasPrice": fee_cache.gas_price(w3),
+                        "nonce": nonces[-1],
+                    }
+                )
+            )
+        signed_txs = sign_transactions(txs) if txs else []
+    except Exception as e:
+        for nonce in reversed(nonces):
+            nonce_manager.release(acc_address, nonce)
+        if isinstance(e, web3Exceptions.InvalidAddress):
+            return {"error": "Invalid address"}
+        print(e.args[0])
+        return {"error": "Something went wrong, try again."}
+
+    results = []
+    failed = False
+    for transaction, signed_tx in zip(transactions, signed_txs):
+        if failed:
+            results.append({"error": "Not sent, a previous transaction failed."})
+            continue
+        try:
+            hash_tx = send_raw_transaction(signed_tx["rawTransaction"])
+        except Exception as e:
+            print(signed_tx.get("error") or e.args[0])
+            results.append({"error": "Something went wrong, try again."})
+            failed = True
+            continue
+        gas_table.track(hash_tx, transaction)
+        results.append(hash_tx)
+    block_pin.expire()
+    if failed:
+        # the nonces after the failed transaction are not used
+        nonce_manager.resync(acc_address)
+    return results
+
+
+def create_products(names, acc_address):
+    """Creates several products from an address as owner, signing them in one signer call.
+
+    :param names: names of the products
+    :type names: list[str]
+    :param acc_address: account address
+    :type acc_address: str
+    :return: hash of each transaction, or an error
+    :rtype: list
+    """
+    txs = [contract.functions.createProduct(name) for name in names]
+    return send_transactions(txs, acc_address)
+
+
 def create_product(name, acc_address):
     """Creates a new product with a given name from an address as owner.
 
@@ -91,67 +284,300 @@ def accept_product(product_id, acc_address):
     return send_transaction(tx, acc_address)
 
 
-def get_product(product_id):
-    """Get a product by id
+def start_product_index(poll_interval=2):
+    """Builds the local product index from the contract events and keeps it up to date.
+
+    :param poll_interval: seconds between index syncs
+    :type poll_interval: int
+    :return: the thread following the chain
+    :rtype: threading.Thread
+    """
+    return product_index.follow(contract, poll_interval)
+
+
+def start_fee_tracker():
+    """Expires the cached gas price on each new block and learns the gas of the functions from the
+    receipts of the transactions sent by this process.
+
+    :return: the thread following the chain
+    :rtype: threading.Thread
+    """
+    return fee_tracker.start()
+
+
+def pinned_block(block=None):
+    """Returns the block the reads are pinned to, the current block by default.
+
+    :param block: block number or block hash requested
+    :type block: int or str
+    :rtype: int or str
+    """
+    return block_pin.block_number(w3) if block is None else block
+
+
+def resolve_block(block=None):
+    """Resolves the block of a read request once, so the ETag of the response and its reads
+    agree. Without the index it's the current block when none is requested.
+
+    :param block: block number or block hash requested
+    :type block: int or str
+    :return: the block to tag and read at, None while the index answers
+    :rtype: int or str
+    """
+    if block is not None or product_index.ready:
+        return block
+    return pinned_block()
+
+
+def read_block(block=None):
+    """Returns the block the reads answer at. While the index answers, the products it hasn't
+    seen are read at its last synced block, so its version tags the whole response.
+
+    :param block: block number or block hash requested
+    :type block: int or str
+    :rtype: int or str
+    """
+    if _use_index(block):
+        return product_index.last_block
+    return pinned_block(block)
+
+
+def state_version(block=None):
+    """Version of the contract state the reads answer from, to tag the responses with. A
+    requested block never changes, the index only changes with the product events, the reads
+    it can't answer are made at its last synced block, and otherwise the state changes with every
+    block.
+
+    :param block: block number or hash requested
+    :type block: int or str
+    :rtype: str
+    """
+    if block is not None:
+        return f"block-{block_key(block)}"
+    if product_index.ready:
+        return f"index-{product_index.version}"
+    return f"block-{block_pin.block_number(w3)}"
+
+
+def get_product(product_id, block=None):
+    """Get a product by id, from the product index if it has seen it or from the contract.
 
     :param product_id: product id
     :type product_id: int
+    :param block: block number or hash to read the product at, the current block by default. A
+        requested block is always read from the contract, the index only knows its last block.
+    :type block: int or str
     :return: product
     :rtype: list
     """
-    try:
-        product = contract.functions.products(product_id).call()
-    except web3Exceptions.ContractLogicError:
+    product = product_index.get(product_id) if block is None else None
+    if product is not None:
+        return product
+    (product,) = call_cache.call([contract.functions.products(product_id)], read_block(block))
+    if isinstance(product, web3Exceptions.ContractLogicError):
         raise ProductDoesNotExists(product_id)
-    return Product(product[0], product[1], product[2], product[3])
+    if isinstance(product, Exception):
+        raise product
+    product = Product(product[0], product[1], product[2], product[3])
+    if product_index.ready and block is None:
+        # the next index syncs will keep it up to date
+        product_index.put(product_id, product)
+    return product
 
 
-def get_products():
+def _use_index(block):
+    return product_index.ready and block is None
+
+
+def _head_size(start, limit):
+    """Amount of products to read with the products amount, up to the amount of the last listing
+    so the products past the end aren't requested, or ``HEAD_SIZE`` before the first one.
+    """
+    head_size = DEFAULT_BATCH_SIZE if limit is None else min(limit, DEFAULT_BATCH_SIZE)
+    if last_products_amount is None:
+        return min(head_size, HEAD_SIZE)
+    return max(0, min(head_size, last_products_amount - start))
+
+
+def _read_head(start, limit, block):
+    """Reads the products amount. Without an index the first chunk of products from ``start``
+    is requested in the same batch.
+
+    :return: pinned block, products amount and the results of the products read by id
+    :rtype: tuple[int, int, dict]
+    """
+    global last_products_amount
+    use_index = _use_index(block)
+    block = read_block(block)
+    head_ids = []
+    if not use_index and batching_enabled(w3):
+        head_ids = list(range(start, start + _head_size(start, limit)))
+    products_amount, *head = call_cache.call(
+        [contract.functions.size()] + [contract.functions.products(i) for i in head_ids], block
+    )
+    if isinstance(products_amount, Exception):
+        raise products_amount
+    last_products_amount = products_amount
+    return block, products_amount, {i: r for i, r in zip(head_ids, head) if i < products_amount}
+
+
+def _read_range(start, stop, fetched, block, use_index):
+    """Yields the products between ``start`` and ``stop`` one chunk at a time, from the index or
+    read from the contract at ``block`` in JSON-RPC batches.
+
+    :param fetched: results of products already read by id
+    :type fetched: dict
+    :rtype: Iterator[tuple[int, Product]]
+    """
+    for chunk_start in range(start, stop, DEFAULT_BATCH_SIZE):
+        ids = range(chunk_start, min(chunk_start + DEFAULT_BATCH_SIZE, stop))
+        indexed = product_index.get_range(ids.start, ids.stop) if use_index else {}
+        missing = [i for i in ids if i not in fetched and indexed.get(i) is None]
+        fetched.update(
+            zip(missing, call_cache.call([contract.functions.products(i) for i in missing], block))
+        )
+        for i in ids:
+            if i not in fetched:
+                yield i, indexed[i]
+                continue
+            result = fetched.pop(i)
+            if isinstance(result, Exception):
+                print(f"Unable to get product {i}")
+                continue
+            product = Product(*result)
+            if use_index:
+                product_index.put(i, product)
+            yield i, product
+
+
+def iter_products(start=0, limit=None, block=None):
+    """Iterates over the products from the id ``start``, reading them from the contract one chunk
+    at a time so the first products are available before the whole listing is read.
+
+    All the contract reads are pinned to the same block, so the listing is consistent.
+
+    :param start: first product id
+    :type start: int
+    :param limit: max amount of product ids to read, all the remaining by default
+    :type limit: int
+    :param block: block number or hash to read the products at, the current block by default
+    :type block: int or str
+    :return: product ids and products
+    :rtype: Iterator[tuple[int, Product]]
+    """
+    use_index = _use_index(block)
+    block, products_amount, fetched = _read_head(start, limit, block)
+    stop = products_amount if limit is None else min(products_amount, start + limit)
+    yield from _read_range(start, stop, fetched, block, use_index)
+
+
+def get_products_page(cursor=0, limit=DEFAULT_BATCH_SIZE, block=None):
+    """Get a page of products
+
+    :param cursor: first product id of the page
+    :type cursor: int
+    :param limit: amount of product ids in the page
+    :type limit: int
+    :param block: block number or hash to read the products at, the current block by default
+    :type block: int or str
+    :return: products of the page and the cursor of the next page, None on the last page
+    :rtype: dict
+    """
+    use_index = _use_index(block)
+    block, products_amount, fetched = _read_head(cursor, limit, block)
+    stop = min(products_amount, cursor + limit)
+    products = [
+        product.to_dict() for _, product in _read_range(cursor, stop, fetched, block, use_index)
+    ]
+    return {"products": products, "next_cursor": stop if stop < products_amount else None}
+
+
+def get_products(block=None):
     """Get all products
 
+    The products the index has not seen are read from the contract in JSON-RPC batches.
+
+    :param block: block number or hash to read the products at, the current block by default
+    :type block: int or str
     :return: list of products
     :rtype: list[dict]
     """
-    products_amount = contract.functions.size().call()
-    products = []
-    for i in range(products_amount):
-        try:
-            products.append(get_product(i).to_dict())
-        except ProductDoesNotExists:
-            print(f"Unable to get product {i}")
-            continue
-    return products
+    return [product.to_dict() for _, product in iter_products(block=block)]
 
 
-def get_product_by_name(name):
+def get_product_by_name(name, block=None):
     """Get a product by name
 
     :param name: name of the product to search for
     :param type: str
+    :param block: block number or hash to read the products at, the current block by default
+    :type block: int or str
     :return: product event creation that matches the given name
     :rtype: list[Product]
     """
-    products = get_products()
+    if _use_index(block):
+        return [product.to_dict() for _, product in product_index.find(name=name)]
+    products = get_products(block)
     return list(filter(lambda p: p["name"] == name, products))
 
 
-def get_delegated_products():
+def get_products_by_status(status, block=None):
+    """Filter products by status
+
+    :param status: status to filter by, 0 for owned and 1 for delegated products.
+    :type status: int
+    :param block: block number or hash to read the products at, the current block by default
+    :type block: int or str
+    :return: products with the given status.
+    :rtype: list[Product]
+    """
+    if _use_index(block):
+        return [product.to_dict() for _, product in product_index.find(status=status)]
+    products = get_products(block)
+    return list(filter(lambda p: p["status"] == status, products))
+
+
+def get_delegated_products(block=None):
     """Gets products that are currently delegated but not accepted yet.
 
+    :param block: block number or hash to read the products at, the current block by default
+    :type block: int or str
     :return: list of products delegated
     :rtype: list[Product]
     """
-    products = get_products()
-    return list(filter(lambda p: p["status"] == 1, products))
+    return get_products_by_status(1, block)
 
 
-def get_delegated_products_by_owner(owner):
+def get_delegated_products_by_owner(owner, block=None):
     """Filter products by owner
 
     :param owner: owner to filter by.
     :type owner: str
+    :param block: block number or hash to read the products at, the current block by default
+    :type block: int or str
     :return: products with a given owner.
     :rtype: list[Product]
     """
-    products = get_products()
-    return list(filter(lambda p: p["owner"] == owner, products))
+    if _use_index(block):
+        return [product.to_dict() for _, product in product_index.find(owner=owner)]
+    products = get_products(block)
+    # addresses are compared case insensitive, like the index does
+    owner = index_key("owner", owner)
+    return list(filter(lambda p: index_key("owner", p["owner"]) == owner, products))
+
+
+def get_products_by_new_owner(new_owner, block=None):
+    """Gets the products delegated to an address that are waiting for it to accept them.
+
+    :param new_owner: address the products were delegated to.
+    :type new_owner: str
+    :param block: block number or hash to read the products at, the current block by default
+    :type block: int or str
+    :return: products delegated to the address.
+    :rtype: list[Product]
+    """
+    if _use_index(block):
+        return [product.to_dict() for _, product in product_index.find(new_owner=new_owner)]
+    products = get_products(block)
+    new_owner = index_key("new_owner", new_owner)
+    return list(filter(lambda p: index_key("new_owner", p["new_owner"]) == new_owner, products))
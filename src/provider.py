@@ -0,0 +1,299 @@
+# stdlib
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+# deps
+from web3 import HTTPProvider
+from web3.providers import BaseProvider
+
+# local
+from src.metrics import rpc_endpoint_requests, rpc_hedged
+from src.sessions import HTTP_POOL_SIZE, HTTP_TIMEOUT, get_session
+
+
+RPC_HEDGE = os.getenv("RPC_HEDGE") == "1"
+# delay before hedging a read while an endpoint has too few latencies for its p95
+RPC_HEDGE_DELAY = float(os.getenv("RPC_HEDGE_DELAY", 0.5))
+RPC_ENDPOINT_COOLDOWN = float(os.getenv("RPC_ENDPOINT_COOLDOWN", 30))
+
+EWMA_ALPHA = 0.2
+# endpoints failing more often are only tried again after the cooldown
+MAX_ERROR_RATE = 0.5
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+MIN_HEDGE_DELAY = 0.01
+
+# reads answering the same on every endpoint, sent to a second one when the first is slow
+HEDGED_METHODS = (
+    "eth_call",
+    "eth_getLogs",
+    "eth_blockNumber",
+    "eth_getTransactionReceipt",
+    "eth_getTransactionByHash",
+    "eth_getBlockByNumber",
+    "eth_getBlockByHash",
+    "eth_chainId",
+)
+# writes, and the pending nonces they depend on, are sent to a single endpoint
+STICKY_METHODS = ("eth_sendRawTransaction", "eth_sendTransaction", "eth_getTransactionCount")
+
+# JSON-RPC error of the endpoints refusing a request over their rate limit
+LIMIT_EXCEEDED = -32005
+# JSON-RPC errors of the endpoints lagging behind the block of a pinned read
+MISSING_BLOCK_ERRORS = ("header not found", "unknown block", "block not found")
+
+
+class EndpointError(Exception):
+    """The endpoint couldn't answer a request that another endpoint can answer."""
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+def check_response(response):
+    """Raises if the endpoint is over its rate limit or doesn't have the requested block yet.
+
+    :param response: JSON-RPC response
+    :type response: dict
+    :raises EndpointError: with the response, if another endpoint can answer the request
+    """
+    error = response.get("error")
+    if not isinstance(error, dict):
+        return
+    message = str(error.get("message", ""))
+    if error.get("code") == LIMIT_EXCEEDED:
+        raise EndpointError(message or "limit exceeded", response)
+    if any(text in message.lower() for text in MISSING_BLOCK_ERRORS):
+        raise EndpointError(message, response)
+
+
+class Endpoint:
+    """JSON-RPC endpoint with a moving average of its latency and error rate."""
+
+    def __init__(self, uri, provider=None, alpha=EWMA_ALPHA, cooldown=RPC_ENDPOINT_COOLDOWN):
+        """
+        :param uri: endpoint URL
+        :type uri: str
+        :param provider: provider sending the requests, an HTTP provider to ``uri`` sharing the
+            HTTP session by default
+        :type provider: web3.providers.BaseProvider
+        :param alpha: weight of the last request in the moving averages
+        :type alpha: float
+        :param cooldown: seconds before an endpoint failing too often is tried again
+        :type cooldown: float
+        """
+        self.uri = uri
+        # the url can hold an api key, the metrics only show the host
+        self.name = urlparse(uri).netloc or uri
+        self.provider = provider or HTTPProvider(
+            uri, request_kwargs={"timeout": HTTP_TIMEOUT}, session=get_session()
+        )
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.latency = None
+        self.error_rate = 0.0
+        self.retry_at = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    @property
+    def healthy(self):
+        return self.error_rate < MAX_ERROR_RATE or time.monotonic() >= self.retry_at
+
+    def score(self):
+        """Expected latency of a request, the endpoints not used yet first and the ones that
+        never answered last.
+
+        :rtype: float
+        """
+        if self.latency is None:
+            return 0.0
+        if not self.latencies:
+            return float("inf")
+        return self.latency * (1 + self.error_rate)
+
+    def p95(self):
+        """95th percentile of the last latencies, None with too few of them.
+
+        :rtype: float
+        """
+        with self._lock:
+            if len(self.latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def observe(self, latency, failed):
+        """Adds a request to the averages, the time lost on the failed ones included.
+
+        :param latency: seconds the request took
+        :type latency: float
+        :param failed: the request failed
+        :type failed: bool
+        """
+        with self._lock:
+            self.error_rate += self.alpha * (failed - self.error_rate)
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+            if failed:
+                if self.error_rate >= MAX_ERROR_RATE:
+                    self.retry_at = time.monotonic() + self.cooldown
+                return
+            # the hedging delay follows the answered requests
+            self.latencies.append(latency)
+
+    def timed(self, send, *args):
+        """Calls ``send(*args)`` timing it in the endpoint averages, failed if it raises.
+
+        :param send: function sending a request to the endpoint
+        :type send: function
+        """
+        started = time.monotonic()
+        try:
+            result = send(*args)
+        except Exception:
+            self.observe(time.monotonic() - started, True)
+            rpc_endpoint_requests.inc(self.name, "error")
+            raise
+        self.observe(time.monotonic() - started, False)
+        rpc_endpoint_requests.inc(self.name, "ok")
+        return result
+
+    def _request(self, method, params):
+        response = self.provider.make_request(method, params)
+        check_response(response)
+        return response
+
+    def request(self, method, params):
+        """Sends a request, timing it in the endpoint averages.
+
+        :raises EndpointError: if the endpoint is over its rate limit or behind the requested
+            block
+        """
+        return self.timed(self._request, method, params)
+
+
+class MultiEndpointProvider(BaseProvider):
+    """Provider routing each request to the healthy endpoint with the lowest expected latency.
+
+    The reads fail over to the next endpoint, the reads pinned to a block an endpoint doesn't have
+    yet included, and with ``hedge`` the idempotent ones are also sent to the second best endpoint
+    when the first hasn't answered after its p95 latency, the first answer wins. The writes stay
+    on one endpoint until it fails, so the node holding the pending transactions of an account
+    also hands out its nonces.
+    """
+
+    def __init__(self, endpoint_uris, hedge=RPC_HEDGE, hedge_delay=RPC_HEDGE_DELAY):
+        """
+        :param endpoint_uris: endpoint URLs
+        :type endpoint_uris: list[str]
+        :param hedge: send the slow idempotent reads to a second endpoint
+        :type hedge: bool
+        :param hedge_delay: seconds before hedging while an endpoint has too few latencies
+        :type hedge_delay: float
+        """
+        if not endpoint_uris:
+            raise ValueError("At least one endpoint must be provided")
+        self.endpoints = [Endpoint(uri) for uri in endpoint_uris]
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self._sticky = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint_uri(self):
+        """URL of the best endpoint, for the clients sending their own requests."""
+        return self.best().uri
+
+    def ranked(self):
+        """Returns the endpoints from the best to the worst, the healthy ones first.
+
+        :rtype: list[Endpoint]
+        """
+        return sorted(self.endpoints, key=lambda endpoint: (not endpoint.healthy, endpoint.score()))
+
+    def best(self):
+        return self.ranked()[0]
+
+    def isConnected(self):
+        return any(endpoint.provider.isConnected() for endpoint in self.endpoints)
+
+    def make_request(self, method, params):
+        if method in STICKY_METHODS:
+            return self._sticky_request(method, params)
+        endpoints = self.ranked()
+        if self.hedge and method in HEDGED_METHODS and len(endpoints) > 1:
+            return self._hedged_request(endpoints[0], endpoints[1], method, params)
+        return self.failover(endpoints, method, Endpoint.request, method, params)
+
+    def failover(self, endpoints, method, send, *args):
+        """Calls ``send(endpoint, *args)`` on each endpoint until one of them answers.
+
+        :param endpoints: endpoints to try in order
+        :type endpoints: list[Endpoint]
+        :param method: JSON-RPC method, for the logs
+        :type method: str
+        :param send: function sending the request to an endpoint
+        :type send: function
+        :return: the first answer, or the refusal of the last endpoint
+        """
+        for endpoint in endpoints[:-1]:
+            try:
+                return send(endpoint, *args)
+            except Exception as e:
+                print(f"{method} failed on {endpoint.name}, trying the next endpoint: {e!r}")
+        try:
+            return send(endpoints[-1], *args)
+        except EndpointError as e:
+            if e.response is None:
+                raise
+            # no endpoint could answer, web3 raises the error of the response
+            return e.response
+
+    def _sticky_request(self, method, params):
+        with self._lock:
+            if self._sticky is None or not self._sticky.healthy:
+                self._sticky = self.best()
+            endpoint = self._sticky
+        try:
+            return endpoint.request(method, params)
+        except Exception:
+            # not sent again, the transaction could have reached the node
+            with self._lock:
+                self._sticky = None
+            raise
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(HTTP_POOL_SIZE, "rpc-hedge")
+        return self._executor
+
+    def _hedged_request(self, primary, secondary, method, params):
+        executor = self._get_executor()
+        delay = max(MIN_HEDGE_DELAY, primary.p95() or self.hedge_delay)
+        done, pending = wait([executor.submit(primary.request, method, params)], timeout=delay)
+        if not done or next(iter(done)).exception() is not None:
+            pending.add(executor.submit(secondary.request, method, params))
+            rpc_hedged.inc(method)
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    # the slower request goes on in the background, timing its endpoint
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                if isinstance(error, EndpointError) and error.response is not None:
+                    return error.response
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
@@ -0,0 +1,63 @@
+# stdlib
+import os
+import threading
+
+# deps
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 20))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 10))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.3))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def build_session(
+    pool_size=HTTP_POOL_SIZE,
+    retries=HTTP_RETRIES,
+    backoff=HTTP_BACKOFF,
+):
+    """Builds an HTTP session keeping up to ``pool_size`` connections alive per host, retrying
+    the failed connections and the rate limited or unavailable responses with exponential backoff.
+    The POST requests are only retried when they couldn't connect, an answered
+    ``eth_sendRawTransaction`` must not be sent again.
+
+    :param pool_size: connections kept alive per host, the amount of threads sharing the session
+    :type pool_size: int
+    :param retries: max amount of retries per request
+    :type retries: int
+    :param backoff: backoff factor between retries, in seconds
+    :type backoff: float
+    :rtype: requests.Session
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 502, 503, 504),
+        # POST is left out, the JSON-RPC requests include the transactions sent
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """Returns the HTTP session shared by the web3 provider and the signer client.
+
+    :rtype: requests.Session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
@@ -0,0 +1,328 @@
+# stdlib
+import json
+import os
+import sqlite3
+
+# local
+from src.index import (
+    PRODUCT_EVENTS,
+    ZERO_ADDRESS,
+    ProductIndex,
+    get_creators,
+    transferred,
+)
+from src.log_cursor import LogCursor
+from src.models import Product
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    new_owner TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_name ON products (name);
+CREATE INDEX IF NOT EXISTS products_status ON products (status);
+CREATE INDEX IF NOT EXISTS products_owner ON products (owner COLLATE NOCASE, status);
+CREATE INDEX IF NOT EXISTS products_new_owner ON products (new_owner COLLATE NOCASE, status);
+
+CREATE TABLE IF NOT EXISTS transfers (
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    from_address TEXT NOT NULL,
+    to_address TEXT NOT NULL,
+    PRIMARY KEY (block_number, log_index)
+);
+CREATE INDEX IF NOT EXISTS transfers_product ON transfers (product_id);
+
+CREATE TABLE IF NOT EXISTS events (
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    transaction_hash TEXT NOT NULL,
+    event TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    args TEXT NOT NULL,
+    PRIMARY KEY (block_number, log_index)
+);
+CREATE INDEX IF NOT EXISTS events_product ON events (product_id);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+FILTER_COLUMNS = {
+    "name": "name = ?",
+    "status": "status = ?",
+    # addresses are compared case insensitive, checksummed or not
+    "owner": "owner = ? COLLATE NOCASE",
+    "new_owner": "new_owner = ? COLLATE NOCASE",
+}
+
+PRODUCT_COLUMNS = "id, name, status, owner, new_owner"
+
+
+def _row_product(row):
+    return row[0], Product(*row[1:])
+
+
+class ProductStore(ProductIndex):
+    """Product table materialized from the contract events into a SQLite file.
+
+    It is synced and read like the in-memory ``ProductIndex``, but the products, their ownership
+    transfers and the raw events are written to disk, each range of logs in one transaction, so a
+    restarted api resumes the sync from the last applied event instead of the creation block.
+    """
+
+    def __init__(self, path, from_block=0):
+        """
+        :param path: SQLite file, created if it doesn't exist
+        :type path: str
+        :param from_block: contract creation block, the first block to sync on an empty store
+        :type from_block: int
+        """
+        super().__init__(from_block)
+        self.path = path
+        self._db = None
+        # the store is only read once this process synced it, a file nobody syncs is stale
+        self._synced = False
+
+    @property
+    def db(self):
+        """Connection to the store, shared by the request threads and the sync thread under the
+        index lock.
+
+        :rtype: sqlite3.Connection
+        """
+        return self.open()
+
+    def open(self):
+        """Opens the store and loads its sync position, on first use so importing the api doesn't
+        touch the file.
+
+        :rtype: sqlite3.Connection
+        """
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    db = sqlite3.connect(self.path, check_same_thread=False)
+                    db.execute("PRAGMA journal_mode=WAL")
+                    db.execute("PRAGMA synchronous=NORMAL")
+                    db.executescript(SCHEMA)
+                    self._load_meta(db)
+                    self._db = db
+        return self._db
+
+    def _load_meta(self, db):
+        meta = dict(db.execute("SELECT key, value FROM meta"))
+        if "last_block" in meta:
+            self.last_block = int(meta["last_block"])
+        if "last_event" in meta:
+            self.last_event = tuple(json.loads(meta["last_event"]))
+
+    def _save_meta(self):
+        values = [("last_event", json.dumps(self.last_event))]
+        if self.last_block is not None:
+            values.append(("last_block", str(self.last_block)))
+        self.db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", values)
+
+    def _resume_block(self):
+        """First block to sync, the block of the last applied event if the store was stopped in
+        the middle of a sync, its events already applied are skipped.
+        """
+        self.open()
+        if self.last_event is not None and (
+            self.last_block is None or self.last_event[0] > self.last_block
+        ):
+            return self.last_event[0]
+        if self.last_block is not None:
+            return self.last_block + 1
+        return self.from_block
+
+    @property
+    def ready(self):
+        """The store has replayed the contract history and was synced by this process, e.g. by
+        ``follow``, so it's followed up to the chain head.
+        """
+        return self._synced and self.last_block is not None
+
+    def size(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def get(self, product_id):
+        """Returns the stored product or None if the store has not seen it yet.
+
+        :param product_id: product id
+        :type product_id: int
+        :rtype: Product
+        """
+        with self._lock:
+            row = self.db.execute(
+                f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id = ?", (product_id,)
+            ).fetchone()
+        return None if row is None else _row_product(row)[1]
+
+    def get_range(self, start, stop):
+        """Returns the stored products with ids between ``start`` and ``stop`` in one query.
+
+        :rtype: dict[int, Product]
+        """
+        with self._lock:
+            rows = self.db.execute(
+                f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id >= ? AND id < ?", (start, stop)
+            ).fetchall()
+        return dict(_row_product(row) for row in rows)
+
+    def _put(self, product_id, product):
+        self.db.execute(
+            f"INSERT OR REPLACE INTO products ({PRODUCT_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+            (product_id, product.name, product.status, product.owner, product.new_owner),
+        )
+
+    def put(self, product_id, product):
+        """Stores a product read from the contract.
+
+        :param product_id: product id
+        :type product_id: int
+        :param product: product
+        :type product: Product
+        """
+        with self._lock, self.db:
+            self._put(product_id, product)
+
+    def find(self, **filters):
+        """Returns the products matching every given field, e.g. ``find(owner=addr, status=1)``.
+
+        :param filters: values of the indexed fields: name, status, owner and new_owner
+        :type filters: dict
+        :return: product ids and products sorted by id
+        :rtype: list[tuple[int, Product]]
+        """
+        where = " AND ".join(FILTER_COLUMNS[field] for field in filters) or "1"
+        with self._lock:
+            rows = self.db.execute(
+                f"SELECT {PRODUCT_COLUMNS} FROM products WHERE {where} ORDER BY id",
+                tuple(filters.values()),
+            ).fetchall()
+        return [_row_product(row) for row in rows]
+
+    def products(self):
+        """Returns every stored product sorted by id.
+
+        :rtype: list[tuple[int, Product]]
+        """
+        return self.find()
+
+    def transfers(self, product_id):
+        """Returns the ownership transfers of a product in chain order, its creation included.
+
+        :param product_id: product id
+        :type product_id: int
+        :return: event, from address, to address and block number of each transfer
+        :rtype: list[tuple[str, str, str, int]]
+        """
+        with self._lock:
+            return self.db.execute(
+                "SELECT event, from_address, to_address, block_number FROM transfers "
+                "WHERE product_id = ? ORDER BY block_number, log_index",
+                (product_id,),
+            ).fetchall()
+
+    def reset(self):
+        with self._lock, self.db:
+            for table in ("products", "transfers", "events", "meta"):
+                self.db.execute(f"DELETE FROM {table}")
+            self._cursor = None
+            self.last_block = None
+            self.last_event = None
+
+    def _apply(self, event, owners):
+        position = (event.blockNumber, event.logIndex)
+        if self.last_event is not None and position <= self.last_event:
+            # already applied before a restart
+            return False
+        product_id = event.args.productId
+        self.db.execute(
+            "INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                *position,
+                event.transactionHash.hex(),
+                event.event,
+                product_id,
+                json.dumps(dict(event.args)),
+            ),
+        )
+        self.last_event = position
+        if event.event == "NewProduct":
+            owner = owners[event.transactionHash]
+            self._put(product_id, Product(event.args.name, 0, owner, ZERO_ADDRESS))
+            self._transfer(position, product_id, event.event, ZERO_ADDRESS, owner)
+            return True
+        product = self.get(product_id)
+        if product is None:
+            # unknown product, it will be read from the contract when requested
+            return True
+        if event.event == "DelegateProduct":
+            self._transfer(position, product_id, event.event, product.owner, event.args.newOwner)
+        elif event.event == "AcceptProduct":
+            self._transfer(position, product_id, event.event, product.owner, product.new_owner)
+        self._put(product_id, transferred(product, event))
+        return True
+
+    def _transfer(self, position, product_id, event, from_address, to_address):
+        self.db.execute(
+            "INSERT OR IGNORE INTO transfers VALUES (?, ?, ?, ?, ?, ?)",
+            (*position, product_id, event, from_address, to_address),
+        )
+
+    def _apply_events(self, events, w3):
+        # the creators are read before the transaction, so the store isn't locked during the calls
+        owners = get_creators(events, w3)
+        with self._lock, self.db:
+            applied = sum(self._apply(event, owners) for event in events)
+            self._save_meta()
+        return applied
+
+    def apply_event(self, event, w3):
+        """Applies a decoded contract event to the product table, in its own transaction.
+
+        :param event: decoded log of one of the product events
+        :type event: web3.datastructures.AttributeDict
+        :param w3: web3 instance, used to find out the creator of new products
+        :type w3: Web3
+        """
+        self._apply_events([event], w3)
+
+    def sync(self, contract, to_block=None):
+        """Replays the product events from the last applied one up to ``to_block``, writing each
+        range of logs in one transaction.
+
+        :param contract: product contract
+        :type contract: web3.contract.Contract
+        :param to_block: last block to sync, the current block by default
+        :type to_block: int
+        :return: amount of events applied
+        :rtype: int
+        """
+        if self._cursor is None:
+            event_types = [getattr(contract.events, name) for name in PRODUCT_EVENTS]
+            self._cursor = LogCursor(event_types, from_block=self._resume_block())
+
+        applied = 0
+        for events in self._cursor.scan(to_block):
+            applied += self._apply_events(events, contract.web3)
+        if self._cursor.last_block != self.last_block:
+            with self._lock, self.db:
+                self.last_block = self._cursor.last_block
+                self._save_meta()
+        self._synced = True
+        return applied
@@ -0,0 +1,281 @@
+# stdlib
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# deps
+from hexbytes import HexBytes
+
+# local
+from src import products
+from src.batch import get_transaction_receipts
+from src.metrics import transactions
+
+
+SUBMIT_BATCH_SIZE = int(os.getenv("SUBMIT_BATCH_SIZE", 50))
+RECEIPT_POLL_INTERVAL = float(os.getenv("RECEIPT_POLL_INTERVAL", 2))
+TX_HISTORY_SIZE = int(os.getenv("TX_HISTORY_SIZE", 10000))
+
+QUEUED = "queued"
+PENDING = "pending"
+MINED = "mined"
+CONFIRMED = "confirmed"
+FAILED = "failed"
+
+
+class Job:
+    """A transaction waiting to be sent or tracked until it is confirmed."""
+
+    __slots__ = (
+        "id",
+        "transaction",
+        "sender",
+        "status",
+        "transaction_hash",
+        "block_number",
+        "error",
+    )
+
+    def __init__(self, transaction, sender):
+        self.id = uuid.uuid4().hex
+        self.transaction = transaction
+        self.sender = sender
+        self.status = QUEUED
+        self.transaction_hash = None
+        self.block_number = None
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.status in (CONFIRMED, FAILED)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "transaction_hash": self.transaction_hash,
+            "block_number": self.block_number,
+            "error": self.error,
+        }
+
+
+class TransactionSubmitter:
+    """Sends the transactions of the write routes in the background.
+
+    The routes enqueue a job and answer right away. A submitter thread drains the queue, builds,
+    signs and sends the queued transactions of each sender together, and a receipt thread polls
+    the receipts of the sent ones until they are mined and then confirmed or failed. The state of
+    the jobs is kept in memory, up to ``history_size`` jobs, forgetting the ones finished first.
+    """
+
+    def __init__(
+        self,
+        batch_size=SUBMIT_BATCH_SIZE,
+        poll_interval=RECEIPT_POLL_INTERVAL,
+        history_size=TX_HISTORY_SIZE,
+        min_confirmations=None,
+    ):
+        """
+        :param batch_size: max amount of transactions sent together
+        :type batch_size: int
+        :param poll_interval: seconds between receipt polls
+        :type poll_interval: float
+        :param history_size: amount of jobs kept to report their status
+        :type history_size: int
+        :param min_confirmations: blocks on top of a mined transaction to confirm it,
+            ``MINIMUM_CONFIRMATION`` by default
+        :type min_confirmations: int
+        """
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.history_size = history_size
+        self.min_confirmations = min_confirmations
+        self.queue = queue.Queue()
+        self.running = False
+        self._jobs = OrderedDict()
+        self._hashes = {}
+        # ids of the finished jobs, in the order they finished
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _confirmations(self):
+        if self.min_confirmations is not None:
+            return self.min_confirmations
+        return int(os.getenv("MINIMUM_CONFIRMATION", 3))
+
+    def submit(self, transaction, acc_address):
+        """Queues a transaction to be sent from an address.
+
+        :param transaction: transaction function
+        :type transaction: function
+        :param acc_address: address to send the transaction from
+        :type acc_address: str
+        :rtype: Job
+        """
+        job = Job(transaction, acc_address)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+        self.queue.put(job)
+        transactions.inc(QUEUED)
+        return job
+
+    def create_product(self, name, acc_address):
+        """Queues a product creation, see ``products.create_product``.
+
+        :rtype: Job
+        """
+        return self.submit(products.contract.functions.createProduct(name), acc_address)
+
+    def delegate_product(self, product_id, acc_address, acc2_address):
+        """Queues a product delegation, see ``products.delegate_product``.
+
+        :rtype: Job
+        """
+        tx = products.contract.functions.delegateProduct(product_id, acc2_address)
+        return self.submit(tx, acc_address)
+
+    def accept_product(self, product_id, acc_address):
+        """Queues a product acceptance, see ``products.accept_product``.
+
+        :rtype: Job
+        """
+        return self.submit(products.contract.functions.acceptProduct(product_id), acc_address)
+
+    def get(self, key):
+        """Returns the job of a job id or of a transaction hash, None if it's unknown.
+
+        :param key: job id or transaction hash
+        :type key: str
+        :rtype: Job
+        """
+        key = key.lower()
+        with self._lock:
+            return self._jobs.get(key) or self._hashes.get(key)
+
+    def _forget_finished(self):
+        # the unfinished jobs are kept, wherever they are in the history
+        while len(self._jobs) > self.history_size and self._finished:
+            job_id, _ = self._finished.popitem(last=False)
+            job = self._jobs.pop(job_id)
+            self._hashes.pop(job.transaction_hash, None)
+
+    def _set_status(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        transactions.inc(status)
+        if job.finished:
+            self._finished[job.id] = None
+
+    def _next_batch(self, timeout=None):
+        try:
+            jobs = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(jobs) < self.batch_size:
+            try:
+                jobs.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return jobs
+
+    def send_batch(self, jobs):
+        """Sends the jobs, the transactions of each sender signed in one signer call.
+
+        :param jobs: queued jobs
+        :type jobs: list[Job]
+        """
+        senders = OrderedDict()
+        for job in jobs:
+            senders.setdefault(job.sender.lower(), []).append(job)
+        for sender_jobs in senders.values():
+            results = self._send(sender_jobs)
+            for job, result in zip(sender_jobs, results):
+                with self._lock:
+                    if isinstance(result, dict):
+                        self._set_status(job, FAILED, result["error"])
+                        continue
+                    job.transaction_hash = HexBytes(result).hex()
+                    self._hashes[job.transaction_hash] = job
+                    self._set_status(job, PENDING)
+
+    def _send(self, jobs):
+        sender = jobs[0].sender
+        try:
+            results = products.send_transactions([job.transaction for job in jobs], sender)
+        except Exception as e:
+            print(f"Unable to send the transactions of {sender}: {e!r}")
+            results = {"error": "Something went wrong, try again."}
+        if isinstance(results, dict) and len(jobs) > 1:
+            # one transaction that can't be built fails the batch, the rest are sent one by one
+            return [self._send([job])[0] for job in jobs]
+        if isinstance(results, dict):
+            return [results]
+        return results
+
+    def track_receipts(self):
+        """Moves the sent jobs to mined once their receipt is found, and then to confirmed with
+        enough blocks on top or to failed if the transaction reverted. The receipts of the
+        pending jobs are read in batch requests.
+        """
+        with self._lock:
+            jobs = [job for job in self._hashes.values() if job.status in (PENDING, MINED)]
+        if not jobs:
+            return
+        head = products.w3.eth.block_number
+        pending = [job for job in jobs if job.status == PENDING]
+        receipts = get_transaction_receipts(products.w3, [job.transaction_hash for job in pending])
+        with self._lock:
+            for job, receipt in zip(pending, receipts):
+                if receipt is None:
+                    continue
+                job.block_number = receipt["blockNumber"]
+                if receipt["status"] != 1:
+                    self._set_status(job, FAILED, "Transaction reverted.")
+                    continue
+                self._set_status(job, MINED)
+            for job in jobs:
+                if job.status == MINED and head - job.block_number >= self._confirmations():
+                    self._set_status(job, CONFIRMED)
+
+    def _submit_loop(self):
+        while self.running:
+            jobs = self._next_batch(timeout=1)
+            if not jobs:
+                continue
+            try:
+                self.send_batch(jobs)
+            except Exception as e:
+                print(f"Unable to send the queued transactions: {e!r}")
+
+    def _receipt_loop(self):
+        while self.running:
+            time.sleep(self.poll_interval)
+            try:
+                self.track_receipts()
+            except Exception as e:
+                print(f"Unable to track the transaction receipts: {e!r}")
+
+    def start(self):
+        """Starts the submitter and the receipt tracker in daemon threads.
+
+        :return: the submitter and the receipt tracker threads
+        :rtype: tuple[threading.Thread, threading.Thread]
+        """
+        self.running = True
+        threads = (
+            threading.Thread(target=self._submit_loop, name="tx-submitter", daemon=True),
+            threading.Thread(target=self._receipt_loop, name="tx-receipts", daemon=True),
+        )
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def stop(self):
+        self.running = False
+
+
+tx_submitter = TransactionSubmitter()
@@ -1,18 +1,29 @@
 # stdlib
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 # deps
+import pytest
 from hexbytes import HexBytes
 
 # local
 from app import app
 from src.exceptions import ProductDoesNotExists
+from src.models import Product
+from src.submitter import TransactionSubmitter
 from src.tests.fixtures import *
 
 
 client = app.test_client()
 
 
+@pytest.fixture(autouse=True)
+def mock_state_version(monkeypatch):
+    version = MagicMock(return_value="block-7")
+    monkeypatch.setattr("app.state_version", version)
+    monkeypatch.setattr("app.resolve_block", lambda block: block)
+    return version
+
+
 @patch("app.create_product")
 def test_create_product(mock_create):
     hex = HexBytes("0x000546512314847856")
@@ -60,7 +71,26 @@ def test_read_product(mock_get_prod):
     assert response.status_code == 200
     assert "product" in response.get_json()
     assert response.get_json()["product"] == prod_data
-    mock_get_prod.assert_called_once_with(0)
+    mock_get_prod.assert_called_once_with(0, block=None)
+
+
+@patch("app.get_product")
+def test_read_product_pinned_block(mock_get_prod):
+    mock_get_prod.return_value.to_dict.return_value = {"name": "test_product_0"}
+    client.get("/product/0?block=120")
+    mock_get_prod.assert_called_once_with(0, block=120)
+    block_hash = "0x" + "ab" * 32
+    mock_get_prod.reset_mock()
+    client.get(f"/product/0?block={block_hash}")
+    mock_get_prod.assert_called_once_with(0, block=block_hash)
+
+
+@pytest.mark.parametrize(
+    "query", ["?block=latest", "?block=-1", "?block=0x12", "?block=0x" + "zz" * 32]
+)
+def test_read_product_invalid_block(query):
+    response = client.get("/product/0" + query)
+    assert response.get_json() == {"error": "block must be a block number or a block hash."}
 
 
 @patch("app.get_product")
@@ -71,8 +101,8 @@ def test_read_product_raise_exception(mock_get_prod):
     assert response.get_json() == {"error": "Product 0 does not exists."}
 
 
-@patch("app.get_products")
-def test_read_products(mock_products):
+@patch("app.iter_products")
+def test_read_products(mock_iter):
     prods_data = [
         {
             "name": "test_product_0",
@@ -87,11 +117,58 @@ def test_read_products(mock_products):
             "new_owner": "0x0000000000000000000000000000000000000000",
         },
     ]
-    mock_products.return_value = prods_data
+    mock_iter.return_value = [(i, Product(**data)) for i, data in enumerate(prods_data)]
     response = client.get("/")
     assert response.status_code == 200
+    assert response.content_type == "application/json"
     assert "products" in response.get_json()
     assert response.get_json()["products"] == prods_data
+    mock_iter.assert_called_once_with(block=None)
+
+
+@patch("app.get_products_page")
+def test_read_products_page(mock_page):
+    page = {"products": [{"name": "test_product_2"}], "next_cursor": 3}
+    mock_page.return_value = page
+    response = client.get("/?cursor=2&limit=1")
+    assert response.status_code == 200
+    assert response.get_json() == page
+    mock_page.assert_called_once_with(2, 1, block=None)
+
+
+@patch("app.get_products_page")
+def test_read_products_page_max_limit(mock_page):
+    mock_page.return_value = {"products": [], "next_cursor": None}
+    client.get("/?limit=100000")
+    mock_page.assert_called_once_with(0, 1000, block=None)
+    mock_page.reset_mock()
+    client.get("/?cursor=5")
+    mock_page.assert_called_once_with(5, 1000, block=None)
+
+
+@pytest.mark.parametrize("query", ["?limit=0", "?limit=a", "?cursor=-1", "?cursor=abc"])
+def test_read_products_page_invalid(query):
+    response = client.get("/" + query)
+    assert response.get_json() == {"error": "cursor and limit must be positive integers."}
+
+
+@patch("app.iter_products")
+def test_stream_products(mock_iter):
+    prods = [Product(f"test_product_{i}", 0, "0x%040d" % 111, "0x%040d" % 0) for i in range(3)]
+    mock_iter.return_value = iter(enumerate(prods))
+    response = client.get("/?stream=1&cursor=1")
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [p.to_dict() for p in prods]
+    mock_iter.assert_called_once_with(1, None, block=None)
+
+
+@patch("app.iter_products")
+def test_stream_products_accept_header(mock_iter):
+    mock_iter.return_value = iter([])
+    response = client.get("/", headers={"Accept": "application/x-ndjson"})
+    assert response.mimetype == "application/x-ndjson"
+    assert response.get_data() == b""
 
 
 @patch("app.delegate_product")
@@ -165,4 +242,113 @@ def test_find_product(mock_find_prod):
     response = client.get("/product/test_product_0")
     assert response.status_code == 200
     assert response.get_json() == {"product": prod_data}
-    mock_find_prod.assert_called_once_with("test_product_0")
+    mock_find_prod.assert_called_once_with("test_product_0", block=None)
+
+
+@patch("app.get_products_by_status")
+def test_read_products_by_status(mock_by_status):
+    prods_data = [{"name": "test_product_0", "status": 1}]
+    mock_by_status.return_value = prods_data
+    response = client.get("/products?status=1")
+    assert response.get_json() == {"products": prods_data}
+    mock_by_status.assert_called_once_with(1, block=None)
+
+
+def test_read_products_by_status_missing():
+    response = client.get("/products")
+    assert response.get_json() == {"error": "A status must be provided."}
+
+
+@patch("app.get_products_by_new_owner")
+@patch("app.get_delegated_products_by_owner")
+def test_read_owner_products(mock_by_owner, mock_by_new_owner):
+    addr = "0x%040d" % 111
+    mock_by_owner.return_value = [{"name": "test_product_0"}]
+    mock_by_new_owner.return_value = [{"name": "test_product_1"}]
+    response = client.get(f"/owner/{addr}/products")
+    assert response.get_json() == {
+        "products": [{"name": "test_product_0"}],
+        "pending": [{"name": "test_product_1"}],
+    }
+    mock_by_owner.assert_called_once_with(addr, block=None)
+    mock_by_new_owner.assert_called_once_with(addr, block=None)
+
+
+@pytest.mark.parametrize("url", ["/", "/product/0", "/product/test_product_0"])
+@patch("app.get_product_by_name")
+@patch("app.get_product")
+@patch("app.iter_products")
+def test_conditional_get(mock_products, mock_get_prod, mock_find_prod, url, mock_state_version):
+    mock_products.return_value = []
+    mock_get_prod.return_value.to_dict.return_value = {"name": "test_product_0"}
+    mock_find_prod.return_value = []
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"block-7"'
+    assert response.headers["Cache-Control"] == "no-cache"
+    mock_products.reset_mock()
+    mock_get_prod.reset_mock()
+    mock_find_prod.reset_mock()
+
+    response = client.get(url, headers={"If-None-Match": '"block-7"'})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == '"block-7"'
+    assert response.get_data() == b""
+    mock_products.assert_not_called()
+    mock_get_prod.assert_not_called()
+    mock_find_prod.assert_not_called()
+
+    mock_state_version.return_value = "block-8"
+    response = client.get(url, headers={"If-None-Match": '"block-7"'})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"block-8"'
+
+
+@patch("app.iter_products")
+def test_conditional_stream(mock_iter, mock_state_version):
+    mock_iter.return_value = iter([])
+    response = client.get("/?stream=1")
+    assert response.headers["ETag"] == '"block-7-ndjson"'
+    assert "Accept" in response.headers["Vary"]
+    response = client.get("/?stream=1", headers={"If-None-Match": '"block-7"'})
+    assert response.status_code == 200
+    response = client.get("/?stream=1", headers={"If-None-Match": '"block-7-ndjson"'})
+    assert response.status_code == 304
+    mock_state_version.assert_called_with(None)
+
+
+@patch("app.get_products_page")
+def test_tag_and_reads_of_the_same_block(mock_page, mock_state_version, monkeypatch):
+    mock_page.return_value = {"products": [], "next_cursor": None}
+    monkeypatch.setattr("app.resolve_block", MagicMock(return_value=12))
+    client.get("/?cursor=0")
+    # the current block is resolved once for the tag and the reads
+    mock_state_version.assert_called_once_with(12)
+    mock_page.assert_called_once_with(0, 1000, block=12)
+
+
+@patch("app.get_product")
+def test_read_product_error_not_tagged(mock_get_prod):
+    mock_get_prod.side_effect = ProductDoesNotExists()
+    response = client.get("/product/0")
+    assert "ETag" not in response.headers
+
+
+def test_queued_writes(monkeypatch, mock_contract):
+    submitter = TransactionSubmitter()
+    submitter.running = True
+    monkeypatch.setattr("app.tx_submitter", submitter)
+    response = client.post(
+        "/product/", data={"name": "prod", "address": "0x%040d" % 111}, follow_redirects=False
+    )
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job["status"] == "queued"
+    assert response.headers["Location"].endswith(f"/tx/{job['job_id']}")
+
+    response = client.post("/product/0/accept/", data={"address": "0x%040d" % 1})
+    assert response.status_code == 202
+    assert submitter.queue.qsize() == 2
+
+    assert client.get(f"/tx/{job['job_id']}").get_json() == job
+    assert client.get("/tx/0x1234").get_json() == {"error": "Transaction 0x1234 not found."}
@@ -0,0 +1,201 @@
+# stdlib
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# deps
+import pytest
+import pytest_asyncio
+from aiohttp.test_utils import TestClient, TestServer
+from web3 import exceptions as web3Exceptions
+
+# local
+from async_app import init_app
+from src import async_products
+from src.models import Product
+from src.submitter import TransactionSubmitter
+from src.tests.fixtures import *
+
+
+@pytest.fixture
+def mock_async_sign(monkeypatch, w3, account_1):
+    async def sign(tx):
+        signed = w3.eth.account.sign_transaction(tx, account_1.key.hex())
+        return {"rawTransaction": signed["rawTransaction"].hex()}
+
+    monkeypatch.setattr("src.async_products.sign_transaction", sign)
+
+
+@pytest_asyncio.fixture
+async def client(monkeypatch):
+    monkeypatch.setattr("async_app.resolve_block", AsyncMock(side_effect=lambda block: block))
+    client = TestClient(TestServer(init_app()))
+    await client.start_server()
+    yield client
+    await client.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("new_product", [5], indirect=True)
+async def test_async_reads(mock_contract, mock_w3, mock_async_w3, account_1, new_product):
+    products = await async_products.get_products()
+    assert [p["name"] for p in products] == [f"new_prod_{i}" for i in range(5)]
+    assert products[0]["owner"] == account_1.address
+
+    product = await async_products.get_product(2)
+    assert product.name == "new_prod_2"
+
+    page = await async_products.get_products_page(cursor=3, limit=1)
+    assert page == {"products": [products[3]], "next_cursor": 4}
+    assert await async_products.get_product_by_name("new_prod_4") == [products[4]]
+    assert len(await async_products.get_products_by_status(0)) == 5
+    owned = await async_products.get_delegated_products_by_owner(account_1.address.lower())
+    assert len(owned) == 5
+
+
+@pytest.mark.asyncio
+async def test_resolve_block(mock_w3, mock_async_w3, mock_product_index, w3):
+    # without the index the current block is resolved, the requested ones are kept
+    assert await async_products.resolve_block() == w3.eth.block_number
+    assert await async_products.resolve_block(3) == 3
+    mock_product_index.last_block = 0
+    assert await async_products.resolve_block() is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("new_product", [10], indirect=True)
+async def test_async_reads_bounded(mock_contract, mock_w3, mock_async_w3, monkeypatch, new_product):
+    monkeypatch.setattr("src.async_products.ASYNC_READ_CONCURRENCY", 3)
+    in_flight = []
+    max_in_flight = []
+    eth_call = async_products._eth_call
+
+    async def counted_call(function, block_identifier):
+        in_flight.append(function)
+        max_in_flight.append(len(in_flight))
+        await asyncio.sleep(0.001)
+        try:
+            return await eth_call(function, block_identifier)
+        finally:
+            in_flight.pop()
+
+    monkeypatch.setattr("src.async_products._eth_call", counted_call)
+    assert len(await async_products.get_products()) == 10
+    assert max(max_in_flight) == 3
+
+
+@pytest.mark.asyncio
+async def test_async_eth_call_errors(monkeypatch):
+    mock_async_w3 = MagicMock()
+    monkeypatch.setattr("src.async_products.async_w3", mock_async_w3)
+    function = MagicMock(address="0x%040d" % 1)
+    function._encode_transaction_data.return_value = "0x"
+
+    mock_async_w3.eth.call = AsyncMock(
+        side_effect=ValueError({"code": 3, "message": "execution reverted: Product not found"})
+    )
+    result = await async_products._eth_call(function, 1)
+    assert isinstance(result, web3Exceptions.ContractLogicError)
+    # the other node errors are not results
+    mock_async_w3.eth.call = AsyncMock(
+        side_effect=ValueError({"code": -32000, "message": "header not found"})
+    )
+    with pytest.raises(ValueError):
+        await async_products._eth_call(function, 1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("new_product", [1], indirect=True)
+async def test_async_send_transaction(
+    mock_contract, mock_w3, mock_async_w3, mock_async_sign, account_1, account_2, new_product
+):
+    tx_hash = await async_products.delegate_product(0, account_1.address, account_2.address)
+    assert (await mock_async_w3.eth.get_transaction_receipt(tx_hash))["status"] == 1
+    product = await async_products.get_product(0)
+    assert product.status == 1
+    assert product.new_owner == account_2.address
+
+
+@pytest.mark.asyncio
+@patch("src.async_products.print")
+async def test_async_send_transaction_sign_error(mock_print, mock_w3, mock_async_w3, monkeypatch):
+    monkeypatch.setattr(
+        "src.async_products.sign_transaction", AsyncMock(side_effect=Exception("Signer down"))
+    )
+    transaction = MagicMock()
+    transaction.buildTransaction.return_value = {"nonce": 0}
+    with patch("src.products.nonce_manager") as mock_nonce_manager:
+        mock_nonce_manager.allocate.return_value = 0
+        ret = await async_products.send_transaction(transaction, "0x%040d" % 1)
+    assert ret == {"error": "Something went wrong, try again."}
+    mock_print.assert_called_once_with("Signer down")
+    mock_nonce_manager.release.assert_called_once_with("0x%040d" % 1, 0)
+
+
+@pytest.mark.asyncio
+@patch("async_app.get_products_page", new_callable=AsyncMock)
+@patch("async_app.state_version", new_callable=AsyncMock)
+async def test_async_app_page(mock_state_version, mock_page, client):
+    mock_state_version.return_value = "block-7"
+    mock_page.return_value = {"products": [{"name": "test_product_2"}], "next_cursor": 3}
+    response = await client.get("/?cursor=2&limit=1")
+    assert await response.json() == mock_page.return_value
+    assert response.headers["ETag"] == '"block-7"'
+    mock_page.assert_awaited_once_with(2, 1, block=None)
+
+    response = await client.get("/?cursor=2&limit=1", headers={"If-None-Match": '"block-7"'})
+    assert response.status == 304
+    mock_page.assert_awaited_once()
+
+    for query in ("?limit=0", "?cursor=abc"):
+        response = await client.get("/" + query)
+        assert await response.json() == {"error": "cursor and limit must be positive integers."}
+
+
+@pytest.mark.asyncio
+@patch("async_app.get_product", new_callable=AsyncMock)
+@patch("async_app.state_version", new_callable=AsyncMock)
+async def test_async_app_product(mock_state_version, mock_get_prod, client):
+    mock_state_version.return_value = "block-7"
+    mock_get_prod.return_value = Product("test_product_0", 0, "0x%040d" % 111, "0x%040d" % 0)
+    response = await client.get("/product/0?block=12")
+    assert await response.json() == {"product": mock_get_prod.return_value.to_dict()}
+    mock_get_prod.assert_awaited_once_with(0, block=12)
+    mock_state_version.assert_awaited_once_with(12)
+
+    response = await client.get("/product/0?block=latest")
+    assert await response.json() == {"error": "block must be a block number or a block hash."}
+
+
+@pytest.mark.asyncio
+@patch("async_app.iter_products")
+@patch("async_app.state_version", new_callable=AsyncMock)
+async def test_async_app_stream(mock_state_version, mock_iter, client):
+    prods = [Product(f"test_product_{i}", 0, "0x%040d" % 111, "0x%040d" % 0) for i in range(3)]
+
+    async def iter_products(*args):
+        for i, product in enumerate(prods):
+            yield i, product
+
+    mock_state_version.return_value = "block-7"
+    mock_iter.side_effect = iter_products
+    response = await client.get("/", headers={"Accept": "application/x-ndjson"})
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    assert response.headers["ETag"] == '"block-7-ndjson"'
+    lines = (await response.text()).splitlines()
+    assert [json.loads(line) for line in lines] == [p.to_dict() for p in prods]
+
+
+@pytest.mark.asyncio
+async def test_async_app_queued_write(monkeypatch, mock_contract, client):
+    submitter = TransactionSubmitter()
+    submitter.running = True
+    monkeypatch.setattr("async_app.tx_submitter", submitter)
+    response = await client.post(
+        "/product/0/delegate/", data={"address": "0x%040d" % 111, "new_address": "0x%040d" % 1}
+    )
+    assert response.status == 202
+    job = await response.json()
+    assert job["status"] == "queued"
+
+    response = await client.get(f"/tx/{job['job_id']}")
+    assert await response.json() == job
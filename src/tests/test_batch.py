@@ -0,0 +1,254 @@
+# stdlib
+from unittest.mock import patch
+
+# deps
+import pytest
+import requests
+from eth_abi import encode_abi
+from hexbytes import HexBytes
+from web3 import HTTPProvider, Web3
+
+# local
+from benchmarks.rpc_server import StandIn, serve
+from benchmarks.run import Chain
+from src import batch
+from src.batch import (
+    batch_call,
+    batching_enabled,
+    get_transaction_receipts,
+    get_transactions,
+)
+from src.sessions import get_session
+from src.tests.fixtures import *
+
+
+ENDPOINT = "http://fake-node"
+
+
+@pytest.fixture
+def http_contract():
+    w3 = Web3(HTTPProvider(ENDPOINT))
+    return w3.eth.contract(address="0x%040d" % 1, abi=load_abi())
+
+
+@pytest.fixture(autouse=True)
+def clear_unsupported_endpoints(monkeypatch):
+    monkeypatch.setattr("src.batch._unsupported_endpoints", set())
+    monkeypatch.setattr("src.batch._batch_limits", {})
+
+
+@pytest.fixture
+def seeded_stand_in(request):
+    chain = Chain()
+    chain.seed(25)
+    stand_in = StandIn(chain, **request.param)
+    server = serve(stand_in, port=0)
+    yield stand_in, "http://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def product_result(i):
+    data = encode_abi(
+        ["string", "uint8", "address", "address"],
+        [f"prod_{i}", 0, "0x%040d" % 1, "0x%040d" % 0],
+    )
+    return "0x" + data.hex()
+
+
+def batch_response(payload):
+    responses = []
+    for item in payload:
+        if item["id"] == 2:
+            responses.append({"id": 2, "error": {"code": 3, "message": "execution reverted"}})
+        else:
+            responses.append({"id": item["id"], "result": product_result(item["id"])})
+    # providers are not required to keep the request order
+    return MockResponse(list(reversed(responses)), 200)
+
+
+@patch.object(get_session(), "post")
+def test_batch_call(mock_post, http_contract):
+    mock_post.side_effect = lambda uri, json, **kwargs: batch_response(json)
+    results = batch_call([http_contract.functions.products(i) for i in range(3)])
+
+    mock_post.assert_called_once()
+    assert results[0] == ["prod_0", 0, "0x%040d" % 1, "0x%040d" % 0]
+    assert results[1][0] == "prod_1"
+    assert isinstance(results[2], exceptions.ContractLogicError)
+
+
+@patch.object(get_session(), "post")
+def test_batch_call_chunks(mock_post, http_contract):
+    mock_post.side_effect = lambda uri, json, **kwargs: batch_response(json)
+    results = batch_call([http_contract.functions.products(i) for i in range(5)], chunk_size=2)
+
+    assert mock_post.call_count == 3
+    assert len(results) == 5
+
+
+@patch.object(get_session(), "post")
+def test_batch_call_not_supported(mock_post, http_contract, monkeypatch):
+    mock_post.return_value = MockResponse({"error": "batch requests not supported"}, 200)
+    monkeypatch.setattr("src.batch._call_one", lambda function, block_identifier: "single")
+    functions = [http_contract.functions.products(i) for i in range(3)]
+    results = batch_call(functions)
+
+    assert results == ["single", "single", "single"]
+    assert not batching_enabled(http_contract.web3)
+    # the endpoint is not asked for batches again
+    batch_call(functions)
+    mock_post.assert_called_once()
+
+
+@patch.object(get_session(), "post")
+def test_batch_call_http_error(mock_post, http_contract, monkeypatch):
+    response = requests.Response()
+    response.status_code = 400
+    mock_post.return_value = response
+    monkeypatch.setattr("src.batch._call_one", lambda function, block_identifier: "single")
+    assert batch_call([http_contract.functions.size()]) == ["single"]
+    assert ENDPOINT in batch._unsupported_endpoints
+
+
+@patch.object(get_session(), "post")
+def test_batch_call_errors_are_raised(mock_post, http_contract):
+    functions = [http_contract.functions.products(i) for i in range(2)]
+    # a failing endpoint doesn't disable the batches
+    response = requests.Response()
+    response.status_code = 503
+    mock_post.return_value = response
+    with pytest.raises(requests.HTTPError):
+        batch_call(functions)
+    assert batching_enabled(http_contract.web3)
+
+    # only the reverts are results
+    mock_post.return_value = MockResponse(
+        [
+            {"id": 0, "result": product_result(0)},
+            {"id": 1, "error": {"code": -32000, "message": "header not found"}},
+        ],
+        200,
+    )
+    with pytest.raises(ValueError, match="header not found"):
+        batch_call(functions)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        {"code": -32600, "message": "Batch size limit exceeded"},
+        {"code": -32005, "message": "limit exceeded"},
+        {"code": -32000, "message": "batch too large"},
+    ],
+)
+@patch.object(get_session(), "post")
+def test_batch_over_the_size_limit(mock_post, http_contract, error):
+    def post(uri, json, **kwargs):
+        if len(json) > 2:
+            return MockResponse({"jsonrpc": "2.0", "id": None, "error": error}, 200)
+        return batch_response(json)
+
+    mock_post.side_effect = post
+    functions = [http_contract.functions.products(i) for i in range(5)]
+    assert len(batch_call(functions)) == 5
+    assert [len(c.kwargs["json"]) for c in mock_post.call_args_list] == [5, 2, 2, 1]
+    # the limit is kept, the next batches are sent within it
+    mock_post.reset_mock()
+    batch_call(functions)
+    assert [len(c.kwargs["json"]) for c in mock_post.call_args_list] == [2, 2, 1]
+    assert batching_enabled(http_contract.web3)
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        ({"code": 3, "message": "execution reverted: Product does not exist"}, True),
+        ({"code": -32000, "message": "execution reverted"}, True),
+        ({"code": -32000, "message": "header not found"}, False),
+        ({"code": -32000, "message": "invalid opcode: INVALID"}, True),
+        ("execution reverted", True),
+    ],
+)
+def test_is_revert(error, expected):
+    assert batch.is_revert(error) == expected
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_batch_call_not_http(product_contract, new_product):
+    functions = [product_contract.functions.size()] + [
+        product_contract.functions.products(i) for i in range(2)
+    ]
+    size, prod_0, prod_1 = batch_call(functions)
+    assert size == 2
+    assert prod_0[0] == "new_prod_0"
+    assert prod_1[0] == "new_prod_1"
+
+
+def test_batch_call_empty():
+    assert batch_call([]) == []
+
+
+@patch.object(get_session(), "post")
+def test_get_transaction_receipts_batch(mock_post, http_contract):
+    receipt = {
+        "transactionHash": "0x" + "01" * 32,
+        "blockNumber": "0xa",
+        "status": "0x1",
+        "gasUsed": "0x5208",
+        "logs": [],
+    }
+    mock_post.return_value = MockResponse(
+        [{"id": 1, "result": None}, {"id": 0, "result": receipt}], 200
+    )
+    receipts = get_transaction_receipts(http_contract.web3, [HexBytes(1), "0x02"])
+
+    mock_post.assert_called_once()
+    assert [item["method"] for item in mock_post.call_args.kwargs["json"]] == [
+        "eth_getTransactionReceipt",
+        "eth_getTransactionReceipt",
+    ]
+    assert [item["params"] for item in mock_post.call_args.kwargs["json"]] == [["0x01"], ["0x02"]]
+    assert receipts[0].status == 1
+    assert receipts[0].blockNumber == 10
+    assert receipts[0].gasUsed == 21000
+    assert receipts[1] is None
+
+
+@patch.object(get_session(), "post")
+def test_get_transactions_batch(mock_post, http_contract):
+    transaction = {
+        "hash": "0x" + "01" * 32,
+        "from": "0x" + "ab" * 20,
+        "nonce": "0x3",
+        "gas": "0x5208",
+    }
+    mock_post.return_value = MockResponse(
+        [{"id": 0, "result": transaction}, {"id": 1, "result": None}], 200
+    )
+    transactions = get_transactions(http_contract.web3, [HexBytes(1), "0x02"])
+
+    mock_post.assert_called_once()
+    assert [item["method"] for item in mock_post.call_args.kwargs["json"]] == [
+        "eth_getTransactionByHash",
+        "eth_getTransactionByHash",
+    ]
+    assert transactions[0]["from"] == Web3.toChecksumAddress("0x" + "ab" * 20)
+    assert transactions[0].nonce == 3
+    assert transactions[1] is None
+
+
+@pytest.mark.parametrize("seeded_stand_in", [{"max_batch_size": 10}], indirect=True)
+def test_batch_call_stand_in_size_limit(seeded_stand_in):
+    stand_in, uri = seeded_stand_in
+    w3 = Web3(HTTPProvider(uri))
+    contract = w3.eth.contract(address=stand_in.chain.contract.address, abi=load_abi())
+    functions = [contract.functions.products(i) for i in range(25)]
+    with patch.object(stand_in, "handle", wraps=stand_in.handle) as mock_handle:
+        products = batch_call(functions)
+        assert [product[0] for product in products] == [f"product_{i}" for i in range(25)]
+        mock_handle.reset_mock()
+        batch_call(functions)
+    # the endpoint is not blacklisted, the later reads are sent in batches within its limit
+    assert batching_enabled(w3)
+    assert [len(c.args[0]) for c in mock_handle.call_args_list] == [6, 6, 6, 6, 1]
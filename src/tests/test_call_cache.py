@@ -0,0 +1,136 @@
+# stdlib
+from unittest.mock import MagicMock, patch
+
+# deps
+import pytest
+from hexbytes import HexBytes
+from web3 import exceptions as web3Exceptions
+
+# local
+from src import products
+from src.batch import batch_call
+from src.call_cache import BlockPin, CallCache, block_key
+from src.products import get_product, get_products, get_products_page
+from src.tests.fixtures import *
+
+
+def test_block_key():
+    block_hash = "0x" + "AB" * 32
+    assert block_key(10) == 10
+    assert block_key(block_hash) == block_hash.lower()
+    assert block_key(bytes.fromhex("ab" * 32)) == block_hash.lower()
+
+
+def latest_block(number):
+    return {"number": number, "hash": HexBytes(number).rjust(32, b"\0")}
+
+
+def test_block_pin_ttl(monkeypatch):
+    now = [0]
+    monkeypatch.setattr("src.call_cache.time.monotonic", lambda: now[0])
+    mw3 = MagicMock()
+    mw3.eth.get_block.return_value = latest_block(10)
+    pin = BlockPin(ttl=1)
+    assert pin.block_number(mw3) == 10
+    assert pin.block_hash(10) == "0x" + "00" * 31 + "0a"
+    assert pin.block_hash(9) is None
+    mw3.eth.get_block.return_value = latest_block(11)
+    now[0] = 0.5
+    assert pin.block_number(mw3) == 10
+    now[0] = 2
+    assert pin.block_number(mw3) == 11
+    mw3.eth.get_block.return_value = latest_block(12)
+    pin.expire()
+    assert pin.block_number(mw3) == 12
+    # an older block never moves the pin back
+    pin.on_new_block(5)
+    assert pin.block_number(mw3) == 12
+    # the hash of a block seen without it is unknown
+    pin.on_new_block(13)
+    assert pin.block_hash(13) is None
+
+
+@pytest.mark.parametrize("new_product", [3], indirect=True)
+def test_call_cache_hits(mock_contract, mock_w3, product_contract, new_product):
+    block = products.w3.eth.block_number
+    cache = CallCache(block_hash=lambda block_number: "0x01")
+    functions = [product_contract.functions.products(i) for i in range(3)]
+    with patch("src.call_cache.batch_call", wraps=batch_call) as mock_batch_call:
+        first = cache.call(functions, block)
+        second = cache.call(functions + [product_contract.functions.size()], block)
+    assert first == second[:3]
+    assert second[3] == 3
+    # only the call not cached is sent
+    assert len(mock_batch_call.call_args_list[1].args[0]) == 1
+    assert cache.stats() == {"hits": 3, "misses": 4, "size": 4}
+
+
+def test_call_cache_lru_and_errors():
+    def function(data, result):
+        fn = MagicMock()
+        fn.address = "0x%040d" % 1
+        fn._encode_transaction_data.return_value = data
+        fn.web3 = MagicMock()
+        fn.call.side_effect = [result] if isinstance(result, Exception) else None
+        fn.call.return_value = result
+        return fn
+
+    cache = CallCache(maxsize=2, block_hash=lambda block_number: "0x05")
+    error = web3Exceptions.ContractLogicError("reverted")
+    results = cache.call([function("0x01", 1), function("0x02", error), function("0x03", 3)], 5)
+    assert results == [1, error, 3]
+    # the failed call is not cached
+    assert cache.stats() == {"hits": 0, "misses": 3, "size": 2}
+    cache.call([function("0x04", 4)], 5)
+    # the least recently used result was evicted
+    assert cache.call([function("0x01", 10)], 5) == [10]
+    assert cache.call([function("0x04", 40)], 5) == [4]
+
+
+@pytest.mark.parametrize("new_product", [1], indirect=True)
+def test_call_cache_keyed_by_block_hash(mock_contract, mock_w3, product_contract, new_product):
+    hashes = {}
+    cache = CallCache(block_hash=hashes.get)
+    block = products.w3.eth.block_number
+    functions = [product_contract.functions.size()]
+    # the tester chain can't call at a block hash
+    with patch("src.call_cache.batch_call", return_value=[3]) as mock_batch_call:
+        # without a known hash the block number could be replaced by a reorg
+        cache.call(functions, block)
+        assert cache.stats()["size"] == 0
+        hashes[block] = "0x01"
+        cache.call(functions, block)
+        cache.call(functions, block)
+        # the same block number after a reorg is read again
+        hashes[block] = "0x02"
+        cache.call(functions, block)
+        # a requested block hash is cached as is
+        cache.call(functions, "0x" + "AB" * 32)
+        cache.call(functions, "0x" + "ab" * 32)
+    assert mock_batch_call.call_count == 4
+    assert cache.stats() == {"hits": 2, "misses": 3, "size": 3}
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_pinned_reads(
+    mock_request, mock_contract, mock_w3, product_contract, account_1, account_2, new_product
+):
+    block = products.w3.eth.block_number
+    products.delegate_product(0, account_1.address, account_2.address)
+    products.create_product("prod_2", account_1.address)
+
+    # the reads at the block before the transactions don't see them
+    assert [p["name"] for p in get_products(block=block)] == ["new_prod_0", "new_prod_1"]
+    assert get_product(0, block=block).status == 0
+    assert get_products_page(0, 10, block=block)["next_cursor"] is None
+    assert get_product(0).status == 1
+    assert len(get_products()) == 3
+
+
+@pytest.mark.parametrize("new_product", [3], indirect=True)
+def test_repeated_reads_in_block(mock_contract, mock_w3, new_product):
+    first = get_products()
+    with patch("src.call_cache.batch_call") as mock_batch_call:
+        assert get_products() == first
+        assert get_product(1).to_dict() == first[1]
+    mock_batch_call.assert_not_called()
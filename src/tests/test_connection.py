@@ -0,0 +1,54 @@
+# deps
+import pytest
+from web3 import EthereumTesterProvider
+
+# local
+from src import connection, products
+from src.connection import Lazy, load_abi
+
+
+@pytest.fixture
+def reset_connection():
+    connection.reset()
+    yield
+    connection.reset()
+
+
+def test_load_abi():
+    abi = load_abi()
+    assert isinstance(abi, list)
+    assert "createProduct" in [item.get("name") for item in abi]
+    assert load_abi() is abi
+
+
+def test_lazy():
+    built = []
+
+    def factory():
+        built.append(1)
+        return type("Target", (), {"value": 1})()
+
+    lazy = Lazy(factory)
+    assert built == []
+    assert lazy.value == 1
+    lazy.value = 2
+    assert lazy.value == 2
+    assert built == [1]
+
+
+def test_built_on_first_use(reset_connection, monkeypatch):
+    monkeypatch.setenv("PROVIDER", "http://fake-node:8545")
+    assert object.__getattribute__(connection.w3, "_target") is None
+    assert connection.w3.provider.endpoint_uri == "http://fake-node:8545"
+    # the modules importing the connection share it
+    assert products.w3.provider is connection.w3.provider
+    assert connection.contract.address == connection.DEFAULT_CONTRACT_ADDR
+
+
+def test_init_and_reset(reset_connection):
+    w3, contract = connection.init(EthereumTesterProvider(), "0x%040d" % 1)
+    assert connection.w3.eth.block_number == w3.eth.block_number == 0
+    assert products.contract.address == contract.address == "0x%040d" % 1
+
+    connection.reset()
+    assert connection.contract.address == connection.DEFAULT_CONTRACT_ADDR
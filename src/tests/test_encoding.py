@@ -0,0 +1,54 @@
+# stdlib
+import json
+
+# deps
+import pytest
+from hexbytes import HexBytes
+
+# local
+from src.encoding import dumps
+from src.models import Product
+
+
+OWNER = "0x0000000000000000000000000000000000000111"
+ZERO = "0x%040d" % 0
+
+
+@pytest.mark.parametrize("name", ["product", 'say "hi"\\', "prodúcto\n"])
+def test_product_to_json(name):
+    product = Product(name, 1, OWNER, ZERO)
+    assert json.loads(product.to_json()) == product.to_dict()
+
+
+def test_product_slots():
+    product = Product("product", 0, OWNER, ZERO)
+    with pytest.raises(AttributeError):
+        product.price = 1
+    product.status = 1
+    assert product.to_dict()["status"] == 1
+
+
+def test_dumps():
+    products = [Product(f"product_{i}", 0, OWNER, ZERO) for i in range(3)]
+    body = {"products": products, "next_cursor": None}
+    assert json.loads(dumps(body)) == {
+        "products": [product.to_dict() for product in products],
+        "next_cursor": None,
+    }
+    assert json.loads(dumps({"products": [], "pending": [products[0].to_dict()]})) == {
+        "products": [],
+        "pending": [products[0].to_dict()],
+    }
+
+
+def test_dumps_transaction_hash():
+    tx_hash = HexBytes("0x" + "ab" * 32)
+    assert dumps({"transaction_hash": tx_hash}) == '{"transaction_hash":"0x%s"}' % ("ab" * 32)
+    assert json.loads(dumps({"transaction_hash": {"error": "Invalid address"}})) == {
+        "transaction_hash": {"error": "Invalid address"}
+    }
+
+
+def test_dumps_not_serializable():
+    with pytest.raises(TypeError):
+        dumps({"value": object()})
@@ -1,51 +1,112 @@
 # stdlib
-from unittest.mock import call, patch
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
 
 # deps
 import pytest
 from web3 import exceptions as web3Exceptions
 
 # local
+from src import metrics
 from src.event_subscription import (
+    EventPipeline,
+    HeadTracker,
     WatchList,
+    contract,
     handle_event,
     has_min_confirmations,
     is_transaction_successfull,
+    listen_event,
+    log_loop,
     polling_accepted_products,
     polling_delegated_products,
     polling_new_products,
+    polling_products,
 )
+from src.models import address_key
 
 from .fixtures import *
 
 
+ADDR_1 = "0x%040d" % 1
+ADDR_2 = "0x%040d" % 2
+
+
+@pytest.fixture
+def watch_list(monkeypatch, tmp_path):
+    monkeypatch.setattr(WatchList, "db_path", str(tmp_path / "watchlist.db"))
+    monkeypatch.setattr(WatchList, "_subscribers", set())
+    monkeypatch.setattr(WatchList, "_loaded", False)
+    return WatchList()
+
+
+def restart(monkeypatch):
+    monkeypatch.setattr(WatchList, "_subscribers", set())
+    monkeypatch.setattr(WatchList, "_loaded", False)
+    return WatchList()
+
+
 class TestWatchList:
-    def test_subscribe(self):
-        wl = WatchList()
-        wl.subscribe("fake-address")
+    def test_subscribe(self, watch_list):
+        watch_list.subscribe(ADDR_1)
+
+        assert address_key(ADDR_1) in watch_list._subscribers
+        # shared by every instance
+        assert WatchList().is_subscribed(ADDR_1)
 
-        assert "fake-address" in wl._subscribers
+    def test_unsubscribe(self, watch_list):
+        watch_list.subscribe(ADDR_1)
+        assert watch_list.is_subscribed(ADDR_1)
+        watch_list.unsubscribe(ADDR_1)
+        assert not watch_list.is_subscribed(ADDR_1)
+        # unsubscribing an address not subscribed does nothing
+        watch_list.unsubscribe(ADDR_2)
 
-    def test_unsubscribe(self):
-        wl = WatchList()
-        wl._subscribers = ["fake-address"]
-        assert "fake-address" in wl._subscribers
-        wl.unsubscribe("fake-address")
-        assert "fake-address" not in wl._subscribers
+    def test_is_subscribed(self, watch_list):
+        watch_list.subscribe("0xABCDEF0000000000000000000000000000000001")
 
-    def test_is_subscribed(self):
-        wl = WatchList()
-        wl._subscribers = ["fake-address"]
+        assert watch_list.is_subscribed("0xabcdef0000000000000000000000000000000001")
+        assert watch_list.is_subscribed("abcdef0000000000000000000000000000000001")
+        assert not watch_list.is_subscribed(ADDR_1)
+        assert not watch_list.is_subscribed("fake-address")
 
-        assert wl.is_subscribed("fake-address")
+    def test_get_subscribers(self, watch_list):
+        watch_list.subscribe(ADDR_1)
 
-    def test_get_subscribers(self):
-        wl = WatchList()
-        wl._subscribers = ["fake-address"]
+        subs = watch_list.get_subscribers()
+        assert subs == [ADDR_1]
+        subs.append(ADDR_2)
+        assert watch_list.get_subscribers() == [ADDR_1]
 
-        subs = wl.get_subscribers()
-        assert subs == wl._subscribers
-        assert subs is not wl._subscribers
+    def test_invalid_address(self, watch_list):
+        with pytest.raises(ValueError):
+            watch_list.subscribe("fake-address")
+        with pytest.raises(ValueError):
+            watch_list.subscribe("0x1234")
+
+    def test_bulk(self, watch_list):
+        addresses = ["0x%040x" % i for i in range(1, 1001)]
+        watch_list.subscribe_many(addresses)
+        assert len(watch_list.get_subscribers()) == 1000
+        watch_list.unsubscribe_many(addresses[:500])
+        assert not watch_list.is_subscribed(addresses[0])
+        assert watch_list.is_subscribed(addresses[500])
+        assert len(watch_list.get_subscribers()) == 500
+
+    def test_persisted(self, watch_list, monkeypatch):
+        watch_list.subscribe_many([ADDR_1, ADDR_2])
+        watch_list.unsubscribe(ADDR_2)
+
+        restarted = restart(monkeypatch)
+        assert not WatchList._loaded
+        assert restarted.is_subscribed(ADDR_1)
+        assert not restarted.is_subscribed(ADDR_2)
+
+    def test_not_persisted_without_db(self, watch_list, monkeypatch):
+        monkeypatch.setattr(WatchList, "db_path", None)
+        watch_list.subscribe(ADDR_1)
+        assert not restart(monkeypatch).is_subscribed(ADDR_1)
 
 
 @pytest.mark.parametrize(
@@ -109,6 +170,135 @@ def test_polling_accepted_products(mock_listen):
     mock_listen.assert_called_once()
 
 
+@patch("src.event_subscription.listen_events")
+def test_polling_products(mock_listen):
+    handlers = {"NewProduct": MagicMock()}
+    polling_products(handlers)
+    event_types, called_handlers = mock_listen.call_args.args
+    assert [e.event_name for e in event_types] == [
+        "NewProduct",
+        "DelegateProduct",
+        "AcceptProduct",
+    ]
+    assert called_handlers is handlers
+
+
+@patch("src.event_subscription.listen_events")
+def test_listen_event(mock_listen):
+    listen_event(contract.events.NewProduct)
+    mock_listen.assert_called_once_with([contract.events.NewProduct])
+
+
+@pytest.mark.asyncio
+@patch("src.event_subscription.handle_event")
+async def test_pipeline_dispatch(mock_handle_event):
+    new_product = MockEvent(event="NewProduct", newOwner="", block_num=1, transaction_hash="0x1")
+    accepted = MockEvent(event="AcceptProduct", newOwner="", block_num=1, transaction_hash="0x2")
+    handle_new_product = AsyncMock()
+    event_filter = MagicMock()
+    event_filter.get_new_entries.side_effect = [[new_product, accepted], asyncio.CancelledError]
+    event_filter.caught_up = False
+    head_tracker = MagicMock()
+    pipeline = EventPipeline(
+        head_tracker,
+        {"NewProduct": handle_new_product},
+        workers=2,
+        on_handled=[event_filter.handled],
+    )
+    pipeline.start()
+
+    with pytest.raises(asyncio.CancelledError):
+        await log_loop(event_filter, 2, pipeline)
+    await pipeline.queue.join()
+    handle_new_product.assert_awaited_once_with(new_product, head_tracker)
+    mock_handle_event.assert_called_once_with(accepted, head_tracker)
+    # the cursor checkpoints the handled events
+    assert [c.args[0] for c in event_filter.handled.call_args_list] == [new_product, accepted]
+    assert pipeline.stats() == {"queued": 0, "in_flight": 0, "completed": 2, "failed": 0}
+    await pipeline.stop()
+
+
+@pytest.mark.asyncio
+@patch("src.event_subscription.print")
+async def test_log_loop_read_errors(mock_print):
+    event = MockEvent(event="NewProduct", newOwner="", block_num=1, transaction_hash="0x1")
+    event_filter = MagicMock()
+    event_filter.get_new_entries.side_effect = [
+        ValueError("503 Server Error"),
+        [event],
+        asyncio.CancelledError,
+    ]
+    pipeline = MagicMock(put=AsyncMock())
+
+    with pytest.raises(asyncio.CancelledError):
+        await log_loop(event_filter, 0, pipeline)
+    # the failed read is logged and tried again
+    mock_print.assert_called_once_with(
+        "Unable to read the new events: ValueError('503 Server Error')"
+    )
+    pipeline.put.assert_awaited_once_with(event)
+
+
+@pytest.mark.asyncio
+async def test_log_loop_reads_in_a_thread():
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    def slow_read():
+        time.sleep(0.1)
+        raise asyncio.CancelledError
+
+    event_filter = MagicMock()
+    event_filter.get_new_entries.side_effect = slow_read
+    tick_task = asyncio.create_task(tick())
+    with pytest.raises(asyncio.CancelledError):
+        await log_loop(event_filter, 0, MagicMock())
+    tick_task.cancel()
+    # the other coroutines ran during the read
+    assert len(ticks) > 3
+
+
+@pytest.mark.asyncio
+@patch("src.event_subscription.print")
+async def test_pipeline_backpressure(mock_print):
+    release = asyncio.Event()
+
+    async def slow_handler(event, head_tracker):
+        await release.wait()
+        if event.args.productId == 3:
+            raise ValueError("boom")
+
+    events = []
+    for i in range(10):
+        event = MockEvent(event="NewProduct", newOwner="", block_num=1, transaction_hash="0x1")
+        event.args.productId = i
+        events.append(event)
+    event_filter = MagicMock()
+    reads = iter([events])
+    event_filter.get_new_entries.side_effect = lambda: next(reads, [])
+    pipeline = EventPipeline(MagicMock(), {"NewProduct": slow_handler}, workers=2, queue_size=3)
+    failed_before = metrics.events.value("NewProduct", "failed")
+    pipeline.start()
+
+    loop_task = asyncio.create_task(log_loop(event_filter, 0, pipeline))
+    await asyncio.sleep(0.01)
+    # two events are being handled, three are waiting and the reader waits for room
+    assert pipeline.stats() == {"queued": 3, "in_flight": 2, "completed": 0, "failed": 0}
+    assert event_filter.get_new_entries.call_count == 1
+
+    release.set()
+    await asyncio.sleep(0.01)
+    assert pipeline.stats() == {"queued": 0, "in_flight": 0, "completed": 9, "failed": 1}
+    mock_print.assert_called_once_with("Unable to handle event NewProduct: ValueError('boom')")
+    assert metrics.events.value("NewProduct", "failed") == failed_before + 1
+    loop_task.cancel()
+    await pipeline.stop()
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "mock_event, expected",
@@ -138,17 +328,61 @@ def test_polling_accepted_products(mock_listen):
     ],
 )
 @patch("src.event_subscription.Web3.toJSON")
-@patch("src.event_subscription.has_min_confirmations")
+@patch("src.head_tracker.get_transaction_receipts")
 @patch("src.event_subscription.WatchList.is_subscribed")
 @patch("src.event_subscription.print")
 async def test_handle_event(
-    mock_print, mock_wl_sub, mock_has_min, mock_wtojson, mock_event, expected
+    mock_print, mock_wl_sub, mock_receipts, mock_wtojson, mock_event, expected, monkeypatch
 ):
+    monkeypatch.setenv("MINIMUM_CONFIRMATION", "3")
     mock_wl_sub.return_value = True
-    mock_has_min.side_effect = [False, False, True]
-    await handle_event(mock_event)
+    mock_receipts.side_effect = lambda w3, tx_hashes: [{"status": 1} for _ in tx_hashes]
+    mock_w3 = MagicMock()
+    head_tracker = HeadTracker(mock_w3)
+    task = asyncio.create_task(handle_event(mock_event, head_tracker))
+
+    for block_number in (1, 2, 3):
+        mock_w3.eth.block_number = block_number
+        await head_tracker.poll()
+        assert not task.done()
+    mock_w3.eth.block_number = 4
+    await head_tracker.poll()
+    await task
+
     if not expected:
         mock_wl_sub.assert_not_called()
     else:
-        mock_print.assert_called_once()
-    mock_has_min.assert_has_calls([call(1, "0x0000"), call(1, "0x0000"), call(1, "0x0000")])
+        mock_wl_sub.assert_called_once_with("own")
+    mock_print.assert_called_once()
+    mock_receipts.assert_called_once_with(mock_w3, ["0x0000"])
+
+
+@pytest.mark.asyncio
+@patch("src.event_subscription.Web3.toJSON")
+@patch("src.event_subscription.WatchList.is_subscribed")
+@patch("src.event_subscription.print")
+async def test_handle_event_not_subscribed(mock_print, mock_wl_sub, mock_wtojson):
+    mock_wl_sub.return_value = False
+    event = MockEvent(
+        event="DelegateProduct", newOwner="own", block_num=1, transaction_hash="0x0000"
+    )
+    head_tracker = HeadTracker(MagicMock())
+    await handle_event(event, head_tracker)
+    mock_print.assert_called_once()
+    assert head_tracker.pending == 0
+
+
+@pytest.mark.asyncio
+@patch("src.head_tracker.get_transaction_receipts")
+@patch("src.event_subscription.print")
+async def test_handle_event_failed_transaction(mock_print, mock_receipts, monkeypatch):
+    monkeypatch.setenv("MINIMUM_CONFIRMATION", "0")
+    mock_receipts.return_value = [{"status": 0}]
+    event = MockEvent(event="NewProduct", newOwner="own", block_num=1, transaction_hash="0x0000")
+    head_tracker = HeadTracker(MagicMock())
+    task = asyncio.create_task(handle_event(event, head_tracker))
+    await asyncio.sleep(0)
+    head_tracker.w3.eth.block_number = 1
+    await head_tracker.poll()
+    await task
+    mock_print.assert_not_called()
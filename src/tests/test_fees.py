@@ -0,0 +1,128 @@
+# stdlib
+from unittest.mock import MagicMock, patch
+
+# deps
+import pytest
+from hexbytes import HexBytes
+
+# local
+from src import products
+from src.fees import DEFAULT_GAS, FeeCache, FeeTracker, GasTable
+from src.products import create_product
+from src.tests.fixtures import *
+
+
+@pytest.fixture
+def mock_fn():
+    fn = MagicMock()
+    fn.fn_name = "createProduct"
+    fn._encode_transaction_data.return_value = "0x" + "00" * 100
+    fn.estimateGas.return_value = 100000
+    return fn
+
+
+def test_fee_cache_ttl(monkeypatch):
+    now = [0]
+    monkeypatch.setattr("src.fees.time.monotonic", lambda: now[0])
+    mw3 = MagicMock()
+    mw3.eth.gas_price = 10
+    cache = FeeCache(ttl=15)
+    assert cache.gas_price(mw3) == 10
+    mw3.eth.gas_price = 20
+    now[0] = 14
+    assert cache.gas_price(mw3) == 10
+    now[0] = 30
+    assert cache.gas_price(mw3) == 20
+    assert cache.stats() == {"hits": 1, "misses": 2}
+
+
+def test_fee_cache_new_block():
+    mw3 = MagicMock()
+    mw3.eth.gas_price = 10
+    cache = FeeCache()
+    cache.on_new_block(1)
+    cache.gas_price(mw3)
+    cache.on_new_block(1)
+    assert cache.gas_price(mw3) == 10
+    mw3.eth.gas_price = 20
+    cache.on_new_block(2)
+    assert cache.gas_price(mw3) == 20
+    assert cache.stats() == {"hits": 1, "misses": 2}
+
+
+def test_gas_table_estimates_once(mock_fn):
+    table = GasTable(margin=1.5)
+    assert table.gas(mock_fn, "0x%040d" % 1) == 150000
+    assert table.gas(mock_fn, "0x%040d" % 1) == 150000
+    mock_fn.estimateGas.assert_called_once_with({"from": "0x%040d" % 1})
+    assert table.stats() == {"hits": 1, "misses": 1}
+
+    # longer arguments are estimated on their own
+    mock_fn._encode_transaction_data.return_value = "0x" + "00" * 200
+    table.gas(mock_fn, "0x%040d" % 1)
+    assert mock_fn.estimateGas.call_count == 2
+
+
+@patch("src.fees.print")
+def test_gas_table_estimate_error(mock_print, mock_fn):
+    mock_fn.estimateGas.side_effect = ValueError("execution reverted")
+    table = GasTable()
+    assert table.gas(mock_fn, "0x%040d" % 1) == DEFAULT_GAS
+    assert table.gas(mock_fn, "0x%040d" % 1) == DEFAULT_GAS
+    assert mock_fn.estimateGas.call_count == 2
+
+
+def test_gas_table_observe_receipt(mock_fn):
+    table = GasTable(margin=1)
+    table.gas(mock_fn, "0x%040d" % 1)
+    for i, gas_used in enumerate([80000, 90000, 85000]):
+        tx_hash = HexBytes(i)
+        table.track(tx_hash, mock_fn)
+        table.observe_receipt({"transactionHash": tx_hash, "status": 1, "gasUsed": gas_used})
+        # untracked and failed transactions are ignored
+        table.observe_receipt({"transactionHash": HexBytes(99), "status": 1, "gasUsed": 1})
+    assert table.gas(mock_fn, "0x%040d" % 1) == 90000
+
+    table.track(HexBytes(10), mock_fn)
+    table.observe_receipt({"transactionHash": HexBytes(10), "status": 0, "gasUsed": 200000})
+    assert table.gas(mock_fn, "0x%040d" % 1) == 90000
+
+
+def test_gas_table_pending_expiry(mock_fn):
+    table = GasTable(pending_blocks=3)
+    table.track(HexBytes(1), mock_fn)
+    assert table.pending(10) == [HexBytes(1)]
+    table.track(HexBytes(2), mock_fn)
+    assert table.pending(12) == [HexBytes(1), HexBytes(2)]
+    # never mined, dropped after 3 blocks of polls
+    assert table.pending(13) == [HexBytes(2)]
+    assert table.pending(15) == []
+
+
+def test_fee_tracker(mock_request, product_contract, mock_contract, mock_w3, w3, account_1):
+    tracker = FeeTracker(w3, products.fee_cache, products.gas_table)
+    tracker.poll()
+    tx_hash = create_product("prod_0", account_1.address)
+    assert products.gas_table.pending() == [tx_hash]
+
+    # the new block expires the gas price and the receipt refines the gas
+    tracker.poll()
+    assert products.gas_table.pending() == []
+    gas_used = w3.eth.get_transaction_receipt(tx_hash).gasUsed
+    create_product("prod_1", account_1.address)
+    assert w3.eth.get_transaction(w3.eth.get_block("latest").transactions[0]).gas == int(
+        gas_used * products.gas_table.margin
+    )
+    assert products.fee_cache.stats() == {"hits": 0, "misses": 2}
+
+
+def test_create_product_gas(mock_request, product_contract, mock_contract, mock_w3, w3, account_1):
+    tx_hash = create_product("prod_0", account_1.address)
+    receipt = w3.eth.get_transaction_receipt(tx_hash)
+    assert receipt.status == 1
+    assert w3.eth.get_transaction(tx_hash).gas < 210000
+
+    products.gas_table.observe_receipt(receipt)
+    create_product("prod_1", account_1.address)
+    assert products.gas_table.stats() == {"hits": 1, "misses": 1}
+    assert products.fee_cache.stats() == {"hits": 1, "misses": 1}
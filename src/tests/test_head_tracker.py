@@ -0,0 +1,110 @@
+# stdlib
+import asyncio
+from unittest.mock import MagicMock, patch
+
+# deps
+import pytest
+from hexbytes import HexBytes
+
+# local
+from src.batch import get_transaction_receipts
+from src.head_tracker import HeadTracker
+from src.tests.fixtures import *
+
+
+@pytest.fixture
+def head_tracker(monkeypatch):
+    monkeypatch.setenv("MINIMUM_CONFIRMATION", "2")
+    tracker = HeadTracker(MagicMock())
+    tracker.w3.eth.block_number = 10
+    return tracker
+
+
+@pytest.mark.asyncio
+@patch("src.head_tracker.get_transaction_receipts")
+async def test_release_in_one_batch(mock_receipts, head_tracker):
+    mock_receipts.side_effect = lambda w3, tx_hashes: [{"status": 1} for _ in tx_hashes]
+    waiters = [
+        asyncio.create_task(head_tracker.wait_for_confirmations(block_number, tx_hash))
+        for block_number, tx_hash in [(9, "0x01"), (9, "0x01"), (10, "0x02"), (11, "0x03")]
+    ]
+    await asyncio.sleep(0)
+    assert head_tracker.pending == 3
+
+    await head_tracker.poll()
+    assert not any(waiter.done() for waiter in waiters)
+    head_tracker.w3.eth.block_number = 12
+    await head_tracker.poll()
+    await asyncio.sleep(0)
+    assert [waiter.done() for waiter in waiters] == [True, True, True, False]
+    assert all(waiter.result() for waiter in waiters[:3])
+    # one receipt per transaction, read in a single batch
+    mock_receipts.assert_called_once_with(head_tracker.w3, ["0x01", "0x02"])
+    assert head_tracker.pending == 1
+    waiters[3].cancel()
+
+
+@pytest.mark.asyncio
+@patch("src.head_tracker.get_transaction_receipts")
+async def test_same_block_is_not_processed_twice(mock_receipts, head_tracker):
+    mock_receipts.return_value = [None]
+    waiter = asyncio.create_task(head_tracker.wait_for_confirmations(1, "0x01"))
+    await asyncio.sleep(0)
+    await head_tracker.poll()
+    await head_tracker.poll()
+    # a receipt not found is read once per block
+    mock_receipts.assert_called_once()
+    # receipts not available yet are read again on the next block
+    mock_receipts.return_value = [{"status": 1}]
+    head_tracker.w3.eth.block_number = 11
+    await head_tracker.poll()
+    assert await waiter
+
+
+@pytest.mark.asyncio
+@patch("src.head_tracker.get_transaction_receipts")
+async def test_release_already_confirmed(mock_receipts, head_tracker):
+    mock_receipts.return_value = [{"status": 1}]
+    await head_tracker.poll()
+    # deep enough when it is added, released without a new block
+    waiter = asyncio.create_task(head_tracker.wait_for_confirmations(5, "0x01"))
+    await asyncio.sleep(0)
+    await head_tracker.poll()
+    assert head_tracker.pending == 0
+    assert await waiter
+
+
+@pytest.mark.asyncio
+@patch("src.head_tracker.get_transaction_receipts")
+async def test_callbacks(mock_receipts, monkeypatch):
+    monkeypatch.setenv("MINIMUM_CONFIRMATION", "0")
+    receipt = {"status": 1, "transactionHash": "0x01"}
+    mock_receipts.return_value = [receipt]
+    on_new_block = MagicMock()
+    on_receipt = MagicMock()
+    tracker = HeadTracker(MagicMock(), on_new_block=[on_new_block], on_receipt=[on_receipt])
+    tracker.w3.eth.block_number = 5
+    waiter = asyncio.create_task(tracker.wait_for_confirmations(5, "0x01"))
+    await asyncio.sleep(0)
+    await tracker.poll()
+    assert await waiter
+    on_new_block.assert_called_once_with(5)
+    on_receipt.assert_called_once_with(receipt)
+
+
+@pytest.mark.asyncio
+@patch("src.head_tracker.print")
+async def test_run_survives_errors(mock_print):
+    tracker = HeadTracker(MagicMock(), poll_interval=0)
+    type(tracker.w3.eth).block_number = property(MagicMock(side_effect=ValueError("down")))
+    task = asyncio.create_task(tracker.run())
+    await asyncio.sleep(0.05)
+    task.cancel()
+    mock_print.assert_called_with("Unable to poll the chain head: down")
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_get_transaction_receipts(w3, new_product):
+    receipts = get_transaction_receipts(w3, new_product + [HexBytes("0x" + "00" * 32)])
+    assert [r.status for r in receipts[:2]] == [1, 1]
+    assert receipts[2] is None
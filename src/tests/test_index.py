@@ -0,0 +1,233 @@
+# stdlib
+import threading
+from unittest.mock import MagicMock, patch
+
+# deps
+import pytest
+
+# local
+from src.batch import get_transactions
+from src.index import ZERO_ADDRESS, ProductIndex
+from src.models import Product
+from src.products import (
+    get_delegated_products,
+    get_delegated_products_by_owner,
+    get_product,
+    get_product_by_name,
+    get_products,
+    get_products_by_new_owner,
+    get_products_by_status,
+    state_version,
+)
+from src.tests.fixtures import *
+
+
+@pytest.mark.parametrize("new_product", [3], indirect=True)
+def test_sync_new_products(product_contract, account_1, new_product):
+    index = ProductIndex()
+    applied = index.sync(product_contract)
+
+    assert applied == 3
+    assert index.ready
+    assert index.size() == 3
+    for i, product in index.products():
+        assert product.to_dict() == {
+            "name": f"new_prod_{i}",
+            "status": 0,
+            "owner": account_1.address,
+            "new_owner": ZERO_ADDRESS,
+        }
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_sync_matches_contract(product_contract, account_1, account_2, new_product, sign_and_send):
+    index = ProductIndex()
+    index.sync(product_contract)
+
+    sign_and_send(product_contract.functions.delegateProduct(0, account_2.address), account_1)
+    sign_and_send(product_contract.functions.delegateProduct(1, account_2.address), account_1)
+    sign_and_send(product_contract.functions.acceptProduct(1), account_2)
+    assert index.sync(product_contract) == 3
+
+    for i, product in index.products():
+        on_chain = product_contract.functions.products(i).call()
+        assert product.to_dict() == Product(*on_chain).to_dict()
+    assert index.get(1).owner == account_2.address
+    # nothing new to replay
+    assert index.sync(product_contract) == 0
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_version_changes_with_events(
+    product_contract, account_1, account_2, new_product, sign_and_send
+):
+    index = ProductIndex()
+    assert index.version == "0"
+    index.sync(product_contract)
+    version = index.version
+    assert version != "0"
+    # no new events
+    index.put(5, Product("read_from_contract", 0, account_1.address, ZERO_ADDRESS))
+    index.sync(product_contract)
+    assert index.version == version
+
+    sign_and_send(product_contract.functions.delegateProduct(0, account_2.address), account_1)
+    index.sync(product_contract)
+    assert index.version != version
+    index.reset()
+    assert index.version == "0"
+
+
+def test_sync_from_future_block(product_contract):
+    index = ProductIndex(from_block=1000)
+    assert index.sync(product_contract) == 0
+    assert index.ready
+    assert index.last_block == 999
+
+
+@pytest.mark.parametrize("new_product", [3], indirect=True)
+def test_creators_read_together(product_contract, account_1, new_product):
+    index = ProductIndex()
+    with patch("src.index.get_transactions", wraps=get_transactions) as mock_get_transactions:
+        index.sync(product_contract)
+    mock_get_transactions.assert_called_once()
+    assert len(mock_get_transactions.call_args.args[1]) == 3
+    assert [p.owner for _, p in index.products()] == [account_1.address] * 3
+
+
+def test_follow_syncs_in_the_thread():
+    index = ProductIndex()
+    synced = threading.Event()
+    with patch.object(index, "sync", side_effect=lambda contract: synced.set()):
+        thread = index.follow(MagicMock(), poll_interval=60)
+        assert thread.is_alive()
+        assert synced.wait(1)
+
+
+@pytest.mark.parametrize("new_product", [1], indirect=True)
+def test_events_replace_the_products(
+    product_contract, account_1, account_2, new_product, sign_and_send
+):
+    index = ProductIndex()
+    index.sync(product_contract)
+    product = index.get(0)
+    sign_and_send(product_contract.functions.delegateProduct(0, account_2.address), account_1)
+    index.sync(product_contract)
+    # the product handed to a request before the event is not changed under it
+    assert (product.status, product.new_owner) == (0, ZERO_ADDRESS)
+    assert (index.get(0).status, index.get(0).new_owner) == (1, account_2.address)
+
+
+def test_apply_event_unknown_product():
+    index = ProductIndex()
+    event = MagicMock(event="DelegateProduct")
+    event.args.productId = 7
+    index.apply_event(event, MagicMock())
+    assert index.get(7) is None
+
+
+@patch("src.products.contract")
+def test_get_product_from_index(mock_contract, mock_product_index):
+    mock_product_index.put(0, Product("indexed", 0, "0x%040d" % 1, ZERO_ADDRESS))
+    product = get_product(0)
+    assert product.name == "indexed"
+    mock_contract.functions.products.assert_not_called()
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_get_product_fallback(w3, mock_contract, mock_w3, new_product, mock_product_index):
+    # the index is not built yet, products are read from the contract and not stored
+    assert get_product(0).name == "new_prod_0"
+    assert mock_product_index.get(0) is None
+
+    mock_product_index.last_block = w3.eth.block_number
+    assert get_product(1).name == "new_prod_1"
+    assert mock_product_index.get(1).name == "new_prod_1"
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_reads_at_the_index_block(
+    w3, product_contract, mock_contract, mock_w3, new_product, mock_product_index
+):
+    mock_product_index.last_block = w3.eth.block_number - 1
+    version = state_version()
+    # a product created after the last synced block is not read at the current block, so the
+    # index version still tags the responses
+    assert [p["name"] for p in get_products()] == ["new_prod_0"]
+    assert mock_product_index.get(1) is None
+    assert state_version() == version
+
+
+@pytest.mark.parametrize("new_product", [3], indirect=True)
+def test_get_products_from_index(
+    product_contract, mock_contract, mock_w3, new_product, mock_product_index
+):
+    mock_product_index.sync(product_contract)
+    with patch.object(product_contract.functions, "products") as mock_products:
+        products = get_products()
+    mock_products.assert_not_called()
+    assert [p["name"] for p in products] == ["new_prod_0", "new_prod_1", "new_prod_2"]
+
+
+def test_find():
+    index = ProductIndex()
+    owner_1, owner_2 = "0x%040d" % 1, "0x%040d" % 2
+    index.put(0, Product("prod", 0, owner_1, ZERO_ADDRESS))
+    index.put(1, Product("prod", 1, owner_1, owner_2))
+    index.put(2, Product("other", 1, owner_2, owner_1))
+
+    assert [i for i, _ in index.find(name="prod")] == [0, 1]
+    assert [i for i, _ in index.find(status=1)] == [1, 2]
+    assert [i for i, _ in index.find(owner=owner_1, status=1)] == [1]
+    assert [i for i, _ in index.find(new_owner=owner_1)] == [2]
+    assert index.find(name="missing") == []
+
+    # replacing a product updates its index entries
+    index.put(1, Product("renamed", 0, owner_2, ZERO_ADDRESS))
+    assert [i for i, _ in index.find(name="prod")] == [0]
+    assert [i for i, _ in index.find(owner=owner_2)] == [1, 2]
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_find_follows_events(product_contract, account_1, account_2, new_product, sign_and_send):
+    index = ProductIndex()
+    index.sync(product_contract)
+    # addresses are matched case insensitive
+    assert len(index.find(owner=account_1.address.lower())) == 2
+
+    sign_and_send(product_contract.functions.delegateProduct(0, account_2.address), account_1)
+    index.sync(product_contract)
+    assert [i for i, _ in index.find(status=1)] == [0]
+    assert [i for i, _ in index.find(new_owner=account_2.address)] == [0]
+
+    sign_and_send(product_contract.functions.acceptProduct(0), account_2)
+    index.sync(product_contract)
+    assert index.find(status=1) == []
+    assert index.find(new_owner=account_2.address) == []
+    assert [i for i, _ in index.find(owner=account_2.address)] == [0]
+    assert [i for i, _ in index.find(owner=account_1.address)] == [1]
+
+
+def test_reset():
+    index = ProductIndex()
+    index.put(0, Product("prod", 0, ZERO_ADDRESS, ZERO_ADDRESS))
+    index.last_block = 10
+    index.reset()
+    assert not index.ready
+    assert index.size() == 0
+    assert index.find(name="prod") == []
+
+
+@patch("src.products.get_products")
+def test_filters_use_index(mock_get_products, mock_product_index):
+    owner = "0x%040d" % 1
+    mock_product_index.put(0, Product("prod_0", 1, owner, ZERO_ADDRESS))
+    mock_product_index.put(1, Product("prod_1", 0, ZERO_ADDRESS, owner))
+    mock_product_index.last_block = 0
+
+    assert get_product_by_name("prod_1")[0]["name"] == "prod_1"
+    assert [p["name"] for p in get_delegated_products()] == ["prod_0"]
+    assert [p["name"] for p in get_products_by_status(0)] == ["prod_1"]
+    assert [p["name"] for p in get_delegated_products_by_owner(owner)] == ["prod_0"]
+    assert [p["name"] for p in get_products_by_new_owner(owner)] == ["prod_1"]
+    mock_get_products.assert_not_called()
@@ -0,0 +1,174 @@
+# stdlib
+from unittest.mock import MagicMock
+
+# deps
+import pytest
+import requests
+from web3.datastructures import AttributeDict
+
+# local
+from src.log_cursor import LogCursor, is_range_error
+from src.tests.fixtures import *
+
+
+def product_events(contract):
+    return [
+        contract.events.NewProduct,
+        contract.events.DelegateProduct,
+        contract.events.AcceptProduct,
+    ]
+
+
+@pytest.fixture
+def mock_cursor_w3(product_contract):
+    cursor = LogCursor(product_events(product_contract), chunk_size=100)
+    cursor.w3 = MagicMock()
+    cursor.w3.eth.block_number = 999
+    cursor.w3.eth.get_logs.return_value = []
+    return cursor
+
+
+@pytest.mark.parametrize("new_product", [3], indirect=True)
+def test_scan(product_contract, account_2, new_product, sign_and_send, account_1):
+    sign_and_send(product_contract.functions.delegateProduct(1, account_2.address), account_1)
+    cursor = LogCursor(product_events(product_contract), chunk_size=1)
+    events = [event for chunk in cursor.scan() for event in chunk]
+
+    assert [e.event for e in events] == [
+        "NewProduct",
+        "NewProduct",
+        "NewProduct",
+        "DelegateProduct",
+    ]
+    assert [e.args.productId for e in events] == [0, 1, 2, 1]
+    assert events[3].args.newOwner == account_2.address
+    assert cursor.caught_up
+    assert cursor.last_block == product_contract.web3.eth.block_number
+    # the range grows while the queries are small and fast
+    assert cursor.chunk_size > 1
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_checkpoint_resume(product_contract, new_product, tmp_path, w3):
+    checkpoint_path = str(tmp_path / "checkpoints" / "products.json")
+    cursor = LogCursor(product_events(product_contract), checkpoint_path=checkpoint_path)
+    entries = cursor.get_new_entries()
+    assert len(entries) == 2
+    for entry in entries:
+        cursor.handled(entry)
+    last_block = cursor.last_block
+    assert last_block == cursor.read_block
+    with open(checkpoint_path) as checkpoint_file:
+        assert json.load(checkpoint_file) == {"last_block": last_block}
+
+    w3.eth.send_transaction({"from": w3.eth.accounts[0], "to": w3.eth.accounts[1], "value": 1})
+    restarted = LogCursor(product_events(product_contract), checkpoint_path=checkpoint_path)
+    assert restarted.last_block == last_block
+    assert restarted.get_new_entries() == []
+    assert restarted.last_block == last_block + 1
+
+
+def test_get_new_entries_max_entries(mock_cursor_w3):
+    mock_cursor_w3.w3.eth.get_logs.side_effect = lambda params: [params["fromBlock"]] * 10
+    mock_cursor_w3.decode = lambda log: AttributeDict({"blockNumber": log})
+    entries = mock_cursor_w3.get_new_entries(max_entries=15)
+    assert len(entries) == 20
+    # the second range is twice as large
+    assert mock_cursor_w3.read_block == 299
+    assert not mock_cursor_w3.caught_up
+
+
+def test_checkpoint_after_handled(mock_cursor_w3):
+    mock_cursor_w3.w3.eth.block_number = 9
+    mock_cursor_w3.w3.eth.get_logs.return_value = [5, 5, 7]
+    mock_cursor_w3.decode = lambda log: AttributeDict({"blockNumber": log})
+    first, second, third = mock_cursor_w3.get_new_entries()
+    # nothing is checkpointed before the entries are handled
+    assert mock_cursor_w3.last_block == 4
+    mock_cursor_w3.handled(third)
+    mock_cursor_w3.handled(first)
+    assert mock_cursor_w3.last_block == 4
+    mock_cursor_w3.handled(second)
+    assert mock_cursor_w3.last_block == 9
+
+    mock_cursor_w3.w3.eth.block_number = 12
+    mock_cursor_w3.w3.eth.get_logs.return_value = []
+    assert mock_cursor_w3.get_new_entries() == []
+    assert mock_cursor_w3.last_block == 12
+
+
+def test_failed_range_keeps_the_entries_read(mock_cursor_w3):
+    mock_cursor_w3.w3.eth.block_number = 299
+    error = ValueError({"code": -32000, "message": "internal error"})
+    mock_cursor_w3.w3.eth.get_logs.side_effect = [[5, 7], error, [250]]
+    mock_cursor_w3.decode = lambda log: AttributeDict({"blockNumber": log})
+    first, second = mock_cursor_w3.get_new_entries()
+    # the range read before the failure is returned, and not checkpointed until handled
+    assert mock_cursor_w3.read_block == 99
+    assert mock_cursor_w3.last_block == 4
+    mock_cursor_w3.handled(first)
+    mock_cursor_w3.handled(second)
+    assert mock_cursor_w3.last_block == 99
+
+    # the failed range is read again
+    (third,) = mock_cursor_w3.get_new_entries()
+    assert third.blockNumber == 250
+    assert mock_cursor_w3.last_block == 249
+    mock_cursor_w3.handled(third)
+    assert mock_cursor_w3.last_block == 299
+
+
+def test_range_error_shrinks_chunk(mock_cursor_w3):
+    too_many = ValueError({"code": -32005, "message": "query returned more than 10000 results"})
+    mock_cursor_w3.w3.eth.block_number = 24
+    mock_cursor_w3.w3.eth.get_logs.side_effect = [too_many, too_many] + [[]] * 3
+    mock_cursor_w3.get_new_entries()
+    params = [c.args[0] for c in mock_cursor_w3.w3.eth.get_logs.call_args_list]
+    # the refused range is halved, not the larger chunk
+    assert [(p["fromBlock"], p["toBlock"]) for p in params] == [
+        (0, 24),
+        (0, 11),
+        (0, 5),
+        (6, 17),
+        (18, 24),
+    ]
+
+
+def test_slow_query_shrinks_chunk(mock_cursor_w3, monkeypatch):
+    ticks = iter([0, 10])
+    monkeypatch.setattr("src.log_cursor.time.monotonic", lambda: next(ticks))
+    mock_cursor_w3.w3.eth.block_number = 99
+    mock_cursor_w3.get_new_entries()
+    assert mock_cursor_w3.chunk_size == 50
+
+
+def test_other_errors_are_raised(mock_cursor_w3):
+    mock_cursor_w3.w3.eth.get_logs.side_effect = ValueError({"code": -32000, "message": "boom"})
+    with pytest.raises(ValueError):
+        mock_cursor_w3.get_new_entries()
+    assert mock_cursor_w3.last_block == -1
+
+
+def test_range_error_at_min_chunk_is_raised(mock_cursor_w3):
+    mock_cursor_w3.chunk_size = 1
+    mock_cursor_w3.w3.eth.get_logs.side_effect = ValueError("block range too large")
+    with pytest.raises(ValueError):
+        mock_cursor_w3.get_new_entries()
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (ValueError({"code": -32005, "message": "Log response size exceeded"}), True),
+        (ValueError("query returned more than 10000 results"), True),
+        (ValueError("exceed maximum block range: 5000"), True),
+        (requests.Timeout(), True),
+        (ValueError("query timeout exceeded"), False),
+        (ValueError({"code": -32005, "message": "daily request count limit exceeded"}), False),
+        (requests.HTTPError("500 Server Error"), False),
+        (ValueError({"code": -32000, "message": "header not found"}), False),
+        (KeyError("topics"), False),
+    ],
+)
+def test_is_range_error(error, expected):
+    assert is_range_error(error) == expected
@@ -0,0 +1,110 @@
+# stdlib
+from unittest.mock import MagicMock, patch
+
+# deps
+import pytest
+
+# local
+from app import app
+from src.metrics import (
+    Counter,
+    Histogram,
+    Registry,
+    http_latency,
+    rpc_errors,
+    rpc_metrics_middleware,
+    rpc_requests,
+    signer_requests,
+    track,
+)
+from src.products import send_transaction
+from src.tests.fixtures import *
+
+
+client = app.test_client()
+
+
+def test_render():
+    registry = Registry()
+    counter = registry.register(Counter("calls_total", "Calls.", ("method",)))
+    histogram = registry.register(Histogram("latency_seconds", "Latency.", ("method",), (0.1, 1)))
+    counter.inc("eth_call")
+    counter.inc("eth_call", amount=2)
+    counter.inc('say "hi"')
+    histogram.observe(0.05, "eth_call")
+    histogram.observe(0.5, "eth_call")
+
+    assert registry.render().splitlines() == [
+        "# HELP calls_total Calls.",
+        "# TYPE calls_total counter",
+        'calls_total{method="eth_call"} 3',
+        'calls_total{method="say \\"hi\\""} 1',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{method="eth_call",le="0.1"} 1',
+        'latency_seconds_bucket{method="eth_call",le="1"} 2',
+        'latency_seconds_bucket{method="eth_call",le="+Inf"} 2',
+        'latency_seconds_sum{method="eth_call"} 0.55',
+        'latency_seconds_count{method="eth_call"} 2',
+    ]
+
+
+def test_track():
+    counter = Counter("calls_total", "Calls.", ("route", "outcome"))
+    histogram = Histogram("latency_seconds", "Latency.", ("route",))
+    with track(counter, histogram, "sign"):
+        pass
+    with pytest.raises(ValueError):
+        with track(counter, histogram, "sign"):
+            raise ValueError
+    assert counter.value("sign", "ok") == 1
+    assert counter.value("sign", "error") == 1
+    assert histogram.count("sign") == 2
+
+
+def test_rpc_metrics_middleware(w3):
+    w3.middleware_onion.inject(rpc_metrics_middleware, "rpc_metrics", layer=0)
+    before = rpc_requests.value("eth_blockNumber")
+    w3.eth.block_number
+    w3.eth.block_number
+    assert rpc_requests.value("eth_blockNumber") == before + 2
+
+
+def test_rpc_metrics_middleware_errors():
+    make_request = MagicMock(side_effect=[{"error": {"message": "reverted"}}, TimeoutError])
+    middleware = rpc_metrics_middleware(make_request, None)
+    requests_before = rpc_requests.value("eth_call")
+    errors_before = rpc_errors.value("eth_call")
+    assert middleware("eth_call", []) == {"error": {"message": "reverted"}}
+    with pytest.raises(TimeoutError):
+        middleware("eth_call", [])
+    assert rpc_requests.value("eth_call") == requests_before + 2
+    assert rpc_errors.value("eth_call") == errors_before + 2
+
+
+@patch("app.get_products_by_status")
+def test_metrics_endpoint(mock_by_status):
+    mock_by_status.return_value = []
+    before = http_latency.count("/products", "GET", "200")
+    client.get("/products?status=1")
+    assert http_latency.count("/products", "GET", "200") == before + 1
+
+    response = client.get("/metrics")
+    assert response.content_type.startswith("text/plain")
+    body = response.get_data(as_text=True)
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert (
+        'http_request_duration_seconds_count{route="/products",method="GET",status="200"}' in body
+    )
+
+
+@patch("src.products.print")
+@patch.object(get_session(), "request")
+def test_signer_errors_counted(mock_request, mock_print, mock_w3):
+    before = signer_requests.value("sign", "error")
+    transaction = MagicMock()
+    transaction.buildTransaction.return_value = {"nonce": 0}
+    mock_request.side_effect = Exception("Signer down")
+    with patch("src.products.nonce_manager"):
+        send_transaction(transaction, "0x%040d" % 1)
+    assert signer_requests.value("sign", "error") == before + 1
@@ -0,0 +1,154 @@
+# stdlib
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+# deps
+import pytest
+from eth_utils import keccak
+from hexbytes import HexBytes
+
+# local
+from src.nonce import NonceManager, is_already_known, is_nonce_error
+from src.products import create_product, send_transaction
+from src.sessions import get_session
+from src.tests.fixtures import *
+
+
+ADDRESS = "0x%040d" % 1
+
+
+@pytest.fixture
+def mock_nonce_w3():
+    mw3 = MagicMock()
+    mw3.eth.get_transaction_count.return_value = 5
+    return mw3
+
+
+@pytest.fixture
+def mock_nonce_manager(monkeypatch):
+    manager = NonceManager()
+    monkeypatch.setattr("src.products.nonce_manager", manager)
+    return manager
+
+
+def test_allocate(mock_nonce_w3):
+    manager = NonceManager()
+    assert [manager.allocate(mock_nonce_w3, ADDRESS) for _ in range(3)] == [5, 6, 7]
+    # synced once from the pending transaction count, addresses are case insensitive
+    assert manager.allocate(mock_nonce_w3, ADDRESS.upper().replace("0X", "0x")) == 8
+    mock_nonce_w3.eth.get_transaction_count.assert_called_once_with(ADDRESS, "pending")
+
+
+def test_allocate_concurrently(mock_nonce_w3):
+    manager = NonceManager()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        nonces = list(executor.map(lambda _: manager.allocate(mock_nonce_w3, ADDRESS), range(200)))
+    assert sorted(nonces) == list(range(5, 205))
+
+
+def test_release_last_nonce(mock_nonce_w3):
+    manager = NonceManager()
+    nonce = manager.allocate(mock_nonce_w3, ADDRESS)
+    manager.release(ADDRESS, nonce)
+    assert manager.allocate(mock_nonce_w3, ADDRESS) == nonce
+    assert mock_nonce_w3.eth.get_transaction_count.call_count == 1
+
+
+def test_release_with_gap_resyncs(mock_nonce_w3):
+    manager = NonceManager()
+    nonce = manager.allocate(mock_nonce_w3, ADDRESS)
+    manager.allocate(mock_nonce_w3, ADDRESS)
+    manager.release(ADDRESS, nonce)
+    mock_nonce_w3.eth.get_transaction_count.return_value = 6
+    assert manager.allocate(mock_nonce_w3, ADDRESS) == 6
+    assert mock_nonce_w3.eth.get_transaction_count.call_count == 2
+
+
+def test_resync(mock_nonce_w3):
+    manager = NonceManager()
+    manager.allocate(mock_nonce_w3, ADDRESS)
+    mock_nonce_w3.eth.get_transaction_count.return_value = 9
+    manager.resync(ADDRESS)
+    assert manager.allocate(mock_nonce_w3, ADDRESS) == 9
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (ValueError({"code": -32000, "message": "nonce too low"}), True),
+        (ValueError({"code": -32000, "message": "replacement transaction underpriced"}), True),
+        (ValueError({"code": -32000, "message": "already known"}), False),
+        (ValueError({"code": -32000, "message": "insufficient funds for gas"}), False),
+        (Exception(), False),
+    ],
+)
+def test_is_nonce_error(error, expected):
+    assert is_nonce_error(error) == expected
+
+
+def test_is_already_known():
+    assert is_already_known(ValueError({"code": -32000, "message": "already known"}))
+    assert not is_already_known(ValueError({"code": -32000, "message": "nonce too low"}))
+
+
+def test_create_products_without_reading_nonce(
+    mock_request, mock_contract, mock_w3, w3, account_1, mock_nonce_manager
+):
+    with patch.object(w3.eth, "get_transaction_count", wraps=w3.eth.get_transaction_count) as m:
+        for i in range(3):
+            create_product(f"prod_{i}", account_1.address)
+    m.assert_called_once()
+    assert w3.eth.get_transaction_count(account_1.address) == 3
+
+
+@patch("src.products.print")
+@patch("src.products.w3")
+def test_send_transaction_resyncs_on_nonce_error(
+    mock_pw3, mock_print, mock_nonce_manager, mock_fee_cache
+):
+    mock_pw3.eth.gas_price = 1
+    mock_pw3.eth.get_transaction_count.side_effect = [3, 7]
+    mock_pw3.eth.send_raw_transaction.side_effect = [
+        ValueError({"code": -32000, "message": "nonce too low"}),
+        "fake-hash",
+    ]
+    mock_tx = MagicMock()
+    mock_tx.buildTransaction.side_effect = lambda params: params
+    with patch.object(get_session(), "request") as mock_sign:
+        mock_sign.return_value = MockResponse({"rawTransaction": "0x00"}, 200)
+        assert send_transaction(mock_tx, ADDRESS) == "fake-hash"
+
+    nonces = [c.args[0]["nonce"] for c in mock_tx.buildTransaction.call_args_list]
+    assert nonces == [3, 7]
+
+
+@patch("src.products.print")
+@patch("src.products.w3")
+def test_send_transaction_retries_once(mock_pw3, mock_print, mock_nonce_manager, mock_fee_cache):
+    mock_pw3.eth.gas_price = 1
+    mock_pw3.eth.get_transaction_count.return_value = 3
+    mock_pw3.eth.send_raw_transaction.side_effect = ValueError("nonce too low")
+    mock_tx = MagicMock()
+    mock_tx.buildTransaction.side_effect = lambda params: params
+    with patch.object(get_session(), "request") as mock_sign:
+        mock_sign.return_value = MockResponse({"rawTransaction": "0x00"}, 200)
+        assert send_transaction(mock_tx, ADDRESS) == {"error": "Something went wrong, try again."}
+    assert mock_pw3.eth.send_raw_transaction.call_count == 2
+
+
+@patch("src.products.print")
+@patch("src.products.w3")
+def test_send_transaction_already_known(mock_pw3, mock_print, mock_nonce_manager, mock_fee_cache):
+    mock_pw3.eth.gas_price = 1
+    mock_pw3.eth.get_transaction_count.return_value = 3
+    mock_pw3.eth.send_raw_transaction.side_effect = ValueError(
+        {"code": -32000, "message": "already known"}
+    )
+    mock_tx = MagicMock()
+    mock_tx.buildTransaction.side_effect = lambda params: params
+    with patch.object(get_session(), "request") as mock_sign:
+        mock_sign.return_value = MockResponse({"rawTransaction": "0x00"}, 200)
+        # the node already has the transaction, it was sent
+        assert send_transaction(mock_tx, ADDRESS) == HexBytes(keccak(HexBytes("0x00")))
+    mock_pw3.eth.send_raw_transaction.assert_called_once_with("0x00")
+    mock_pw3.eth.get_transaction_count.assert_called_once()
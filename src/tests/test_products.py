@@ -3,20 +3,29 @@ from unittest.mock import MagicMock, patch
 
 # deps
 import pytest
+from web3 import exceptions as web3Exceptions
 
 # local
+from src import products
 from src.exceptions import ProductDoesNotExists
 from src.products import (
+    HEAD_SIZE,
     accept_product,
     create_product,
+    create_products,
     delegate_product,
     get_delegated_products,
     get_delegated_products_by_owner,
     get_product,
     get_product_by_name,
     get_products,
+    get_products_by_new_owner,
+    get_products_page,
+    iter_products,
     send_transaction,
+    send_transactions,
 )
+from src.sessions import get_session
 from src.tests.fixtures import *
 
 
@@ -28,10 +37,10 @@ def test_send_transaction_invalid_addr(mock_w3):
 
 @patch("src.products.w3.eth.get_transaction_count")
 @patch("src.products.print")
-@patch("src.products.requests.request")
+@patch.object(get_session(), "request")
 def test_send_transaction_request_error(mock_request, mock_print, mock_get_txc, mock_w3):
     mock_build_tx = MagicMock()
-    mock_build_tx.buildTransaction.return_value = {"rawTransaction": "fake tx"}
+    mock_build_tx.buildTransaction.return_value = {"rawTransaction": "fake tx", "nonce": 0}
     mock_request.side_effect = Exception("Some exception")
     ret = send_transaction(mock_build_tx, "fake-address")
     assert ret == {"error": "Something went wrong, try again."}
@@ -58,7 +67,12 @@ def test_get_product(product_contract, mock_contract, mock_w3, account_1, new_pr
     assert product[3] == "0x0000000000000000000000000000000000000000"
 
 
-def test_get_product_raise_exception(mock_exception):
+def test_get_product_raise_exception(mock_contract, mock_w3, monkeypatch):
+    # the call of a product that doesn't exist reverts
+    monkeypatch.setattr(
+        "src.call_cache.batch_call",
+        lambda functions, block_identifier: [web3Exceptions.ContractLogicError("reverted")],
+    )
     with pytest.raises(ProductDoesNotExists):
         get_product(0)
 
@@ -126,12 +140,17 @@ def test_get_product_by_name(mock_products):
 
 @patch("src.products.print")
 @patch("src.products.contract.functions.size")
-@patch("src.products.get_product")
-def test_get_products_exception(mock_get_product, mock_size, mock_print):
-    mock_get_product.return_value.to_dict.side_effect = [
-        {"name": "fake-prod-1", "status": 0, "owner": "0x%040d" % 0, "new_owner": "0x%040d" % 0},
-        ProductDoesNotExists,
-    ]
+@patch("src.products.contract.functions.products")
+def test_get_products_exception(mock_products, mock_size, mock_print, mock_w3):
+    def mock_product(product_id):
+        mproduct = MagicMock()
+        if product_id == 0:
+            mproduct.call.return_value = ["fake-prod-1", 0, "0x%040d" % 0, "0x%040d" % 0]
+        else:
+            mproduct.call.side_effect = web3Exceptions.ContractLogicError
+        return mproduct
+
+    mock_products.side_effect = mock_product
     msize = MagicMock()
     msize.call.return_value = 2
     mock_size.return_value = msize
@@ -162,3 +181,104 @@ def test_get_delegated_products_by_owner(mock_products):
     assert len(owner_products) == 4
     for op in owner_products:
         assert op["owner"] == "0x%040d" % 1
+
+
+@patch("src.products.get_products")
+def test_filters_by_address_case_insensitive(mock_products):
+    owner, new_owner = "0x" + "AB" * 20, "0x" + "Cd" * 20
+    mock_products.return_value = [
+        {"owner": owner, "new_owner": new_owner},
+        {"owner": "0x%040d" % 1, "new_owner": "0x%040d" % 0},
+    ]
+    # the fallback matches the addresses like the index, checksummed or not
+    assert get_delegated_products_by_owner(owner.lower(), block=7) == [
+        mock_products.return_value[0]
+    ]
+    assert get_products_by_new_owner(new_owner.upper().replace("0X", "0x"), block=7) == [
+        mock_products.return_value[0]
+    ]
+
+
+@pytest.mark.parametrize("new_product", [5], indirect=True)
+def test_get_products_page(mock_contract, mock_w3, new_product):
+    page = get_products_page(cursor=1, limit=3)
+    assert [p["name"] for p in page["products"]] == ["new_prod_1", "new_prod_2", "new_prod_3"]
+    assert page["next_cursor"] == 4
+
+    page = get_products_page(cursor=page["next_cursor"], limit=3)
+    assert [p["name"] for p in page["products"]] == ["new_prod_4"]
+    assert page["next_cursor"] is None
+
+
+@pytest.mark.parametrize("new_product", [5], indirect=True)
+def test_iter_products(mock_contract, mock_w3, new_product, monkeypatch):
+    monkeypatch.setattr("src.products.DEFAULT_BATCH_SIZE", 2)
+    products = iter_products(start=1)
+    product_id, product = next(products)
+    assert product_id == 1
+    assert product.name == "new_prod_1"
+    assert [i for i, _ in products] == [2, 3, 4]
+    assert [i for i, _ in iter_products(start=0, limit=2)] == [0, 1]
+
+
+@pytest.mark.parametrize("new_product", [12], indirect=True)
+def test_listing_head_size(mock_contract, mock_w3, new_product, monkeypatch):
+    monkeypatch.setattr("src.products.batching_enabled", lambda w3: True)
+    with patch.object(products.call_cache, "call", wraps=products.call_cache.call) as mock_call:
+        get_products()
+        products.block_pin.expire()
+        get_products()
+    amount = products.contract.functions.size().call()
+    # the first listing reads a few products with the amount, the next ones no more than it
+    calls = [len(c.args[0]) for c in mock_call.call_args_list if c.args[0]]
+    assert calls == [1 + HEAD_SIZE, amount - HEAD_SIZE, 1 + amount]
+
+
+def test_create_products(mock_batch_request, product_contract, mock_contract, mock_w3, account_1):
+    with patch.object(get_session(), "post", wraps=get_session().post) as mock_post:
+        hashes = create_products([f"prod_{i}" for i in range(5)], account_1.address)
+    mock_post.assert_called_once()
+    assert mock_post.call_args.args[0] == "http://service:5001/batch"
+    assert len(hashes) == 5
+    assert product_contract.functions.size().call() == 5
+    assert product_contract.functions.products(4).call()[0] == "prod_4"
+
+
+@patch("src.products.print")
+def test_send_transactions_stops_after_failure(
+    mock_print, mock_request, mock_batch_request, mock_contract, mock_w3, w3, account_1
+):
+    sign_batch = get_session().post
+
+    def mock_sign_batch(*args, **kwargs):
+        response = sign_batch(*args, **kwargs)
+        response.json_data["results"][2] = {"error": "fake error"}
+        return response
+
+    with patch.object(get_session(), "post", side_effect=mock_sign_batch):
+        results = create_products([f"prod_{i}" for i in range(4)], account_1.address)
+    assert all(not isinstance(r, dict) for r in results[:2])
+    assert results[2] == {"error": "Something went wrong, try again."}
+    assert results[3] == {"error": "Not sent, a previous transaction failed."}
+    mock_print.assert_called_once_with("fake error")
+    # the unused nonces are read again from the chain
+    create_product("prod_after", account_1.address)
+    assert w3.eth.get_transaction_count(account_1.address) == 3
+
+
+@patch("src.products.print")
+def test_send_transactions_sign_error(
+    mock_print, mock_contract, mock_w3, w3, account_1, monkeypatch
+):
+    monkeypatch.setenv("SIGN_URL", "http://service:5001")
+    with patch.object(get_session(), "post") as mock_post:
+        mock_post.return_value = MockResponse({"error": "A list of transactions"}, 200)
+        ret = create_products(["prod_0", "prod_1"], account_1.address)
+    assert ret == {"error": "Something went wrong, try again."}
+    mock_print.assert_called_once_with("A list of transactions")
+    # the nonces are given back
+    assert products.nonce_manager.allocate(w3, account_1.address) == 0
+
+
+def test_send_transactions_invalid_address(mock_w3):
+    assert send_transactions([MagicMock()], "fake-address") == {"error": "Invalid address"}
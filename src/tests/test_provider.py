@@ -0,0 +1,254 @@
+# stdlib
+import time
+from unittest.mock import patch
+
+# deps
+import pytest
+import requests
+from web3 import Web3
+
+# local
+from src import batch
+from src.connection import build_w3
+from src.metrics import rpc_hedged
+from src.provider import MIN_HEDGE_SAMPLES, Endpoint, MultiEndpointProvider
+from src.sessions import get_session
+from src.tests.fixtures import MockResponse
+
+
+class FakeProvider:
+    def __init__(self, delay=0, error=None, response=None):
+        self.delay = delay
+        self.error = error
+        self.response = response
+        self.methods = []
+
+    def make_request(self, method, params):
+        self.methods.append(method)
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.response or {"jsonrpc": "2.0", "id": 1, "result": self.delay}
+
+    def isConnected(self):
+        return self.error is None
+
+
+def multi_provider(*fakes, **kwargs):
+    provider = MultiEndpointProvider([f"http://node-{i}:8545" for i in range(len(fakes))], **kwargs)
+    for endpoint, fake in zip(provider.endpoints, fakes):
+        endpoint.provider = fake
+    return provider
+
+
+def test_endpoint_averages():
+    endpoint = Endpoint("https://node.example/v3/secret-key", provider=FakeProvider())
+    assert endpoint.name == "node.example"
+    endpoint.observe(0.1, False)
+    endpoint.observe(0.2, False)
+    assert endpoint.latency == pytest.approx(0.12)
+    assert endpoint.p95() is None
+
+    for _ in range(4):
+        endpoint.observe(1, True)
+    assert endpoint.error_rate > 0.5
+    assert not endpoint.healthy
+    endpoint.retry_at = 0
+    # tried again after the cooldown
+    assert endpoint.healthy
+
+
+def test_failures_count_in_the_score():
+    endpoint = Endpoint("http://node-0:8545", provider=FakeProvider())
+    assert endpoint.score() == 0
+    endpoint.observe(2, True)
+    # the time lost is counted, and an endpoint that never answered is tried last
+    assert endpoint.latency == 2
+    assert endpoint.score() == float("inf")
+    endpoint.observe(0.1, False)
+    assert endpoint.score() == pytest.approx(1.62 * 1.16)
+
+
+def test_endpoint_that_never_answered_is_not_first_after_cooldown(capsys):
+    down, up = FakeProvider(error=requests.ConnectionError("refused")), FakeProvider(delay=0.01)
+    provider = multi_provider(down, up)
+    for _ in range(5):
+        provider.make_request("eth_call", [])
+    provider.endpoints[0].retry_at = 0
+    provider.make_request("eth_call", [])
+    assert len(down.methods) == 1
+    assert provider.best() is provider.endpoints[1]
+
+
+def test_routes_to_the_fastest_endpoint():
+    slow, fast = FakeProvider(delay=0.02), FakeProvider()
+    provider = multi_provider(slow, fast)
+    for _ in range(5):
+        provider.make_request("eth_call", [])
+    # each endpoint is tried once, then the fastest gets the requests
+    assert len(slow.methods) == 1
+    assert len(fast.methods) == 4
+    assert provider.endpoint_uri == "http://node-1:8545"
+
+
+@pytest.mark.parametrize(
+    "failing",
+    [
+        FakeProvider(error=requests.ConnectionError("refused")),
+        FakeProvider(response={"jsonrpc": "2.0", "id": 1, "error": {"code": -32005}}),
+    ],
+)
+def test_reads_fail_over(failing, capsys):
+    provider = multi_provider(failing, FakeProvider(delay=0.01))
+    assert provider.make_request("eth_blockNumber", [])["result"] == 0.01
+    assert provider.endpoints[0].error_rate > 0
+    assert "trying the next endpoint" in capsys.readouterr().out
+
+    # the last endpoint error is raised
+    provider = multi_provider(FakeProvider(error=ValueError("down")))
+    with pytest.raises(ValueError):
+        provider.make_request("eth_call", [])
+
+
+def test_pinned_read_behind_endpoint(capsys):
+    missing = {"jsonrpc": "2.0", "id": 1, "error": {"code": -32000, "message": "header not found"}}
+    lagging, synced = FakeProvider(response=missing), FakeProvider(delay=0.01)
+    provider = multi_provider(lagging, synced)
+    assert provider.make_request("eth_call", [{}, "0x10"])["result"] == 0.01
+    assert provider.endpoints[0].error_rate > 0
+
+    # without a synced endpoint the error is answered
+    provider = multi_provider(lagging, FakeProvider(response=missing))
+    assert provider.make_request("eth_call", [{}, "0x10"]) == missing
+
+
+def test_reverted_call_is_an_answer():
+    reverted = {"jsonrpc": "2.0", "id": 1, "error": {"code": 3, "message": "execution reverted"}}
+    provider = multi_provider(FakeProvider(response=reverted), FakeProvider())
+    assert provider.make_request("eth_call", []) == reverted
+    assert provider.endpoints[0].error_rate == 0
+
+
+def test_hedged_read():
+    slow, fast = FakeProvider(delay=0.3), FakeProvider(delay=0.01)
+    provider = multi_provider(slow, fast, hedge=True, hedge_delay=0.05)
+    # the slow endpoint is the best one until it's timed
+    provider.endpoints[1].observe(0.5, False)
+    before = rpc_hedged.value("eth_call")
+
+    started = time.monotonic()
+    assert provider.make_request("eth_call", [])["result"] == 0.01
+    assert time.monotonic() - started < 0.25
+    assert rpc_hedged.value("eth_call") == before + 1
+    # the writes are never hedged
+    provider.make_request("eth_sendRawTransaction", [])
+    assert fast.methods == ["eth_call"]
+
+
+def test_hedge_delay_from_p95():
+    fast, other = FakeProvider(delay=0.01), FakeProvider()
+    provider = multi_provider(fast, other, hedge=True, hedge_delay=5)
+    for _ in range(MIN_HEDGE_SAMPLES):
+        provider.endpoints[0].observe(0.02, False)
+    provider.endpoints[1].observe(1, False)
+    before = rpc_hedged.value("eth_getLogs")
+    fast.delay = 0.2
+
+    started = time.monotonic()
+    provider.make_request("eth_getLogs", [])
+    # hedged after the p95 of the endpoint, not after the default delay
+    assert time.monotonic() - started < 1
+    assert rpc_hedged.value("eth_getLogs") == before + 1
+
+
+def test_sticky_writes():
+    first, second = FakeProvider(), FakeProvider()
+    provider = multi_provider(first, second)
+    provider.make_request("eth_sendRawTransaction", [])
+    # the other endpoint becomes faster, the writes stay
+    provider.endpoints[0].observe(1, False)
+    provider.make_request("eth_getTransactionCount", [])
+    provider.make_request("eth_sendRawTransaction", [])
+    assert first.methods == [
+        "eth_sendRawTransaction",
+        "eth_getTransactionCount",
+        "eth_sendRawTransaction",
+    ]
+
+    # a failed write is not sent again, the next one picks an endpoint again
+    first.error = requests.ConnectionError("refused")
+    with pytest.raises(requests.ConnectionError):
+        provider.make_request("eth_sendRawTransaction", [])
+    assert second.methods == []
+    provider.make_request("eth_sendRawTransaction", [])
+    assert second.methods == ["eth_sendRawTransaction"]
+
+
+def test_build_w3_with_several_endpoints(monkeypatch):
+    monkeypatch.setenv("PROVIDER", "http://node-0:8545, http://node-1:8545")
+    w3 = build_w3()
+    assert isinstance(w3.provider, MultiEndpointProvider)
+    assert [endpoint.uri for endpoint in w3.provider.endpoints] == [
+        "http://node-0:8545",
+        "http://node-1:8545",
+    ]
+    assert batch.batching_enabled(w3)
+
+    monkeypatch.setenv("PROVIDER", "http://node-0:8545")
+    assert not isinstance(build_w3().provider, MultiEndpointProvider)
+
+
+def test_web3_through_multi_provider():
+    provider = multi_provider(
+        FakeProvider(response={"jsonrpc": "2.0", "id": 1, "result": "0x10"}),
+        FakeProvider(error=requests.ConnectionError("refused")),
+    )
+    assert Web3(provider).eth.block_number == 16
+
+
+@pytest.fixture
+def clear_unsupported_endpoints(monkeypatch):
+    monkeypatch.setattr("src.batch._unsupported_endpoints", set())
+    monkeypatch.setattr("src.batch._batch_limits", {})
+
+
+def test_batches_fail_over(clear_unsupported_endpoints, capsys):
+    provider = MultiEndpointProvider(["http://node-0:8545", "http://node-1:8545"])
+    # the first endpoint is the best one until it fails
+    provider.endpoints[1].observe(0.5, False)
+    calls = [("eth_blockNumber", []), ("eth_chainId", [])]
+
+    def post(uri, json, **kwargs):
+        if uri == "http://node-0:8545":
+            raise requests.ConnectionError("refused")
+        return MockResponse([{"id": item["id"], "result": "0x1"} for item in json], 200)
+
+    with patch.object(get_session(), "post", side_effect=post):
+        assert batch._send_batch(provider, calls) == [
+            {"id": 0, "result": "0x1"},
+            {"id": 1, "result": "0x1"},
+        ]
+    assert provider.endpoints[0].error_rate > 0
+    assert len(provider.endpoints[1].latencies) == 2
+    assert "batch failed on node-0:8545" in capsys.readouterr().out
+
+
+def test_batch_refused_by_one_endpoint(clear_unsupported_endpoints, capsys):
+    provider = MultiEndpointProvider(["http://node-0:8545", "http://node-1:8545"])
+    provider.endpoints[1].observe(0.5, False)
+
+    def post(uri, json, **kwargs):
+        if uri == "http://node-0:8545":
+            return MockResponse({"error": "batch requests not supported"}, 200)
+        return MockResponse([{"id": item["id"], "result": "0x1"} for item in json], 200)
+
+    with patch.object(get_session(), "post", side_effect=post) as mock_post:
+        batch._send_batch(provider, [("eth_blockNumber", [])])
+        batch._send_batch(provider, [("eth_blockNumber", [])])
+    # the endpoint refusing the batches is not asked again
+    assert [c.args[0] for c in mock_post.call_args_list] == [
+        "http://node-0:8545",
+        "http://node-1:8545",
+        "http://node-1:8545",
+    ]
+    assert batch.batching_enabled(Web3(provider))
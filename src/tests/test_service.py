@@ -1,63 +1,54 @@
 # stdlib
 import json
-import os
 from unittest.mock import patch
 
 # deps
-from eth_account.datastructures import SignedTransaction
-from hexbytes import HexBytes
+import pytest
+from eth_account import Account
 
 # local
-from service import app
+from service import app, get_pool, get_signer
+from src.metrics import signings
+from src.tests.fixtures import *
 
 
 client = app.test_client()
 
+TX = {
+    "value": 0,
+    "chainId": 1337,
+    "gas": 210000,
+    "gasPrice": 20000000000,
+    "nonce": 1,
+    "to": "0x%040d" % 123,
+    "data": "0x02ec06be",
+}
+
+
+@pytest.fixture(autouse=True)
+def sign_in_process(monkeypatch):
+    monkeypatch.setattr("service.SIGN_WORKERS", 0)
+
+
+@pytest.fixture
+def account(monkeypatch, w3):
+    account = w3.eth.account.create()
+    monkeypatch.setenv("KEY", account.key.hex(), prepend=False)
+    return account
 
-@patch("service.w3.eth.account.sign_transaction")
-def test_api_sign_tx(mock_sign, monkeypatch):
-    monkeypatch.setenv("KEY", "fake-key", prepend=False)
-    mock_sign.return_value = SignedTransaction(
-        rawTransaction=HexBytes(
-            "0xf8cc808504a817c8008303345094600757547255aa29430612d3155dde9a0bb"
-        ),
-        hash=HexBytes("0xf541db9896ba7b557b8635b4880556ddfe"),
-        r=5807941984468536703127644958600620555,
-        s=3850855411775802047747259,
-        v=2710,
-    )
-    json_data = (
-        json.dumps(
-            {
-                "value": 0,
-                "chainId": 1337,
-                "from": "0x%040d" % 321,
-                "gas": 210000,
-                "gasPrice": 20000000000,
-                "nonce": 1,
-                "to": "0x%040d" % 123,
-                "data": "0x02ec06be00000000000",
-            }
-        ),
-    )
 
-    response = client.get("/", json=json_data[0])
-    mock_sign.assert_called_once_with(json.loads(json_data[0]), os.environ["KEY"])
+def test_api_sign_tx(account, w3):
+    response = client.get("/", json=json.dumps(TX))
     assert response.status_code == 200
-    json_response = response.get_json()
-    assert "rawTransaction" in json_response
-    assert "hash" in json_response
-    assert "r" in json_response
-    assert "s" in json_response
-    assert "v" in json_response
-    assert (
-        json_response["rawTransaction"]
-        == HexBytes("0xf8cc808504a817c8008303345094600757547255aa29430612d3155dde9a0bb").hex()
-    )
-    assert json_response["hash"] == HexBytes("0xf541db9896ba7b557b8635b4880556ddfe").hex()
-    assert json_response["r"] == 5807941984468536703127644958600620555
-    assert json_response["s"] == 3850855411775802047747259
-    assert json_response["v"] == 2710
+    signed = w3.eth.account.sign_transaction(TX, account.key)
+    assert response.get_json() == {
+        "rawTransaction": signed.rawTransaction.hex(),
+        "hash": signed.hash.hex(),
+        "r": signed.r,
+        "s": signed.s,
+        "v": signed.v,
+    }
+    assert response.headers["Server-Timing"].startswith("sign;dur=")
 
 
 def test_api_sign_tx_no_tx():
@@ -66,24 +57,78 @@ def test_api_sign_tx_no_tx():
     assert response.get_json()["error"] == "A transaction must be provided"
 
 
-@patch("service.w3.eth.account.sign_transaction")
-def test_api_sign_tx_error(mock_sign, monkeypatch):
+def test_api_sign_tx_error(account):
+    response = client.get("/", json=json.dumps(dict(TX, nonce="invalid")))
+    assert "error" in response.get_json()
+
+
+def test_api_sign_tx_invalid_key(monkeypatch):
     monkeypatch.setenv("KEY", "fake-key", prepend=False)
-    json_data = (
-        json.dumps(
-            {
-                "value": 0,
-                "chainId": 1337,
-                "from": "0x%040d" % 321,
-                "gas": 210000,
-                "gasPrice": 20000000000,
-                "nonce": 1,
-                "to": "0x%040d" % 123,
-                "data": "0x02ec06be00000000000",
-            }
-        ),
-    )
-    mock_sign.side_effect = Exception("fake error")
-    response = client.get("/", json=json_data[0])
+    response = client.get("/", json={"nonce": 1})
     assert "error" in response.get_json()
-    assert response.get_json()["error"] == "fake error"
+
+
+def test_api_sign_tx_from(account, w3):
+    response = client.get("/", json=dict(TX, **{"from": account.address.lower()}))
+    assert (
+        response.get_json()["hash"] == w3.eth.account.sign_transaction(TX, account.key).hash.hex()
+    )
+
+    response = client.get("/", json=dict(TX, **{"from": "0x%040d" % 321}))
+    assert response.get_json()["error"].startswith("from field must match key's")
+
+
+def test_account_derived_once(account):
+    with patch("service.Account.from_key", wraps=Account.from_key) as mock_from_key:
+        get_signer.cache_clear()
+        for nonce in range(3):
+            client.get("/", json=dict(TX, nonce=nonce))
+        client.post("/batch", json=[TX, TX])
+    mock_from_key.assert_called_once_with(account.key.hex())
+
+
+def test_sign_in_process_pool(monkeypatch, account, w3):
+    monkeypatch.setattr("service.SIGN_WORKERS", 2)
+    txs = [dict(TX, nonce=nonce) for nonce in range(5)] + [{"nonce": "invalid"}]
+    before = signings.value("batch", "ok")
+    try:
+        response = client.post("/batch", json=txs)
+    finally:
+        get_pool(account.key.hex(), 2).shutdown()
+        get_pool.cache_clear()
+    results = response.get_json()["results"]
+    assert [result["hash"] for result in results[:5]] == [
+        w3.eth.account.sign_transaction(tx, account.key).hash.hex() for tx in txs[:5]
+    ]
+    assert "error" in results[5]
+    assert signings.value("batch", "ok") == before + 1
+
+
+def test_api_sign_batch(monkeypatch, w3):
+    account = w3.eth.account.create()
+    monkeypatch.setenv("KEY", account.key.hex(), prepend=False)
+    tx = {
+        "value": 0,
+        "chainId": 1337,
+        "gas": 210000,
+        "gasPrice": 20000000000,
+        "to": "0x%040d" % 123,
+        "data": "0x02ec06be",
+    }
+    txs = [dict(tx, nonce=0), {"nonce": "invalid"}, dict(tx, nonce=1)]
+    response = client.post("/batch", json=txs)
+    results = response.get_json()["results"]
+
+    assert len(results) == 3
+    assert results[0]["rawTransaction"] == (
+        w3.eth.account.sign_transaction(txs[0], account.key).rawTransaction.hex()
+    )
+    assert "error" in results[1]
+    assert results[2]["hash"] == w3.eth.account.sign_transaction(txs[2], account.key).hash.hex()
+
+
+def test_api_sign_batch_no_txs():
+    response = client.post("/batch", json=[])
+    assert response.get_json() == {"error": "A list of transactions must be provided"}
+    response = client.post("/batch", json={"nonce": 1})
+    assert response.get_json() == {"error": "A list of transactions must be provided"}
@@ -0,0 +1,28 @@
+# deps
+from web3._utils.request import _get_session
+
+# local
+from src.connection import w3
+from src.sessions import build_session, get_session
+
+
+def test_build_session():
+    session = build_session(pool_size=5, retries=2, backoff=0.1)
+    adapter = session.get_adapter("https://matic-mumbai.chainstacklabs.com")
+    assert adapter._pool_maxsize == 5
+    assert adapter.max_retries.total == 2
+    assert adapter.max_retries.backoff_factor == 0.1
+    assert 429 in adapter.max_retries.status_forcelist
+    # the sent transactions are not sent again on an unavailable response
+    assert not adapter.max_retries.is_retry("POST", 503)
+    assert adapter.max_retries.is_retry("GET", 503)
+    assert session.get_adapter("http://service:5001") is adapter
+
+
+def test_get_session_is_shared():
+    assert get_session() is get_session()
+
+
+def test_provider_uses_shared_session():
+    assert w3.provider._request_kwargs["timeout"] > 0
+    assert _get_session(w3.provider.endpoint_uri) is get_session()
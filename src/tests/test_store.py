@@ -0,0 +1,121 @@
+# stdlib
+from unittest.mock import patch
+
+# deps
+import pytest
+
+# local
+from src.index import ZERO_ADDRESS
+from src.models import Product
+from src.products import get_product_by_name, get_products
+from src.store import ProductStore
+from src.tests.fixtures import *
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "products.db")
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_sync_matches_contract(
+    store_path, product_contract, account_1, account_2, new_product, sign_and_send
+):
+    store = ProductStore(store_path)
+    assert not store.ready
+    assert store.sync(product_contract) == 2
+    assert store.ready
+
+    sign_and_send(product_contract.functions.delegateProduct(0, account_2.address), account_1)
+    sign_and_send(product_contract.functions.delegateProduct(1, account_2.address), account_1)
+    sign_and_send(product_contract.functions.acceptProduct(1), account_2)
+    assert store.sync(product_contract) == 3
+
+    assert store.size() == 2
+    for i, product in store.products():
+        on_chain = product_contract.functions.products(i).call()
+        assert product.to_dict() == Product(*on_chain).to_dict()
+    assert [transfer[:3] for transfer in store.transfers(1)] == [
+        ("NewProduct", ZERO_ADDRESS, account_1.address),
+        ("DelegateProduct", account_1.address, account_2.address),
+        ("AcceptProduct", account_1.address, account_2.address),
+    ]
+    assert store.db.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 5
+    assert store.sync(product_contract) == 0
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_survives_restart(
+    store_path, product_contract, account_1, account_2, new_product, sign_and_send
+):
+    store = ProductStore(store_path)
+    store.sync(product_contract)
+    version = store.version
+
+    restarted = ProductStore(store_path)
+    assert restarted.get(0).name == "new_prod_0"
+    assert restarted.version == version
+    # the reads go to the contract until this process syncs the store
+    assert not restarted.ready
+
+    # only the new blocks are replayed
+    sign_and_send(product_contract.functions.delegateProduct(0, account_2.address), account_1)
+    assert restarted.sync(product_contract) == 1
+    assert restarted.ready
+    assert restarted.get(0).new_owner == account_2.address
+    assert restarted.last_block == product_contract.web3.eth.block_number
+
+
+@pytest.mark.parametrize("new_product", [2], indirect=True)
+def test_resume_interrupted_sync(store_path, product_contract, account_1, new_product):
+    store = ProductStore(store_path)
+    store.sync(product_contract)
+    # stopped after applying the events of a range, before the end of the sync
+    store.last_block = None
+    with store.db:
+        store.db.execute("DELETE FROM meta WHERE key = 'last_block'")
+
+    restarted = ProductStore(store_path)
+    assert not restarted.ready
+    assert restarted.sync(product_contract) == 0
+    assert restarted.ready
+    assert restarted.size() == 2
+    assert len(restarted.transfers(1)) == 1
+
+
+def test_find(store_path):
+    store = ProductStore(store_path)
+    owner_1, owner_2 = "0x%040d" % 1, "0x%040d" % 2
+    store.put(0, Product("prod", 0, owner_1, ZERO_ADDRESS))
+    store.put(1, Product("prod", 1, owner_1, owner_2))
+    store.put(2, Product("other", 1, owner_2, owner_1))
+
+    assert [i for i, _ in store.find(name="prod")] == [0, 1]
+    assert [i for i, _ in store.find(status=1)] == [1, 2]
+    assert [i for i, _ in store.find(owner=owner_1.upper(), status=1)] == [1]
+    assert [i for i, _ in store.find(new_owner=owner_1)] == [2]
+    assert store.find(name="missing") == []
+    assert sorted(store.get_range(1, 5)) == [1, 2]
+
+    store.put(1, Product("renamed", 0, owner_2, ZERO_ADDRESS))
+    assert [i for i, _ in store.find(name="prod")] == [0]
+    assert [i for i, _ in store.find(owner=owner_2)] == [1, 2]
+
+    store.reset()
+    assert store.size() == 0
+    assert not ProductStore(store_path).ready
+
+
+@pytest.mark.parametrize("new_product", [3], indirect=True)
+def test_reads_from_store(
+    store_path, monkeypatch, product_contract, mock_contract, mock_w3, new_product
+):
+    store = ProductStore(store_path)
+    monkeypatch.setattr("src.products.product_index", store)
+    store.sync(product_contract)
+
+    with patch.object(product_contract.functions, "products") as mock_products:
+        products = get_products()
+        assert get_product_by_name("new_prod_1")[0]["name"] == "new_prod_1"
+    mock_products.assert_not_called()
+    assert [p["name"] for p in products] == ["new_prod_0", "new_prod_1", "new_prod_2"]
@@ -0,0 +1,117 @@
+# stdlib
+from unittest.mock import MagicMock, patch
+
+# deps
+import pytest
+from web3 import exceptions as web3Exceptions
+
+# local
+from src import products
+from src.submitter import (
+    CONFIRMED,
+    FAILED,
+    MINED,
+    PENDING,
+    QUEUED,
+    TransactionSubmitter,
+)
+from src.tests.fixtures import *
+
+
+@pytest.fixture
+def submitter():
+    return TransactionSubmitter(min_confirmations=0)
+
+
+def test_submit_batches_by_sender(
+    submitter, mock_batch_request, product_contract, mock_contract, mock_w3, account_1
+):
+    jobs = [submitter.create_product(f"prod_{i}", account_1.address) for i in range(3)]
+    assert [job.status for job in jobs] == [QUEUED] * 3
+    assert submitter.get(jobs[0].id) is jobs[0]
+
+    with patch.object(get_session(), "post", wraps=get_session().post) as mock_post:
+        submitter.send_batch(submitter._next_batch())
+    mock_post.assert_called_once()
+    assert [job.status for job in jobs] == [PENDING] * 3
+    assert submitter.get(jobs[2].transaction_hash.upper()) is jobs[2]
+
+    submitter.track_receipts()
+    assert [job.status for job in jobs] == [CONFIRMED] * 3
+    assert product_contract.functions.size().call() == 3
+
+
+def test_failed_transaction_doesnt_fail_the_batch(
+    submitter, mock_batch_request, product_contract, mock_contract, mock_w3, account_1
+):
+    invalid = MagicMock()
+    invalid.buildTransaction.side_effect = web3Exceptions.InvalidAddress
+    failing = submitter.submit(invalid, account_1.address)
+    job = submitter.create_product("prod_0", account_1.address)
+    submitter.send_batch(submitter._next_batch())
+
+    assert failing.status == FAILED
+    assert failing.error == "Invalid address"
+    assert job.status == PENDING
+
+
+def test_confirmations(
+    submitter, mock_batch_request, product_contract, mock_contract, mock_w3, w3, account_1
+):
+    submitter.min_confirmations = 2
+    job = submitter.create_product("prod_0", account_1.address)
+    submitter.send_batch(submitter._next_batch())
+    submitter.track_receipts()
+    assert job.status == MINED
+    assert job.block_number == w3.eth.block_number
+
+    w3.provider.ethereum_tester.mine_blocks(2)
+    submitter.track_receipts()
+    assert job.status == CONFIRMED
+
+
+@patch("src.fees.print")
+def test_reverted_transaction(
+    mock_print, submitter, mock_batch_request, product_contract, mock_contract, mock_w3, account_1
+):
+    # the product doesn't exist
+    job = submitter.accept_product(5, account_1.address)
+    submitter.send_batch(submitter._next_batch())
+    assert job.status == PENDING
+    submitter.track_receipts()
+    assert job.status == FAILED
+    assert job.to_dict()["error"] == "Transaction reverted."
+
+
+def test_history_size(submitter):
+    submitter.history_size = 2
+    jobs = [submitter.submit(object(), "0x%040d" % 1) for _ in range(3)]
+    # the queued jobs are kept
+    assert submitter.get(jobs[0].id) is jobs[0]
+
+    submitter._set_status(jobs[0], FAILED)
+    submitter.submit(object(), "0x%040d" % 1)
+    assert submitter.get(jobs[0].id) is None
+    assert submitter.get(jobs[1].id) is jobs[1]
+
+    # a finished job is forgotten even after an unfinished one
+    submitter._set_status(jobs[2], CONFIRMED)
+    submitter.submit(object(), "0x%040d" % 1)
+    assert submitter.get(jobs[2].id) is None
+    assert submitter.get(jobs[1].id) is jobs[1]
+
+
+@patch("src.submitter.get_transaction_receipts")
+def test_receipts_read_in_a_batch(mock_receipts, submitter, monkeypatch):
+    monkeypatch.setattr("src.products.w3", MagicMock())
+    products.w3.eth.block_number = 10
+    mock_receipts.return_value = [None, {"blockNumber": 10, "status": 1}]
+    jobs = [submitter.submit(object(), "0x%040d" % 1) for _ in range(2)]
+    for i, job in enumerate(jobs):
+        job.transaction_hash = f"0x0{i}"
+        submitter._hashes[job.transaction_hash] = job
+        submitter._set_status(job, PENDING)
+
+    submitter.track_receipts()
+    mock_receipts.assert_called_once_with(products.w3, ["0x00", "0x01"])
+    assert [job.status for job in jobs] == [PENDING, CONFIRMED]